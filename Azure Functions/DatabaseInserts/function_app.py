@@ -1,14 +1,48 @@
 """
 This file contains the code for the Azure Function App that is triggered events reaching the Event Hub.
 The function app is responsible for inserting data into the MySQL database in the respective tables.
+An event holds one JSON record, or many records as a zstd compressed Arrow IPC stream when sensor.py
+runs with --encoding arrow-zstd (given by the content_type property of the event).
+
+The functions receive the events in batches (cardinality many): the records of a batch are validated
+against the fields of their table, and the valid ones are inserted with a single executemany in one
+transaction, over one connection per batch instead of one per event.
+When the insert of a batch fails on a constraint (e.g. an unknown user_id), the batch is split in half
+recursively to isolate the rows at fault, and the other rows are committed. The rejected records
+(undecodable, invalid or refused by the database) are written to the insert_quarantine table with the reason.
+Any other error of the database (e.g. a lost connection) fails the invocation, so the batch is not checkpointed
+and is delivered again by the retry policy of the functions.
+
+The connections come from a pool kept by the worker across invocations, so the connection (and its SSL
+handshake) is set up once per pooled connection rather than once per batch. A connection is pinged when it
+is taken from the pool and reconnected if it went stale. The size of the pool is the pool_size setting.
+
+Event Hub delivers at least once, so a batch can be delivered again (e.g. after a restart of the worker).
+Each row carries the partition, the sequence number and the position in its event of its record, under a unique
+key, and the inserts skip the rows already inserted (ON DUPLICATE KEY UPDATE without change, so the other errors
+still isolate the rows at fault, where INSERT IGNORE would hide them). The worker also remembers the events it
+inserted recently (dedup_cache_size setting), and skips them without decoding them when they come again.
+
+The alerts of the abnormal readings are created by the check_glucose_after_insert trigger of the database,
+one lookup per reading inside the insert, unless the alert_mode setting is 'batch' (and the trigger is dropped
+with set_trigger.py --drop). The alerts are then created after each batch insert: the new readings of the batch
+are compared with the thresholds and subscribers of the users, cached by the worker for alert_cache_ttl seconds,
+and the alerts are inserted with one statement.
 """
 
 import azure.functions as func
+import collections
 import logging
+import math
 import mysql.connector
+import mysql.connector.pooling
+import io
 import json
 import os
+import threading
+import time
 from datetime import datetime
+from typing import List
 
 app = func.FunctionApp()
 
@@ -17,137 +51,525 @@ host=os.getenv('host')
 user=os.getenv('user')
 password=os.getenv('password')
 database=os.getenv('database')
+pool_size=int(os.getenv('pool_size', 5))
+dedup_cache_size=int(os.getenv('dedup_cache_size', 100000))
+alert_mode=os.getenv('alert_mode', 'trigger')
+alert_cache_ttl=float(os.getenv('alert_cache_ttl', 300))
+
+# The pool of connections of the worker, created at the first invocation and reused by the next ones
+connection_pool = None
+# The two functions can run concurrently in the worker, only one of them creates the pool
+connection_pool_lock = threading.Lock()
+
+
+# Function helper to create the pool of connections
+def get_connection_pool():
+    global connection_pool
+    if connection_pool is not None:
+        return connection_pool
+    with connection_pool_lock:
+        if connection_pool is None:
+            connection_pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="database_inserts",
+                pool_size=pool_size,
+                # The session is not reset when a connection is given back, the inserts do not change it
+                pool_reset_session=False,
+                host=host,
+                user=user,
+                password=password,
+                database=database,
+                port=3306
+            )
+            logging.info(f"Created a pool of {pool_size} connections to the database")
+    return connection_pool
 
 
 # Function helper to connect to the database
 def get_db_connection():
+    """
+    Takes a connection from the pool, reconnecting it if it went stale. Closing the connection gives it back
+    to the pool. When all the connections of the pool are in use, a connection outside the pool is opened.
+
+    Returns:
+        The connection, None if the database cannot be reached.
+    """
     try:
-        connection = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database,
-            port=3306  
-        )
-        logging.info("Successfully connected to the database")
+        try:
+            connection = get_connection_pool().get_connection()
+        except mysql.connector.errors.PoolError:
+            logging.warning("All the pooled connections are in use, opening a new connection")
+            return mysql.connector.connect(
+                host=host,
+                user=user,
+                password=password,
+                database=database,
+                port=3306
+            )
+        # Health check of the pooled connection, the server may have closed it while it was idle
+        connection.ping(reconnect=True, attempts=3, delay=1)
         return connection
     except mysql.connector.Error as error:
         logging.error(f"Failed to connect to database: {error}")
         return None
 
-@app.function_name(name="glucose_readings_table_insert")
-@app.event_hub_message_trigger(arg_name="azeventhub", event_hub_name="raw_glucose_readings",
-                               connection="EventHubConnectionString",
-                               consumer_group="mysql_glucose_reading_table"
-                               ) 
-def glucose_readings_table_insert(azeventhub: func.EventHubEvent):
-    logging.info('Python EventHub trigger processed an event: %s', azeventhub.get_body().decode('utf-8'))
+ARROW_ZSTD_CONTENT_TYPE = "application/vnd.apache.arrow.stream+zstd"
 
-    # Connect to MySQL database
-    connection = get_db_connection()
-    if not connection:
-        return
+# The fields of the records of each table in the order of the columns, with the expected type of their values
+glucose_reading_fields = {
+    "user_id": int,
+    "device_id": int,
+    "glucose_reading": float,
+    "timestamp": datetime,
+    "latitude": float,
+    "longitude": float,
+}
+device_feed_fields = {
+    "device_id": int,
+    "battery_level": int,
+    "firmware_version": str,
+    "connection_status": str,
+    "error_code": str,
+    "timestamp": datetime,
+}
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+quarantine_stmt = "INSERT INTO insert_quarantine (table_name, record, reason) VALUES (%s, %s, %s)"
+
+
+class RecentEvents:
+    """
+    The (partition, sequence number) of the events recently inserted by the worker, the least recently seen
+    forgotten first. Shared by the invocations of the worker, which may run in parallel threads.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+            return False
+
+    def add_all(self, keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+
+# The events recently inserted in each table
+recent_events = {
+    "glucose_reading": RecentEvents(dedup_cache_size),
+    "device_feed": RecentEvents(dedup_cache_size),
+}
+
+
+class AlertRules:
+    """
+    The glucose thresholds and the subscribers of each user, read from the database and reloaded once they
+    are older than ttl seconds. Shared by the invocations of the worker.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.thresholds = {}
+        self.subscribers = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
 
+    def refresh(self, connection):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT user_id, min_glucose, max_glucose FROM medical_info")
+                thresholds = {user_id: (min_glucose, max_glucose) for user_id, min_glucose, max_glucose in cursor.fetchall()}
+                cursor.execute("SELECT user_id, subscriber_id FROM user_subscriber")
+                subscribers = {}
+                for user_id, subscriber_id in cursor.fetchall():
+                    subscribers.setdefault(user_id, []).append(subscriber_id)
+            finally:
+                cursor.close()
+            self.thresholds, self.subscribers = thresholds, subscribers
+            self._loaded_at = time.monotonic()
+            logging.info(f"Loaded the alert thresholds of {len(thresholds)} users")
+
+alert_rules = AlertRules(alert_cache_ttl)
+
+# The readings of a batch without an alert yet, found by their event key
+new_readings_query = (
+    "SELECT g.reading_id, g.user_id, g.glucose_level FROM glucose_reading g "
+    "LEFT JOIN alert a ON a.reading_id = g.reading_id "
+    "WHERE g.event_partition = %s AND g.event_sequence BETWEEN %s AND %s AND a.alert_id IS NULL"
+)
+# The alerts are timestamped by the database clock, like the ones of the trigger
+alert_stmt = (
+    "INSERT INTO alert (reading_id, user_id, subscribers_informed, created_at, alert_type, status) "
+    "VALUES (%s, %s, %s, NOW(), %s, %s)"
+)
+
+# Function helper to decode the records of an event
+def decode_records(azeventhub, properties=None):
+    """
+    Decodes the records of an event, one JSON record or an Arrow IPC stream of records.
+
+    Args:
+        azeventhub (func.EventHubEvent): The event.
+        properties (dict, optional): The properties of the event, taken from its metadata if not given.
+
+    Returns:
+        list: The records of the event, as dictionaries.
+    """
+    if properties is None:
+        properties = (azeventhub.metadata or {}).get("Properties") or {}
+    body = azeventhub.get_body()
+    if properties.get("content_type") == ARROW_ZSTD_CONTENT_TYPE:
+        # pyarrow is only needed for the events packed by sensor.py
+        import pyarrow.ipc
+        with pyarrow.ipc.open_stream(io.BytesIO(body)) as reader:
+            return reader.read_all().to_pylist()
+    return [json.loads(body.decode('utf-8'))]
+
+# Function helper to decode the records of a batch of events
+def decode_batch(azeventhubs, recent=None):
+    """
+    Decodes the records of a batch of events. The events that cannot be decoded are rejected,
+    and the events recently inserted are skipped.
+
+    Args:
+        azeventhubs (list): The events of the batch (func.EventHubEvent).
+        recent (RecentEvents, optional): The events recently inserted in the table. Defaults to None.
+
+    Returns:
+        tuple: The (record, key) of the records of the events, the (body, reason) of the rejected events,
+        and the (partition, sequence number) of the events decoded with a partition. The key of a record is its partition,
+        its sequence number and its position in its event.
+    """
+    # With cardinality many, every event holds the metadata of the whole batch, with the properties of each event
+    metadata = (azeventhubs[0].metadata or {}) if azeventhubs else {}
+    properties_array = metadata.get("PropertiesArray") or []
+    system_properties_array = metadata.get("SystemPropertiesArray") or []
+    partition_id = (metadata.get("PartitionContext") or {}).get("PartitionId")
+    if azeventhubs and partition_id is None:
+        logging.warning(
+            f"The batch of {len(azeventhubs)} events has no PartitionContext: its records are inserted "
+            "without an event key, so they are not deduplicated and not alerted in batch mode"
+        )
+
+    records = []
+    rejected = []
+    event_keys = []
+    skipped = 0
+    for index, azeventhub in enumerate(azeventhubs):
+        sequence_number = azeventhub.sequence_number
+        if sequence_number is None and index < len(system_properties_array):
+            sequence_number = system_properties_array[index].get("SequenceNumber")
+        event_key = (partition_id, sequence_number)
+        # Without its partition, a sequence number does not identify an event across partitions
+        keyed = partition_id is not None and sequence_number is not None
+        if keyed and recent is not None and event_key in recent:
+            skipped += 1
+            continue
+
+        properties = properties_array[index] if index < len(properties_array) else None
+        try:
+            event_records = decode_records(azeventhub, properties or {})
+        except (ValueError, ImportError) as error:
+            logging.error(f"Error decoding event {index} of the batch: {error}")
+            rejected.append((azeventhub.get_body().decode('utf-8', errors='replace'), f"undecodable event: {error}"))
+            continue
+        records.extend(
+            (record, (partition_id, sequence_number, position)) for position, record in enumerate(event_records)
+        )
+        if keyed:
+            event_keys.append(event_key)
+
+    if skipped:
+        logging.info(f"{skipped} events already inserted skipped")
+    return records, rejected, event_keys
+
+# Function helper to check a value against the type of its field
+def is_valid_value(value, field_type):
+    if field_type is datetime:
+        try:
+            datetime.strptime(value, TIMESTAMP_FORMAT)
+            return True
+        except (TypeError, ValueError):
+            return False
+    if isinstance(value, bool):
+        return False
+    if field_type is float:
+        # json.loads accepts NaN and Infinity, which the database refuses
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, field_type)
+
+# Function helper to find why a record is invalid
+def record_error(record, fields):
+    """
+    Returns why a record cannot be inserted, None if it is valid.
+    """
+    if not isinstance(record, dict):
+        return "not a JSON object"
+    for field, field_type in fields.items():
+        if field not in record:
+            return f"missing field {field}"
+        if not is_valid_value(record[field], field_type):
+            return f"invalid {field}: {record[field]!r}"
+    return None
+
+# Function helper to validate the records of a batch
+def validate_records(records, fields):
+    """
+    Converts the records of a batch to the rows of their table, rejecting the records with a missing field
+    or a value of the wrong type.
+
+    Args:
+        records (list): The (record, key) of the records of the batch, as returned by decode_batch.
+        fields (dict): The fields of the table in the order of its columns, with the type of their values.
+
+    Returns:
+        tuple: The rows of the valid records, their key last, and the (record, reason) of the invalid records.
+    """
+    rows = []
+    rejected = []
+    for record, key in records:
+        error = record_error(record, fields)
+        if error is None:
+            rows.append(tuple(record[field] for field in fields) + key)
+        else:
+            rejected.append((record, error))
+    if rejected:
+        logging.warning(f"{len(rejected)} invalid records rejected, first one: {rejected[0][1]}")
+    return rows, rejected
+
+# Function helper to insert rows, isolating the rows refused by the database
+def insert_or_split(connection, insert_stmt, rows):
+    """
+    Inserts rows in one transaction. If the database refuses them (constraint, invalid data or any other error
+    caused by the rows), the rows are split in half and each half is inserted on its own, recursively, until the
+    rows at fault are isolated. The operational errors (lost connection, timeout) are raised, as they are not
+    caused by the rows.
+
+    Args:
+        connection: The connection to the database.
+        insert_stmt (str): The INSERT statement, with one %s per column.
+        rows (list): The rows to insert.
+
+    Returns:
+        list: The (row, reason) of the rows refused by the database.
+
+    Raises:
+        mysql.connector.OperationalError: If the database fails otherwise than by refusing rows.
+    """
     cursor = connection.cursor()
-  
-    # Parse the message
     try:
-        message = json.loads(azeventhub.get_body().decode('utf-8'))
-    except json.JSONDecodeError as error:
-        logging.error(f"Error decoding JSON: {error}")
-        return
-
-    # timestamp = datetime.utcfromtimestamp(message["timestamp"]).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.executemany(insert_stmt, rows)
+        connection.commit()
+        return []
+    except mysql.connector.OperationalError:
+        raise
+    except mysql.connector.DatabaseError as error:
+        connection.rollback()
+        if len(rows) == 1:
+            return [(rows[0], str(error))]
+    finally:
+        cursor.close()
 
+    middle = len(rows) // 2
+    return insert_or_split(connection, insert_stmt, rows[:middle]) + insert_or_split(connection, insert_stmt, rows[middle:])
 
-    insert_stmt = (
-        "INSERT INTO glucose_reading (user_id, device_id, glucose_level, timestamp, latitude, longitude) "
-        "VALUES (%s, %s, %s, %s, %s, %s)"
-    )
-    data = (
-        message["user_id"],
-        message["device_id"],
-        message["glucose_reading"],
-        message["timestamp"],
-        message["latitude"],
-        message["longitude"]
-    )
+# Function helper to write the rejected records to the quarantine table
+def quarantine(connection, table_name, rejected):
+    """
+    Writes the rejected records of a table to the insert_quarantine table, with the reason of their rejection.
+    The rows of the batch are already inserted, so if the quarantine fails the records are logged and dropped
+    rather than failing the invocation, which would deliver the whole batch again for as long as it fails.
 
-    # Inserting data into the database
+    Args:
+        connection: The connection to the database.
+        table_name (str): The table the records were meant for.
+        rejected (list): The (record, reason) of the rejected records.
+    """
+    cursor = connection.cursor()
     try:
-        cursor.execute(insert_stmt, data)
+        cursor.executemany(
+            quarantine_stmt,
+            [(table_name, json.dumps(record, default=str), reason) for record, reason in rejected]
+        )
         connection.commit()
-        logging.info("1 row inserted successfully")
+        logging.warning(f"{len(rejected)} records of {table_name} quarantined")
     except mysql.connector.Error as error:
-        logging.error(f"Failed to insert row: {error}")
-        connection.rollback()
+        logging.error(f"Failed to quarantine {len(rejected)} records of {table_name}, dropping them: {error}")
+        for record, reason in rejected:
+            logging.error(f"Dropped record of {table_name} ({reason}): {json.dumps(record, default=str)}")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            # The connection itself may be lost
+            pass
     finally:
         cursor.close()
-        connection.close()
-        print("MySQL connection is closed")
 
+# Function helper to create the alerts of the abnormal readings of a batch, replacing the trigger
+def insert_alerts(connection, rows):
+    """
+    Creates the alerts of the readings of a batch that are out of the thresholds of their user, like the
+    check_glucose_after_insert trigger but for the whole batch: one query finds the readings of the batch without
+    an alert (so a batch delivered again is not alerted twice), and one statement inserts their alerts.
 
-@app.function_name(name="device_feed_table_insert")
-@app.event_hub_message_trigger(arg_name="azeventhub", event_hub_name="raw_device_feeds",
-                               connection="EventHubConnectionString",
-                               consumer_group="mysql_device_feed_table") 
-def device_feed_table_insert(azeventhub: func.EventHubEvent):
-    logging.info('Python EventHub trigger processed an event: %s', azeventhub.get_body().decode('utf-8'))
+    Args:
+        connection: The connection to the database.
+        rows (list): The rows of the batch, their event key last.
 
-    # Connect to MySQL database
-    connection = get_db_connection()
-    if not connection:
-        return
+    Returns:
+        int: The number of alerts created.
+    """
+    # The events of a batch all come from one partition, in order of sequence number
+    sequence_numbers = [row[-2] for row in rows if row[-3] is not None and row[-2] is not None]
+    if len(sequence_numbers) < len(rows):
+        logging.warning(f"{len(rows) - len(sequence_numbers)} readings without an event key are not alerted")
+    if not sequence_numbers:
+        return 0
+    partition_id = rows[0][-3]
 
+    alert_rules.refresh(connection)
     cursor = connection.cursor()
-
-    # Parse the message
     try:
-        message = json.loads(azeventhub.get_body().decode('utf-8'))
-        logging.info(f"Message parsed successfully: {message}")
-    except json.JSONDecodeError as error:
-        logging.error(f"Error decoding JSON: {error}")
+        cursor.execute(new_readings_query, (partition_id, min(sequence_numbers), max(sequence_numbers)))
+        alerts = []
+        for reading_id, user_id, glucose_level in cursor.fetchall():
+            min_glucose, max_glucose = alert_rules.thresholds.get(user_id, (None, None))
+            if (min_glucose is not None and glucose_level < min_glucose) or (
+                max_glucose is not None and glucose_level > max_glucose
+            ):
+                subscribers = alert_rules.subscribers.get(user_id)
+                alerts.append((
+                    reading_id,
+                    user_id,
+                    json.dumps(subscribers) if subscribers else None,
+                    "Abnormal Glucose Level",
+                    "Active"
+                ))
+        if alerts:
+            cursor.executemany(alert_stmt, alerts)
+            connection.commit()
+            logging.info(f"{len(alerts)} alerts created")
+        return len(alerts)
+    finally:
+        cursor.close()
+
+# Function helper to insert the rows of a batch in one transaction
+def insert_rows(table_name, fields, insert_stmt, rows, rejected, after_insert=None):
+    """
+    Inserts rows with a single executemany, committed in one transaction over one connection, then quarantines
+    the rejected records. The INSERT statements are not prepared: mysql.connector sends the rows of an executemany
+    as one multi-row INSERT, where a prepared statement would be executed once per row.
+
+    Args:
+        table_name (str): The table of the rows.
+        fields (dict): The fields of the table in the order of its columns.
+        insert_stmt (str): The INSERT statement, with one %s per column.
+        rows (list): The rows to insert.
+        rejected (list): The (record, reason) of the records already rejected.
+        after_insert (function, optional): Called with the connection and the rows once they are inserted.
+            Defaults to None.
+
+    Raises:
+        ConnectionError: If the database cannot be reached.
+        mysql.connector.Error: If the database fails otherwise than by refusing rows, after the rollback.
+    """
+    if not rows and not rejected:
         return
 
-    # Verify and prepare data
+    # Connect to MySQL database
+    connection = get_db_connection()
+    if not connection:
+        raise ConnectionError("Failed to connect to the database, the batch will be delivered again")
+
     try:
-        # timestamp = datetime.utcfromtimestamp(message["timestamp"]).strftime('%Y-%m-%d %H:%M:%S')
-        data = (
-            message["device_id"],
-            message["battery_level"],
-            message["firmware_version"],
-            message["connection_status"],
-            message["error_code"],
-            message["timestamp"]
-        )
-        logging.info(f"Data prepared for insertion: {data}")
-    except KeyError as e:
-        logging.error(f"Key error in message: {e}")
-        return
-    except Exception as e:
-        logging.error(f"Error in data preparation: {e}")
-        return
+        refused = insert_or_split(connection, insert_stmt, rows) if rows else []
+        logging.info(f"{len(rows) - len(refused)} rows inserted successfully")
+        if after_insert is not None and rows:
+            after_insert(connection, rows)
+        rejected = rejected + [(dict(zip(fields, row)), reason) for row, reason in refused]
+        if rejected:
+            quarantine(connection, table_name, rejected)
+    except mysql.connector.Error as error:
+        logging.error(f"Failed to insert {len(rows)} rows: {error}")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            # The connection itself may be lost
+            pass
+        # Failing the invocation, so the batch is delivered again instead of being checkpointed
+        raise
+    finally:
+        # Gives the connection back to the pool
+        connection.close()
+
+@app.function_name(name="glucose_readings_table_insert")
+# A failed batch is delivered again until the database accepts it, the partition waits meanwhile
+@app.retry(strategy="exponential_backoff", max_retry_count="-1",
+           minimum_interval="00:00:05", maximum_interval="00:05:00")
+@app.event_hub_message_trigger(arg_name="azeventhub", event_hub_name="raw_glucose_readings",
+                               connection="EventHubConnectionString",
+                               consumer_group="mysql_glucose_reading_table",
+                               cardinality=func.Cardinality.MANY
+                               ) 
+def glucose_readings_table_insert(azeventhub: List[func.EventHubEvent]):
+    logging.info('Python EventHub trigger processed a batch of %s events', len(azeventhub))
+
+    # Parse and verify the messages
+    messages, undecodable, event_keys = decode_batch(azeventhub, recent_events["glucose_reading"])
+    data, invalid = validate_records(messages, glucose_reading_fields)
+    logging.info(f"Data prepared for insertion: {len(data)} rows, {len(undecodable) + len(invalid)} records rejected")
 
-    # Insert statement
     insert_stmt = (
-        "INSERT INTO device_feed (device_id, battery_level, firmware_version, connectivity_status, error_codes, timestamp)"
-        "VALUES (%s, %s, %s, %s, %s, %s)"
+        "INSERT INTO glucose_reading (user_id, device_id, glucose_level, timestamp, latitude, longitude, "
+        "event_partition, event_sequence, event_position) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE reading_id = reading_id"
     )
 
+    # Creating the alerts of the batch, unless the trigger of the database creates them
+    after_insert = insert_alerts if alert_mode == "batch" else None
+
     # Inserting data into the database
-    try:
-        cursor = connection.cursor()
-        cursor.execute(insert_stmt, data)
-        connection.commit()
-        logging.info("1 row inserted successfully")
-    except mysql.connector.Error as error:
-        logging.error(f"Failed to insert row: {error}")
-        connection.rollback()
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-            logging.info("MySQL connection is closed")
+    insert_rows("glucose_reading", glucose_reading_fields, insert_stmt, data, undecodable + invalid, after_insert)
+    recent_events["glucose_reading"].add_all(event_keys)
+
 
+@app.function_name(name="device_feed_table_insert")
+# A failed batch is delivered again until the database accepts it, the partition waits meanwhile
+@app.retry(strategy="exponential_backoff", max_retry_count="-1",
+           minimum_interval="00:00:05", maximum_interval="00:05:00")
+@app.event_hub_message_trigger(arg_name="azeventhub", event_hub_name="raw_device_feeds",
+                               connection="EventHubConnectionString",
+                               consumer_group="mysql_device_feed_table",
+                               cardinality=func.Cardinality.MANY) 
+def device_feed_table_insert(azeventhub: List[func.EventHubEvent]):
+    logging.info('Python EventHub trigger processed a batch of %s events', len(azeventhub))
 
+    # Parse and verify the messages
+    messages, undecodable, event_keys = decode_batch(azeventhub, recent_events["device_feed"])
+    data, invalid = validate_records(messages, device_feed_fields)
+    logging.info(f"Data prepared for insertion: {len(data)} rows, {len(undecodable) + len(invalid)} records rejected")
+
+    # Insert statement
+    insert_stmt = (
+        "INSERT INTO device_feed (device_id, battery_level, firmware_version, connectivity_status, error_codes, timestamp, "
+        "event_partition, event_sequence, event_position) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE feed_id = feed_id"
+    )
+
+    # Inserting data into the database
+    insert_rows("device_feed", device_feed_fields, insert_stmt, data, undecodable + invalid)
+    recent_events["device_feed"].add_all(event_keys)
@@ -3,30 +3,55 @@ This script generates and stores glucose monitoring data for devices and patient
 
 Creates new datasets of records, and writes them to files. 
 
-The `new_dataset` function generates and moves records to the appropriate directory, 
-tracking the sequence number and current data position. 
+The `new_dataset` function pulls the next records from a stream of the simulation engine 
+and moves them to the appropriate directory, tracking the sequence number. 
+The records can also be written to other sinks with `--sink` (see src/Simulation/output_sinks.py). 
 
 The `generate_data` function updates global sequence numbers for device and patient records. 
 
 The `continuous_data_generation` ensures ongoing data generation by 
 repeatedly calling `generate_data` with a sleep interval.
+
+The `replay_data_generation` instead releases the records at their simulated time 
+(or faster with a speed-up factor), optionally capped at a target rate in events per second.
+
+With `--workers N`, the patients and devices are partitioned into N shards simulated in parallel 
+by `run_workers`. Each shard has its own seed and its own sequence of files.
+A seeded run without `--start-time` starts at a fixed time, so its records are the same on every run.
 """
 
 
-import json
-import os
-import shutil
-import tempfile
+import argparse
+import datetime
+import itertools
+import random
 import time
-from src.Simulation.device_data_generator import device_records, generate_device_record
-from src.Simulation.patient_data_generator import generate_metric_record, records
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.Simulation.data_initialization_config import registry
+from src.Simulation.device_data_generator import generate_device_record
+from src.Simulation.output_sinks import JsonlFileSink, create_sink
+from src.Simulation.patient_data_generator import generate_metric_record
+from src.Simulation.replay import ReplayScheduler
+from src.Simulation.simulation_engine import DEVICE, METRIC, SimulationEngine
+from src.Simulation.user_behaviour import create_user_behaviors, user_behaviors
 
 
 next_file_seq_device = 0
 next_file_seq_patient = 0
 
-current_position_device = 0
-current_position_patient = 0
+# Prefix of the file names, to keep the file sequences of the shards apart
+file_prefix = ""
+
+# Where the records are written, JSONL files in the monitored directories by default
+sink = JsonlFileSink()
+
+# The simulation runs lazily, records are only generated when the streams are pulled
+simulation = SimulationEngine()
+device_records = simulation.stream(DEVICE)
+records = simulation.stream(METRIC)
 
 
 
@@ -36,68 +61,121 @@ def new_dataset(
     generate_record_func=None,
     output_dir=None,
     data_source=None,
+    file_prefix="",
+    output_sink=None,
 ):
     """
-    This function generates a new dataset of records and writes them to a file.
-    It writes the records to a temporary file first and then moves the file to the output directory.
-    It keeps track of the sequence number of the file and the current position in the data source.
+    This function pulls the next records from the data source and writes them to a file.
+    With the default sink, it writes the records to a temporary file in the output directory first and then renames it into place.
+    It keeps track of the sequence number of the file.
 
     Args:
         file_seq (int): The sequence number of the file.
         record_count (int, optional): The number of records to generate within the jsonl file. Defaults to 10.
         generate_record_func (function, optional): The function used to generate records. Defaults to None.
         output_dir (str, optional): The directory to write the generated file to. Defaults to None.
-        data_source (list, optional): The source of data records. Defaults to None.
+        data_source (iterator, optional): The stream of data records. Defaults to None.
+        file_prefix (str, optional): The prefix of the file name. Defaults to "".
+        output_sink (optional): The sink the records are written to (output_sinks.py). Defaults to the module sink.
 
     Returns:
         int: The updated sequence number of the file.
     """
 
-    global current_position_device, current_position_patient
-
     if generate_record_func is None or data_source is None:
         raise ValueError("generate_record_func and data_source must be provided")
 
     if output_dir is None:
         if generate_record_func.__name__ == "generate_device_record":
             output_dir = "monitoring/device_feed"
-            current_position = current_position_device
         elif generate_record_func.__name__ == "generate_metric_record":
             output_dir = "monitoring/metric_feed"
-            current_position = current_position_patient
         else:
             raise ValueError("Unknown record generation function")
 
-    # To ensure that I do not out of range
-    if current_position >= len(data_source):
+    # Pulling the next records from the stream
+    records_to_write = list(itertools.islice(data_source, record_count))
+
+    # To ensure that I do not write empty files once the simulation is over
+    if not records_to_write:
         print("No more data to process")
         return file_seq
 
-    # Calculating the range of indices to generate records for
-    start_index = current_position
-    end_index = min(start_index + record_count, len(data_source))
+    # Writing the records to the sink, a file in the output directory by default
+    (output_sink or sink).write(records_to_write, output_dir, file_prefix + str(file_seq))
 
-    # Selecting the records
-    records_to_write = data_source[start_index:end_index]
+    # Updating the file sequence number
+    file_seq += 1
 
-    # Writing the records to a temporary file
-    file_tmp = os.path.join(tempfile.gettempdir(), str(file_seq) + ".jsonl")
-    with open(file_tmp, "w") as file:
-        file.write("\n".join([json.dumps(record) for record in records_to_write]))
+    return file_seq
 
-    # Moving the temporary file to the output directory
-    shutil.move(file_tmp, os.path.join(output_dir, str(file_seq) + ".jsonl"))
 
-    # Updating the file sequence number and current position
-    file_seq += 1
-    current_position = end_index
+def shard_seed(seed, shard_index):
+    """
+    Derives the seed of a shard from the seed of the run.
+    The seeds of the shards are independent of each other and the same for every run with the same seed.
+
+    Args:
+        seed (int): The seed of the run.
+        shard_index (int): The index of the shard.
 
-    if generate_record_func.__name__ == "generate_device_record":
-        current_position_device = current_position
-    elif generate_record_func.__name__ == "generate_metric_record":
-        current_position_patient = current_position
+    Returns:
+        int: The seed of the shard.
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=(shard_index,)).generate_state(1)[0])
 
-    return file_seq
+
+# The start time of a seeded simulation without a start time, so its timestamps are reproducible too
+seeded_start_time = datetime.datetime(2024, 6, 1)
+
+
+def default_start_time(seed=None):
+    """
+    Returns the start time of a simulation without one.
+
+    Args:
+        seed (int, optional): The seed of the simulation. Defaults to None.
+
+    Returns:
+        datetime.datetime: seeded_start_time for a seeded simulation, otherwise now.
+    """
+    return seeded_start_time if seed is not None else datetime.datetime.now()
+
+
+def start_simulation(vectorized=False, seed=None, shard_registry=registry, start_time=None, prefix="", output_sink=None):
+    """
+    Starts a new simulation and replaces the device and patient record streams with its streams.
+
+    Args:
+        vectorized (bool, optional): Whether the metric records are generated per tick as NumPy arrays. Defaults to False.
+        seed (int, optional): The seed of the random generators, for a reproducible simulation. Defaults to None.
+        shard_registry (PatientRegistry, optional): The patients and devices to simulate. Defaults to the whole registry.
+        start_time (datetime.datetime, optional): The start time of the simulation.
+            Defaults to seeded_start_time for a seeded simulation, otherwise now.
+        prefix (str, optional): The prefix of the names of the files written. Defaults to "".
+        output_sink (optional): The sink the records are written to. Defaults to JSONL files.
+    """
+
+    global simulation, device_records, records, file_prefix, sink
+
+    behaviors = user_behaviors
+
+    # The user behaviors are drawn again once seeded, so they are reproducible too
+    if seed is not None:
+        random.seed(seed)
+        behaviors = create_user_behaviors(shard_registry)
+
+    simulation = SimulationEngine(
+        registry=shard_registry,
+        user_behaviors=behaviors,
+        start_time=start_time or default_start_time(seed),
+        vectorized=vectorized,
+        seed=seed,
+    )
+    device_records = simulation.stream(DEVICE)
+    records = simulation.stream(METRIC)
+    file_prefix = prefix
+    sink = output_sink or JsonlFileSink()
 
 
 def generate_data():
@@ -107,6 +185,8 @@ def generate_data():
     This function generates device records and patient records using the `new_dataset` function.
     It updates the global variables `next_file_seq_device` and `next_file_seq_patient` with the
     next file sequence numbers.
+    As the two kinds are not simulated at the rate of 300 device records for 800 patient records,
+    more files are written for the kind whose records are buffered by the simulation, so its buffer stays bounded.
 
     Parameters:
         None
@@ -123,6 +203,7 @@ def generate_data():
         record_count=300,
         generate_record_func=generate_device_record,
         data_source=device_records,
+        file_prefix=file_prefix,
     )
 
     # Generate patient records
@@ -131,8 +212,27 @@ def generate_data():
         record_count=800,
         generate_record_func=generate_metric_record,
         data_source=records,
+        file_prefix=file_prefix,
     )
 
+    # Catching up with the kind pulled less often than it is simulated
+    while simulation.buffered(DEVICE) >= 300:
+        next_file_seq_device = new_dataset(
+            next_file_seq_device,
+            record_count=300,
+            generate_record_func=generate_device_record,
+            data_source=device_records,
+            file_prefix=file_prefix,
+        )
+    while simulation.buffered(METRIC) >= 800:
+        next_file_seq_patient = new_dataset(
+            next_file_seq_patient,
+            record_count=800,
+            generate_record_func=generate_metric_record,
+            data_source=records,
+            file_prefix=file_prefix,
+        )
+
 
 def continuous_data_generation():
     """
@@ -148,6 +248,193 @@ def continuous_data_generation():
         time.sleep(10)
 
 
+def replay_data_generation(speed=1.0, target_rate=None, flush_interval=1.0, report_interval=10.0):
+    """
+    Replays the simulation in real time.
+
+    The records are released in timestamp order at their simulated time scaled by the speed-up factor,
+    and at most at the target rate. The records released are written every flush_interval seconds,
+    or as soon as a file holds as many records as in `generate_data`.
+    The achieved throughput is printed every report_interval seconds.
+
+    Args:
+        speed (float, optional): The speed-up factor, None for as fast as possible. Defaults to 1.0.
+        target_rate (float, optional): The maximum number of records per second. Defaults to None.
+        flush_interval (float, optional): The maximum time records wait before being written, in seconds. Defaults to 1.0.
+        report_interval (float, optional): The time between two throughput reports, in seconds. Defaults to 10.0.
+    """
+    scheduler = ReplayScheduler(speed, target_rate)
+    max_records = {DEVICE: 300, METRIC: 800}
+    pending = {DEVICE: [], METRIC: []}
+
+    def flush():
+        global next_file_seq_device, next_file_seq_patient
+
+        if pending[DEVICE]:
+            next_file_seq_device = new_dataset(
+                next_file_seq_device,
+                record_count=len(pending[DEVICE]),
+                generate_record_func=generate_device_record,
+                data_source=iter(pending[DEVICE]),
+                file_prefix=file_prefix,
+            )
+        if pending[METRIC]:
+            next_file_seq_patient = new_dataset(
+                next_file_seq_patient,
+                record_count=len(pending[METRIC]),
+                generate_record_func=generate_metric_record,
+                data_source=iter(pending[METRIC]),
+                file_prefix=file_prefix,
+            )
+        pending[DEVICE], pending[METRIC] = [], []
+
+    print(f"Replaying data at speed {speed or 'max'}, target rate {target_rate or 'unlimited'} events/s")
+    last_flush = last_report = time.monotonic()
+    for kind, record in simulation.events():
+        scheduler.wait(record.timestamp)
+        pending[kind].append(record)
+
+        now = time.monotonic()
+        if now - last_flush >= flush_interval or len(pending[kind]) >= max_records[kind]:
+            flush()
+            last_flush = now
+
+        if now - last_report >= report_interval:
+            report = scheduler.report()
+            print(
+                f"{report['released']} events in {report['elapsed']:.1f}s: achieved {report['achieved_rate']:.1f} events/s, "
+                f"target {report['target_rate'] or 'unlimited'} events/s, lag {report['lag']:.2f}s"
+            )
+            last_report = now
+
+    flush()
+    print("No more data to process")
+
+
+def run_shard(
+    shard_registry, shard_index, seed, start_time, vectorized, sink_name="jsonl", sink_address=None, replay_options=None
+):
+    """
+    Simulates one shard continuously. This function runs in a worker process.
+
+    Args:
+        shard_registry (PatientRegistry): The patients and devices of the shard.
+        shard_index (int): The index of the shard.
+        seed (int): The seed of the run, None for a non reproducible simulation.
+        start_time (datetime.datetime): The start time of the simulation, shared by all the shards.
+        vectorized (bool): Whether the metric records are generated per tick as NumPy arrays.
+        sink_name (str, optional): The name of the sink each worker writes to. Defaults to 'jsonl'.
+        sink_address (str, optional): The address of the socket sink. Defaults to None.
+        replay_options (dict, optional): The arguments of replay_data_generation, None for continuous generation. Defaults to None.
+    """
+    start_simulation(
+        vectorized,
+        seed=None if seed is None else shard_seed(seed, shard_index),
+        shard_registry=shard_registry,
+        start_time=start_time,
+        prefix=f"shard{shard_index}_",
+        output_sink=create_sink(sink_name, sink_address),
+    )
+    if replay_options is not None:
+        replay_data_generation(**replay_options)
+    else:
+        continuous_data_generation()
+
+
+def run_workers(
+    worker_count, seed=None, start_time=None, vectorized=False, sink_name="jsonl", sink_address=None, replay_options=None
+):
+    """
+    Partitions the patients and devices into shards and simulates them in parallel worker processes.
+
+    Each shard writes its own sequence of files in monitoring/metric_feed and monitoring/device_feed.
+    For a given seed and number of workers, the records generated are the same on every run: the shards share
+    one start time, seeded_start_time unless another one is given.
+
+    Args:
+        worker_count (int): The number of worker processes (and shards).
+        seed (int, optional): The seed of the run. Defaults to None.
+        start_time (datetime.datetime, optional): The start time of the simulation.
+            Defaults to seeded_start_time for a seeded run, otherwise now.
+        vectorized (bool, optional): Whether the metric records are generated per tick as NumPy arrays. Defaults to False.
+        sink_name (str, optional): The name of the sink each worker writes to. Defaults to 'jsonl'.
+        sink_address (str, optional): The address of the socket sink. Defaults to None.
+        replay_options (dict, optional): The arguments of replay_data_generation, None for continuous generation.
+            The target rate is split evenly between the workers. Defaults to None.
+    """
+    start_time = start_time or default_start_time(seed)
+
+    if replay_options is not None and replay_options.get("target_rate"):
+        replay_options = dict(replay_options, target_rate=replay_options["target_rate"] / worker_count)
+
+    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+        futures = [
+            executor.submit(
+                run_shard,
+                registry.shard(shard_index, worker_count),
+                shard_index,
+                seed,
+                start_time,
+                vectorized,
+                sink_name,
+                sink_address,
+                replay_options,
+            )
+            for shard_index in range(worker_count)
+        ]
+        for future in futures:
+            future.result()
+
+
 if __name__ == "__main__":
-    continuous_data_generation() 
+    parser = argparse.ArgumentParser(description="Generate glucose monitoring data continuously.")
+    parser.add_argument(
+        "--vectorized", action="store_true", help="Generate the metric records of each simulated minute as NumPy arrays"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random generators")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes simulating the shards")
+    parser.add_argument(
+        "--start-time",
+        type=datetime.datetime.fromisoformat,
+        default=None,
+        help=f"Start time of the simulation (ISO format), defaults to now, or to {seeded_start_time:%Y-%m-%d} with --seed",
+    )
+    parser.add_argument(
+        "--sink",
+        choices=["jsonl", "gzip", "zstd", "parquet", "arrow", "socket"],
+        default="jsonl",
+        help="Where the records are written",
+    )
+    parser.add_argument(
+        "--sink-address", default=None, help="Address of the socket sink, host:port or the path of a Unix socket"
+    )
+    parser.add_argument(
+        "--replay", action="store_true", help="Release the records at their simulated time instead of fixed batches every 10s"
+    )
+    parser.add_argument(
+        "--speed",
+        type=lambda value: None if value == "max" else float(value),
+        default=1.0,
+        help="Speed-up factor of the replay (1 for real time, 10, ...) or 'max' for as fast as possible",
+    )
+    parser.add_argument("--rate", type=float, default=None, help="Target rate of the replay in events per second")
+    args = parser.parse_args()
+
+    replay_options = {"speed": args.speed, "target_rate": args.rate} if args.replay else None
+
+    if args.workers > 1:
+        run_workers(
+            args.workers, args.seed, args.start_time, args.vectorized, args.sink, args.sink_address, replay_options
+        )
+    else:
+        start_simulation(
+            args.vectorized,
+            seed=None if args.seed is None else shard_seed(args.seed, 0),
+            start_time=args.start_time,
+            output_sink=create_sink(args.sink, args.sink_address),
+        )
+        if replay_options is not None:
+            replay_data_generation(**replay_options)
+        else:
+            continuous_data_generation()
 
@@ -4,6 +4,7 @@ import pandas as pd
 import time
 import plotly.express as px
 from azure.eventhub import EventHubConsumerClient
+import io
 import json
 import os
 from dotenv import load_dotenv, find_dotenv
@@ -31,6 +32,25 @@ def create_styled_header(text, color):
     </h2>
     """
 
+ARROW_ZSTD_CONTENT_TYPE = "application/vnd.apache.arrow.stream+zstd"
+
+def decode_records(event):
+    """
+    Decodes the readings of an event, one JSON reading or an Arrow IPC stream of readings
+    when sensor.py runs with --encoding arrow-zstd
+    Args:
+        event (EventData): Event data received from the Event Hub
+    Returns:
+        list: The readings of the event
+    """
+    properties = event.properties or {}
+    content_type = event.content_type or properties.get(b"content_type", b"").decode("utf-8")
+    if content_type == ARROW_ZSTD_CONTENT_TYPE:
+        import pyarrow.ipc
+        with pyarrow.ipc.open_stream(io.BytesIO(b"".join(event.body))) as reader:
+            return reader.read_all().to_pylist()
+    return [json.loads(event.body_as_str())]
+
 def on_event(partition_context, event):
     """
     Callback function that is called whenever an event is received from the Event Hub
@@ -40,8 +60,7 @@ def on_event(partition_context, event):
     Returns:
         None
     """
-    event_data = json.loads(event.body_as_str())
-    real_time_data.append(event_data)
+    real_time_data.extend(decode_records(event))
     df = pd.DataFrame(real_time_data)
 
     # Converting 'timestamp' to datetime and sort the DataFrame
@@ -1,30 +1,47 @@
 """
 This script monitors the specified directories where new files are created during data generation
-from the Data_Generation.py script.
+from the Data_Generation.py script (or receives the records from its socket sink with --listen).
 
-The files created in the specified directories are read and sent to Event Hub in batches.
+Each complete file is handed to the asynchronous pipeline of src/Ingestion, which sends its records to Event Hub
+in batches, checkpointing its position so that the files left at startup are resumed and the sent files are moved
+out of the directories. The options (encoding, workers, retries, dead-letter directory, metrics, tracing) are
+described by --help.
 """
 
+import argparse
 import json
 import os
+import socket
+import socketserver
 import time
-from azure.eventhub import EventData, EventHubProducerClient
+from azure.eventhub.aio import EventHubProducerClient
 from dotenv import load_dotenv, find_dotenv
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from src.Ingestion.checkpoint_store import CheckpointStore
+from src.Ingestion.event_encoding import encodings
+from src.Ingestion.file_readiness import FileReadinessTracker
+from src.Ingestion.metrics import MetricsReporter, MetricsServer, ProducerMetrics, create_tracer
+from src.Ingestion.pipeline import IngestionPipeline
+from src.Ingestion.retry import RetryPolicy
+from src.Simulation.output_sinks import file_extensions, parse_address
+
 load_dotenv(find_dotenv())
 
+# The field of the records whose events go to the same partition, in order
+partition_key_fields = {"metric_feed": "user_id", "device_feed": "device_id"}
+
 def create_producer_client(connection_str, eventhub_name):
     """
-    Creates and returns an Event Hub producer client.
+    Creates and returns an asynchronous Event Hub producer client.
     
     Args:
         connection_str (str): The connection string for the Event Hub namespace.
         eventhub_name (str): The name of the Event Hub.
 
     Returns:
-        EventHubProducerClient: The Event Hub producer client.
+        EventHubProducerClient: The asynchronous Event Hub producer client.
     """
     client = EventHubProducerClient.from_connection_string(
         connection_str, eventhub_name=eventhub_name
@@ -34,33 +51,42 @@ def create_producer_client(connection_str, eventhub_name):
 class NewFileHandler(FileSystemEventHandler):
     """
     This class handles the events triggered by the file system watcher.
-    When a new file is created, it reads the file and sends the data to Event Hub.
+    When a new file is complete, it hands the file to the pipeline which sends the data to Event Hub.
 
     Attributes:
-        client (EventHubProducerClient): The Event Hub producer client used to send events.
+        pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+        path (str): The absolute path of the folder being monitored.
         folder_name (str): The name of the folder being monitored.
+        readiness (FileReadinessTracker): The tracker of the new files that may still be written.
 
     Methods:
         on_created(event): Event handler for the "on_created" event.
-        read_and_send_data(file_path): Reads the file and sends the data to Event Hub in batches.
-        send_batches(events): Sends the events to Event Hub in batches.
+        on_closed(event): Event handler for the "on_closed" event.
+        on_moved(event): Event handler for the "on_moved" event.
+        read_and_send_data(file_path): Hands the file to the pipeline.
     """
 
-    def __init__(self, clients, folder_name):
+    def __init__(self, pipeline, path, settle_time=0.2):
         """
         Initializes a new instance of the NewFileHandler class.
 
         Args:
-            clients (dict): A dictionary of folder names to Event Hub producer clients.
-            folder_name (str): The name of the folder being monitored.
+            pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+            path (str): The path of the folder being monitored.
+            settle_time (float, optional): How long the size of a new file must stay the same before it is sent,
+                unless it is closed or renamed into place before. Defaults to 0.2.
         """
-        self.clients = clients
-        self.folder_name = folder_name
-        self.client = clients[folder_name]
+        self.pipeline = pipeline
+        self.path = os.path.abspath(path)
+        self.folder_name = os.path.basename(self.path)
+        self.readiness = FileReadinessTracker(self.read_and_send_data, settle_time=settle_time)
+        self.readiness.start()
 
     def on_created(self, event):
         """
         This method is called when a file is created in the monitored directory.
+        A file moved in from another directory is also reported as created, the file may be complete
+        or still being written, so it is sent once it is closed or its size has settled.
 
         Args:
             event (FileSystemEvent): The event object representing the created file.
@@ -68,108 +94,310 @@ class NewFileHandler(FileSystemEventHandler):
         Returns:
             None
         """
-        if event.is_directory or not event.src_path.endswith(".jsonl"):
+        if event.is_directory or not event.src_path.endswith(file_extensions):
             return
-        time.sleep(2)
-        self.read_and_send_data(event.src_path)
+        self.readiness.track(event.src_path)
+
+    def on_closed(self, event):
+        """
+        This method is called when a file opened for writing is closed (Linux only), the file is then complete.
+
+        Args:
+            event (FileSystemEvent): The event object representing the closed file.
+
+        Returns:
+            None
+        """
+        if event.is_directory or not event.src_path.endswith(file_extensions):
+            return
+        self.readiness.mark_ready(event.src_path)
+
+    def on_moved(self, event):
+        """
+        This method is called when a file is renamed within the monitored directory, or moved out of it.
+        A file renamed into place (e.g. from a temporary name) is complete and is sent right away.
+
+        Args:
+            event (FileSystemEvent): The event object representing the moved file.
+
+        Returns:
+            None
+        """
+        if event.is_directory:
+            return
+        self.readiness.discard(event.src_path)
+
+        # The sent files are moved out of the monitored directory, only the files moved into it are sent
+        dest_path = event.dest_path
+        if os.path.dirname(os.path.abspath(dest_path)) != self.path or not dest_path.endswith(file_extensions):
+            return
+        self.readiness.hand_over(dest_path)
 
     def read_and_send_data(self, file_path):
         """
-        This function reads the jsonl file, converts each line to an EventData object,
-        and use the send_batches function to send the data to Event Hub in batches.
+        This function hands the file (jsonl, compressed jsonl, parquet or arrow) to the pipeline,
+        which reads it and sends the data to Event Hub in batches.
+        It blocks while the queue of the pipeline is full.
 
         Args:
             file_path (str): The path of the file to be read and sent.
         """
 
-        # Read the file and send the data to Event Hub in batches
         # Check if the file is accessible
         if os.access(file_path, os.R_OK):
-            with open(file_path, "r") as file:
-                events = [EventData(json.dumps(json.loads(line))) for line in file]
-                self.send_batches(events)
+            self.pipeline.submit(self.folder_name, file_path)
         else:
             print(f"File {file_path} is not accessible.")
 
-    def send_batches(self, events):
-        """
-        Function for the batch sending of events to Event Hub.
-
-        Args:
-            events (list): A list of EventData objects representing the events to be sent.
-        """
+def disconnect_shutdown(pipeline):
+    """
+    Disconnect the clients and shut down the application.
 
-        # keeps track of the number of batches sent.
-        batch_count = 0
-
-        # keeps track of the number of messages in the current batch.
-        batch_message_limit = 0
-
-        with self.client:
-            event_batch = self.client.create_batch()
-            for event in events:
-                try:
-                    event_batch.add(event)
-                    batch_message_limit += 1
-                except ValueError:
-                    # If the batch is full, send the current batch and start a new one
-                    batch_count += 1
-                    print(
-                        f"Sending batch {batch_count} with {batch_message_limit} messages"
-                    )
-                    self.client.send_batch(event_batch)
-                    event_batch = self.client.create_batch()
-                    event_batch.add(event)
-                    batch_message_limit = 1
-
-            # Here we send the final batch after the loop ends(all records in the jsonl file have been read)
-            if len(event_batch) > 0:
-                batch_count += 1
-                print(
-                    f"Sending final batch {batch_count} with {batch_message_limit} messages"
-                )
-                self.client.send_batch(event_batch)
-
-def disconnect_shutdown(client):
-    """
-    Disconnect the client and shut down the application.
-
-    Allows the client to gracefully disconnect before shutting down the application.
-    """
-    client.close()
+    Allows the queued files to be sent and the clients to gracefully disconnect before shutting down the application.
+    """
+    pipeline.stop()
     print("Shutting down")
 
-def start_monitoring(paths, clients):
+def resume_unsent_files(event_handlers, pipeline):
     """
-    Start monitoring the specified paths for new file events.
+    Hands the files left in the monitored directories to the pipeline, oldest first.
+    They were created while the script was not running, or were partially sent before it stopped.
+    Each directory hands its files over from its own thread, so a backlog in one does not hold back the others.
+
+    Args:
+        event_handlers (list): The NewFileHandler of each monitored directory.
+        pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+    """
+    if pipeline.checkpoint_store is not None:
+        pipeline.checkpoint_store.prune()
+
+    for event_handler in event_handlers:
+        file_paths = [
+            os.path.join(event_handler.path, file_name)
+            for file_name in os.listdir(event_handler.path)
+            if file_name.endswith(file_extensions)
+        ]
+        for file_path in sorted(file_paths, key=os.path.getmtime):
+            event_handler.readiness.hand_over(file_path)
+
+
+def print_status(pipeline):
+    """
+    Prints the files queued, the files being sent and the batches in flight of each Event Hub.
+
+    Args:
+        pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+    """
+    for folder_name, status in pipeline.status().items():
+        print(
+            f"{folder_name}: {status['queued_files']} files queued, {status['sending_files']} being sent, "
+            f"{status['batches_in_flight']} batches in flight"
+        )
+
+
+def create_observer(paths, pipeline, settle_time=0.2):
+    """
+    Starts watching the specified paths and hands the files already there to the pipeline.
 
     Args:
         paths (list): A list of paths to monitor.
-        clients (dict): A dictionary of folder names to Event Hub producer clients.
+        pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+        settle_time (float, optional): How long the size of a new file must stay the same before it is sent,
+            unless it is closed or renamed into place before. Defaults to 0.2.
 
     Returns:
-        None
+        tuple: The started observer and the NewFileHandler of each path.
     """
     observer = Observer()
-    # Here I am getting the folder name from the path and will use it in main() as the key to the clients dictionary
+    # The handler takes the folder name from the path, the pipeline uses it as the key to the clients dictionary
+    event_handlers = []
     for path in paths:
-        folder_name = os.path.basename(path)
-        event_handler = NewFileHandler(clients, folder_name)
+        event_handler = NewFileHandler(pipeline, path, settle_time=settle_time)
         observer.schedule(event_handler, path, recursive=False)
+        event_handlers.append(event_handler)
     observer.start()
+
+    # The files already there are handed over once the observer is started, so no file is missed in between
+    resume_unsent_files(event_handlers, pipeline)
+    return observer, event_handlers
+
+
+def stop_observer(observer, event_handlers):
+    """
+    Stops watching the paths, the files not handed over yet are left for the next start.
+
+    Args:
+        observer (Observer): The observer returned by create_observer.
+        event_handlers (list): The NewFileHandler of each path.
+    """
+    observer.stop()
+    observer.join()
+    for event_handler in event_handlers:
+        event_handler.readiness.stop()
+
+
+def start_monitoring(paths, pipeline, settle_time=0.2, status_interval=30):
+    """
+    Start monitoring the specified paths for new file events.
+
+    Args:
+        paths (list): A list of paths to monitor.
+        pipeline (IngestionPipeline): The pipeline sending the files to Event Hub.
+        settle_time (float, optional): How long the size of a new file must stay the same before it is sent,
+            unless it is closed or renamed into place before. Defaults to 0.2.
+        status_interval (int, optional): How often the queue depth of each Event Hub is printed, in seconds,
+            0 to never print it. Defaults to 30.
+
+    Returns:
+        None
+    """
+    observer, event_handlers = create_observer(paths, pipeline, settle_time=settle_time)
     try:
+        elapsed = 0
         while True:
             time.sleep(1)
+            elapsed += 1
+            if status_interval and elapsed % status_interval == 0:
+                print_status(pipeline)
     except KeyboardInterrupt:
-        observer.stop()
-        for client in clients.values():
-            disconnect_shutdown(client)
-    observer.join()
+        stop_observer(observer, event_handlers)
+        disconnect_shutdown(pipeline)
+
+class SocketFeedHandler(socketserver.StreamRequestHandler):
+    """
+    This class handles a connection from the socket sink of Data_Generation.py.
+
+    Each batch is a JSON header line {"feed": ..., "count": ...} followed by one JSON line per record.
+    The records are sent to the Event Hub of the feed by the pipeline.
+    """
+
+    def handle(self):
+        for header in self.rfile:
+            if not header.strip():
+                continue
+            batch = json.loads(header)
+            lines = [self.rfile.readline().strip() for _ in range(batch["count"])]
+
+            self.server.pipeline.send(batch["feed"], [line for line in lines if line])
+
+
+def start_listening(address, pipeline):
+    """
+    Start listening on the specified socket for batches of records sent by Data_Generation.py.
+
+    Args:
+        address (str): 'host:port' for a TCP socket, or the path of a Unix socket.
+        pipeline (IngestionPipeline): The pipeline sending the records to Event Hub.
+
+    Returns:
+        None
+    """
+    family, socket_address = parse_address(address)
+    if family == socket.AF_INET:
+        server_class = socketserver.ThreadingTCPServer
+    else:
+        server_class = socketserver.ThreadingUnixStreamServer
+        # Removing the socket file left by a previous run
+        if os.path.exists(socket_address):
+            os.remove(socket_address)
+
+    with server_class(socket_address, SocketFeedHandler) as server:
+        server.pipeline = pipeline
+        print(f"Listening on {address}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            disconnect_shutdown(pipeline)
+
 
 def main():
     """
     Main function to start the monitoring process.
     """
+    parser = argparse.ArgumentParser(description="Send the generated data to Event Hub.")
+    parser.add_argument(
+        "--listen",
+        default=None,
+        help="Receive the records from the socket sink of Data_Generation.py at this address (host:port or Unix socket path) "
+        "instead of monitoring the directories",
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=100, help="Maximum number of files waiting to be sent to each Event Hub"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of files sent at the same time to each Event Hub. Defaults to 1 with partition keys, "
+        "so the records of a user or device stay in order across files, and 4 with --no-partition-keys",
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=4, help="Maximum number of batches being sent at the same time to each Event Hub"
+    )
+    parser.add_argument(
+        "--limits",
+        action="append",
+        default=[],
+        metavar="FEED=WORKERS:MAX_IN_FLIGHT",
+        help="Files sent in parallel and batches in flight for one feed, e.g. metric_feed=8:16 (can be repeated)",
+    )
+    parser.add_argument(
+        "--no-partition-keys",
+        action="store_true",
+        help="Send the events to the partitions in turn instead of by user_id (metric_feed) and device_id (device_feed)",
+    )
+    parser.add_argument(
+        "--status-interval", type=int, default=30, help="Seconds between two prints of the queue depths, 0 to disable"
+    )
+    parser.add_argument(
+        "--validate", action="store_true", help="Parse each line and skip the invalid ones instead of sending the lines as they are"
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=sorted(encodings),
+        default="json",
+        help="json sends one event per record, arrow-zstd packs the records into compressed columnar events",
+    )
+    parser.add_argument(
+        "--checkpoint-db",
+        default="monitoring/sensor_checkpoints.db",
+        help="SQLite database of the acknowledged position of each file, 'none' to disable checkpoints",
+    )
+    parser.add_argument(
+        "--after-send",
+        choices=["move", "delete", "keep"],
+        default="move",
+        help="What to do with the fully sent files",
+    )
+    parser.add_argument("--sent-dir", default="monitoring/sent", help="Directory the fully sent files are moved to")
+    parser.add_argument(
+        "--settle-time",
+        type=float,
+        default=0.2,
+        help="Seconds the size of a new file must stay the same before it is sent, unless it is closed or renamed into place",
+    )
+    parser.add_argument(
+        "--max-retries", type=int, default=5, help="Number of times a failed batch is sent again before it is spooled"
+    )
+    parser.add_argument(
+        "--max-retrying", type=int, default=2, help="Maximum number of batches being retried at the same time per Event Hub"
+    )
+    parser.add_argument(
+        "--dead-letter-dir",
+        default="monitoring/dead_letter",
+        help="Directory the batches failing after their retries are spooled to and replayed from, 'none' to disable",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None, help="Serve the metrics in the Prometheus format on this port (GET /metrics)"
+    )
+    parser.add_argument(
+        "--metrics-log-interval", type=float, default=0, help="Seconds between two JSON lines of metrics, 0 to disable"
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="Create an OpenTelemetry span for each batch sent (requires opentelemetry-api)"
+    )
+    args = parser.parse_args()
+
     connection_str = os.getenv("EVENT_HUB_CONNECTION_STR")
     
     metric_client = create_producer_client(
@@ -184,8 +412,54 @@ def main():
         "device_feed": device_client
     }
 
-    paths = ["monitoring/metric_feed", "monitoring/device_feed"]
-    start_monitoring(paths, clients)
+    checkpoint_store = None if args.checkpoint_db == "none" else CheckpointStore(args.checkpoint_db)
+
+    limits = {}
+    for limit in args.limits:
+        folder_name, _, values = limit.partition("=")
+        worker_count, _, max_in_flight = values.partition(":")
+        limits[folder_name] = (int(worker_count), int(max_in_flight or args.max_in_flight))
+
+    metrics = ProducerMetrics()
+
+    # The producers stay open for as long as the script runs
+    pipeline = IngestionPipeline(
+        clients,
+        queue_size=args.queue_size,
+        worker_count=args.workers,
+        max_in_flight=args.max_in_flight,
+        limits=limits,
+        key_fields=None if args.no_partition_keys else partition_key_fields,
+        validate=args.validate,
+        encoding=args.encoding,
+        checkpoint_store=checkpoint_store,
+        after_send=args.after_send,
+        sent_dir=args.sent_dir,
+        metrics=metrics,
+        tracer=create_tracer() if args.trace else None,
+        retry_policy=RetryPolicy(max_retries=args.max_retries, max_retrying=args.max_retrying),
+        dead_letter_dir=None if args.dead_letter_dir == "none" else args.dead_letter_dir,
+    )
+    pipeline.start()
+
+    # The metrics are served and printed from their own threads
+    exporters = []
+    if args.metrics_port is not None:
+        exporters.append(MetricsServer(metrics, args.metrics_port))
+        print(f"Serving the metrics on port {args.metrics_port}")
+    if args.metrics_log_interval:
+        exporters.append(MetricsReporter(metrics, args.metrics_log_interval))
+    for exporter in exporters:
+        exporter.start()
+
+    if args.listen:
+        start_listening(args.listen, pipeline)
+    else:
+        paths = ["monitoring/metric_feed", "monitoring/device_feed"]
+        start_monitoring(paths, pipeline, settle_time=args.settle_time, status_interval=args.status_interval)
+
+    for exporter in exporters:
+        exporter.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,199 @@
+"""
+This script contains the checkpoint store recording how far each file has been sent to Event Hub.
+
+The store is a local SQLite database with one row per file: the position up to which every batch of the file
+has been acknowledged by Event Hub, and the modification time of the file, so a new file reusing the name of an
+old one starts from the beginning. The position is a byte offset for uncompressed JSONL files, and a number of
+records for the other files (see read_json_lines_from in output_sinks.py).
+
+After a crash, sensor.py resumes each file from its last acknowledged batch, so only the batches that were
+being sent at the time of the crash are sent again. The delivery is therefore at-least-once: a batch
+acknowledged by Event Hub but not committed yet is sent again, and its records are deduplicated downstream by the
+(partition, sequence number) unique key of the DatabaseInserts tables. The rows of the files fully sent are
+removed once the files are moved out of the monitored directories.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class CheckpointStore:
+    """
+    Records the acknowledged position of each file in a SQLite database.
+
+    Attributes:
+        path (str): The path of the database.
+
+    Methods:
+        position: Returns the acknowledged position of a file.
+        commit: Records the acknowledged position of a file.
+        forget: Removes the row of a file.
+        prune: Removes the rows of the files that no longer exist.
+        close: Closes the database.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the database, created if it does not exist.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # The store is used from the thread of the pipeline and from the main thread at startup
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            # WAL with synchronous=NORMAL keeps a commit per batch cheap while surviving a crash of the process
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_checkpoint (
+                    file_path TEXT PRIMARY KEY,
+                    modified_ns INTEGER NOT NULL,
+                    position INTEGER NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def _key(file_path):
+        """
+        Returns the key of a file and its modification time in nanoseconds.
+        """
+        return os.path.abspath(file_path), os.stat(file_path).st_mtime_ns
+
+    def position(self, file_path):
+        """
+        Returns the acknowledged position of a file.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            int: The position, 0 if the file was never sent or was replaced since.
+        """
+        key, modified_ns = self._key(file_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT modified_ns, position FROM file_checkpoint WHERE file_path = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] != modified_ns:
+            return 0
+        return row[1]
+
+    def commit(self, file_path, position):
+        """
+        Records the acknowledged position of a file.
+
+        Args:
+            file_path (str): The path of the file.
+            position (int): The position up to which every batch of the file was acknowledged.
+        """
+        key, modified_ns = self._key(file_path)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_checkpoint (file_path, modified_ns, position) VALUES (?, ?, ?)",
+                (key, modified_ns, position),
+            )
+
+    def forget(self, file_path):
+        """
+        Removes the row of a file, once it was fully sent and moved or deleted.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM file_checkpoint WHERE file_path = ?", (os.path.abspath(file_path),))
+
+    def prune(self):
+        """
+        Removes the rows of the files that no longer exist.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        with self._lock:
+            paths = [row[0] for row in self._connection.execute("SELECT file_path FROM file_checkpoint")]
+        missing = [path for path in paths if not os.path.exists(path)]
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM file_checkpoint WHERE file_path = ?", [(path,) for path in missing])
+        return len(missing)
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class OffsetTracker:
+    """
+    Commits the position of a file up to which every event read was acknowledged.
+
+    The batches of a file are sent concurrently and acknowledged out of order, and with one batch filled per
+    partition, a batch sent early can hold events read after the ones of a batch still being filled. So the
+    position committed is the one before the first event of the oldest batch not acknowledged yet, or the
+    position of the last event read when every batch was acknowledged. A file resumed from this position is
+    at-least-once: the batches acknowledged after the oldest unacknowledged one are sent again, and deduplicated
+    downstream by the (partition, sequence number) unique key of DatabaseInserts.
+
+    Attributes:
+        committed (int): The last position committed.
+
+    Methods:
+        open: Records a new batch and the position before its first event.
+        read: Records the position after the last event read.
+        acknowledge: Records the acknowledgement of a batch, committing the position if it moved forward.
+    """
+
+    def __init__(self, commit, start=0):
+        """
+        Args:
+            commit (function): Called with the new position when it moves forward.
+            start (int, optional): The position the file is read from. Defaults to 0.
+        """
+        self.commit = commit
+        self.committed = start
+        self._read = start
+        # The position before the first event of each batch not acknowledged yet
+        self._unacknowledged = {}
+
+    def open(self, batch_id, position):
+        """
+        Records a new batch.
+
+        Args:
+            batch_id (int): The ID of the batch.
+            position (int): The position right before the first event of the batch.
+        """
+        self._unacknowledged[batch_id] = position
+
+    def read(self, position):
+        """
+        Records the position right after the last event read, once the event was added to a batch.
+
+        Args:
+            position (int): The position.
+        """
+        if position is not None:
+            self._read = position
+
+    def acknowledge(self, batch_id):
+        """
+        Records the acknowledgement of a batch.
+
+        Args:
+            batch_id (int): The ID of the batch.
+        """
+        self._unacknowledged.pop(batch_id, None)
+        position = min(self._unacknowledged.values(), default=self._read)
+        if position > self.committed:
+            self.committed = position
+            self.commit(position)
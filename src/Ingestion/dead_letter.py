@@ -0,0 +1,147 @@
+"""
+This script contains the dead-letter spool of the batches that could not be sent to Event Hub.
+
+When a batch still fails after its retries, its events are written to a file of the spool directory of its
+Event Hub instead of being lost, and the batch counts as acknowledged for the checkpoint of its file, so the
+file is finished and moved as usual. The HubSender replays the spooled batches, oldest first, once the Event Hub
+accepts batches again, and removes each file once its batch is acknowledged. The spool survives a restart of
+sensor.py: the batches left in it are replayed when the sender starts.
+
+Each file holds one batch: a JSON header line with the partition of the batch, then one JSON line per event
+with its body (base64, as the body of an arrow-zstd event is binary), its content type and its properties.
+The files are written to a temporary name and renamed into place, so a crash never leaves half a batch.
+"""
+
+import base64
+import itertools
+import json
+import os
+import time
+
+from azure.eventhub import EventData
+
+
+def event_to_json(event):
+    """
+    Returns an event as a JSON document.
+
+    Args:
+        event (EventData): The event.
+
+    Returns:
+        str: The JSON document.
+    """
+    properties = {
+        (key.decode("utf-8") if isinstance(key, bytes) else str(key)): (
+            value.decode("utf-8") if isinstance(value, bytes) else value
+        )
+        for key, value in (event.properties or {}).items()
+    }
+    return json.dumps(
+        {
+            "body": base64.b64encode(b"".join(event.body)).decode("ascii"),
+            "content_type": event.content_type,
+            "properties": properties,
+        },
+        default=str,
+    )
+
+
+def event_from_json(document):
+    """
+    Returns the event of a JSON document written by event_to_json.
+
+    Args:
+        document (str): The JSON document.
+
+    Returns:
+        EventData: The event.
+    """
+    values = json.loads(document)
+    event = EventData(base64.b64decode(values["body"]))
+    if values.get("content_type"):
+        event.content_type = values["content_type"]
+    if values.get("properties"):
+        event.properties = values["properties"]
+    return event
+
+
+class DeadLetterSpool:
+    """
+    Persists the batches that could not be sent to an Event Hub, one file per batch, until they are replayed.
+
+    Attributes:
+        path (str): The spool directory of the Event Hub.
+
+    Methods:
+        put: Writes the events of a batch to a new file.
+        files: Returns the files of the spool, oldest first.
+        load: Reads the partition and the events of a file.
+        remove: Removes a replayed file.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The spool directory of the Event Hub, created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._ids = itertools.count()
+
+    def put(self, events, partition_id=None):
+        """
+        Writes the events of a batch to a new file of the spool.
+
+        Args:
+            events (list): The EventData objects of the batch.
+            partition_id (str, optional): The partition of the batch. Defaults to None.
+
+        Returns:
+            str: The path of the file.
+        """
+        # The names sort in the order the batches were spooled
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(self._ids):06d}.jsonl"
+        file_path = os.path.join(self.path, name)
+        temporary_path = file_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"partition_id": partition_id, "count": len(events)}) + "\n")
+            for event in events:
+                file.write(event_to_json(event) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, file_path)
+        return file_path
+
+    def files(self):
+        """
+        Returns the files of the spool, oldest first.
+
+        Returns:
+            list: The paths of the files.
+        """
+        return [os.path.join(self.path, name) for name in sorted(os.listdir(self.path)) if name.endswith(".jsonl")]
+
+    def load(self, file_path):
+        """
+        Reads a file of the spool.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            tuple: The partition of the batch (None for any partition) and its EventData objects.
+        """
+        with open(file_path, encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            events = [event_from_json(line) for line in file if line.strip()]
+        return header.get("partition_id"), events
+
+    def remove(self, file_path):
+        """
+        Removes a file of the spool once its batch is acknowledged.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        os.remove(file_path)
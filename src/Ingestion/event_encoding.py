@@ -0,0 +1,118 @@
+"""
+This script contains the encodings of the events sent to Event Hub, and the decoder of their bodies.
+
+By default each event holds one record as a JSON document (json). With the arrow-zstd encoding, each event
+holds many records as an Arrow IPC stream whose buffers are compressed with zstd: the columns of the readings
+compress much better than the field names repeated in every JSON document, so a batch carries many more
+readings for the same number of bytes.
+
+The encoding of an event is given by its content type, which is also set as the content_type application
+property for the consumers that only see the application properties (e.g. the Event Hubs connector of Spark).
+The consumers deployed on their own (the DatabaseInserts function, the Streamlit dashboard and the Databricks
+notebook) have their own copy of decode_body, and only need pyarrow for the arrow-zstd events.
+"""
+
+import io
+import json
+
+from azure.eventhub import EventData
+
+from src.Simulation.output_sinks import _import_pyarrow
+
+JSON_CONTENT_TYPE = "application/json"
+ARROW_ZSTD_CONTENT_TYPE = "application/vnd.apache.arrow.stream+zstd"
+
+# The content type of each encoding
+encodings = {"json": JSON_CONTENT_TYPE, "arrow-zstd": ARROW_ZSTD_CONTENT_TYPE}
+
+CONTENT_TYPE_PROPERTY = "content_type"
+
+
+def encode_records(records, compression_level=None):
+    """
+    Encodes records as one Arrow IPC stream compressed with zstd.
+
+    Args:
+        records (list): The records, as dictionaries with the same fields.
+        compression_level (int, optional): The zstd compression level. Defaults to the level of pyarrow.
+
+    Returns:
+        bytes: The body of the event.
+    """
+    pyarrow = _import_pyarrow()
+    table = pyarrow.Table.from_pylist(records)
+    options = pyarrow.ipc.IpcWriteOptions(compression=pyarrow.Codec("zstd", compression_level))
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def create_event(records, compression_level=None):
+    """
+    Creates one arrow-zstd event holding records, with its content type.
+
+    Args:
+        records (list): The records, as dictionaries.
+        compression_level (int, optional): The zstd compression level. Defaults to the level of pyarrow.
+
+    Returns:
+        EventData: The event.
+    """
+    event = EventData(encode_records(records, compression_level))
+    event.content_type = ARROW_ZSTD_CONTENT_TYPE
+    event.properties = {CONTENT_TYPE_PROPERTY: ARROW_ZSTD_CONTENT_TYPE}
+    return event
+
+
+def content_type_of(event):
+    """
+    Returns the content type of a received event, from its content type or its content_type property.
+
+    Args:
+        event (EventData): The event.
+
+    Returns:
+        str: The content type, None if the event has none (a JSON document).
+    """
+    if event.content_type:
+        return event.content_type
+    properties = event.properties or {}
+    content_type = properties.get(CONTENT_TYPE_PROPERTY, properties.get(CONTENT_TYPE_PROPERTY.encode("utf-8")))
+    if isinstance(content_type, bytes):
+        content_type = content_type.decode("utf-8")
+    return content_type
+
+
+def decode_body(body, content_type=None):
+    """
+    Decodes the body of an event into its records.
+
+    Args:
+        body (bytes): The body of the event.
+        content_type (str, optional): The content type of the event. Defaults to None (a JSON document).
+
+    Returns:
+        list: The records of the event, as dictionaries.
+    """
+    if content_type == ARROW_ZSTD_CONTENT_TYPE:
+        pyarrow = _import_pyarrow()
+        with pyarrow.ipc.open_stream(io.BytesIO(body)) as reader:
+            return reader.read_all().to_pylist()
+    if content_type not in (None, "", JSON_CONTENT_TYPE):
+        raise ValueError(f"Unknown content type: {content_type}")
+    record = json.loads(body)
+    return record if isinstance(record, list) else [record]
+
+
+def decode_event(event):
+    """
+    Decodes a received event into its records.
+
+    Args:
+        event (EventData): The event.
+
+    Returns:
+        list: The records of the event, as dictionaries.
+    """
+    return decode_body(b"".join(event.body), content_type_of(event))
@@ -0,0 +1,156 @@
+"""
+This script contains the tracker deciding when a new file in a monitored directory is complete.
+
+A file renamed into the directory (what Data_Generation.py does) is complete as soon as it appears, but the
+watcher cannot tell it apart from a file still being written: both are reported as created. The tracker hands
+a file over as soon as its writer closes it (inotify IN_CLOSE_WRITE, reported by watchdog on Linux), and
+otherwise once its size and modification time have not changed for settle_time seconds.
+
+The files are handed over from the thread of the tracker, never from the thread of the watcher, so a handover
+blocked by a full queue only holds back the files of its own directory.
+"""
+
+import collections
+import os
+import threading
+import time
+
+
+class FileReadinessTracker:
+    """
+    Waits until new files are complete before handing them over.
+
+    Attributes:
+        on_ready (function): Called with the path of each file once it is complete.
+        settle_time (float): How long the size and modification time of a file must stay the same, in seconds.
+        poll_interval (float): How often the files are checked, in seconds.
+
+    Methods:
+        start: Starts checking the files in a background thread.
+        track: Starts waiting for a new file.
+        mark_ready: Hands over a file being waited for right away, e.g. when its writer closed it.
+        hand_over: Hands over a file right away, e.g. when it was renamed into place.
+        discard: Stops waiting for a file.
+        stop: Stops checking the files.
+    """
+
+    def __init__(self, on_ready, settle_time=0.2, poll_interval=0.05, clock=time.monotonic):
+        """
+        Args:
+            on_ready (function): Called with the path of each file once it is complete.
+            settle_time (float, optional): How long the size and modification time of a file must stay the same,
+                in seconds. Defaults to 0.2.
+            poll_interval (float, optional): How often the files are checked, in seconds. Defaults to 0.05.
+            clock (function, optional): The clock measuring the settle time. Defaults to time.monotonic.
+        """
+        self.on_ready = on_ready
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.clock = clock
+        # The size, modification time and time of the last change of each file being waited for
+        self._pending = {}
+        # The files to hand over right away
+        self._ready = collections.deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def start(self):
+        """
+        Starts checking the files in a background thread.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops checking the files, the files still being waited for are not handed over.
+        """
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+
+    def track(self, file_path):
+        """
+        Starts waiting for a new file.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._pending.setdefault(file_path, (stat.st_size, stat.st_mtime_ns, self.clock()))
+
+    def mark_ready(self, file_path):
+        """
+        Hands over a file being waited for right away.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            bool: True if the file was being waited for, False if it was already handed over.
+        """
+        with self._lock:
+            if self._pending.pop(file_path, None) is None:
+                return False
+        self.hand_over(file_path)
+        return True
+
+    def hand_over(self, file_path):
+        """
+        Hands over a file right away, from the thread of the tracker.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        self.discard(file_path)
+        self._ready.append(file_path)
+        self._wake.set()
+
+    def discard(self, file_path):
+        """
+        Stops waiting for a file.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        with self._lock:
+            self._pending.pop(file_path, None)
+
+    def _poll(self):
+        """
+        Hands over the files marked as ready, and checks the files being waited for every poll_interval.
+        """
+        while not self._stopped.is_set():
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            while self._ready and not self._stopped.is_set():
+                self.on_ready(self._ready.popleft())
+            for file_path in self._settled_files():
+                self.on_ready(file_path)
+
+    def _settled_files(self):
+        """
+        Returns the files whose size and modification time have not changed for settle_time,
+        and stops waiting for them and for the files that were removed.
+        """
+        now = self.clock()
+        settled = []
+        with self._lock:
+            for file_path, (size, modified_ns, changed_at) in list(self._pending.items()):
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    del self._pending[file_path]
+                    continue
+
+                if (stat.st_size, stat.st_mtime_ns) != (size, modified_ns):
+                    self._pending[file_path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif stat.st_size > 0 and now - changed_at >= self.settle_time:
+                    del self._pending[file_path]
+                    settled.append(file_path)
+        return settled
@@ -0,0 +1,399 @@
+"""
+This script contains the sender of the events of one Event Hub.
+
+The sender keeps its asynchronous producer client open for as long as sensor.py runs, so the connection
+to the Event Hub is set up once instead of once per file. The batches are sent concurrently, with at most
+max_in_flight batches being sent at a time.
+
+Events without a key go to batches created for the partitions of the Event Hub in turn. Events with a key
+(the user_id of a reading, the device_id of a device report) always go to the same partition, chosen from
+a stable hash of the key, so all the events of a user are in one partition and in order. One batch is filled
+per partition rather than per key, so the batches stay full even with few events per key, and the batches of
+a partition are sent one after the other to keep their order.
+
+With a retry policy, a batch failing with a transient error is sent again after a jittered exponential backoff
+(see retry.py), with at most max_retrying batches being retried at a time. A batch still failing after its
+retries is written to the dead-letter spool (see dead_letter.py) and counts as sent for the checkpoint of its file,
+and the spooled batches are replayed, oldest first, as soon as a batch is acknowledged again, or every
+replay_interval seconds. The replayed batches come after the batches sent meanwhile, so the order of their partition
+is only kept up to the failure.
+
+With metrics, the events, bytes, fill ratio and send latency of each batch acknowledged are recorded,
+and with a tracer each send is an OpenTelemetry span.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import time
+import zlib
+
+
+class HubSender:
+    """
+    Sends events to one Event Hub through a long-lived asynchronous producer client.
+
+    Attributes:
+        client (EventHubProducerClient): The asynchronous producer client (azure.eventhub.aio).
+        max_in_flight (int): The maximum number of batches being sent at the same time.
+        partition_ids (list): The partition IDs of the Event Hub, retrieved when the sender starts.
+        batches_sent (int): The number of batches sent so far.
+        events_sent (int): The number of events sent so far.
+        name (str): The name of the feed of the Event Hub, used in the metrics and spans.
+        metrics (ProducerMetrics): The metrics of the batches sent, None for no metrics.
+        tracer (opentelemetry.trace.Tracer): The tracer of the batches sent, None for no spans.
+        retry_policy (RetryPolicy): The retry policy of the failed sends, None to never retry.
+        spool (DeadLetterSpool): The spool of the batches failing after their retries, None to raise their error.
+        replay_interval (float): The time between two attempts to replay the spool while no batch is acknowledged.
+
+    Methods:
+        start: Retrieves the partitions of the Event Hub.
+        partition_for: Returns the partition of the events with a given key.
+        create_batch: Creates an empty batch for a partition, or for the next partition.
+        send_batch: Starts sending a batch, waiting first while max_in_flight batches are being sent.
+        send_stream: Fills and sends batches while the events are being read.
+        send_events: Sends events in as many batches as needed.
+        close: Waits for the batches being sent and closes the client.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_in_flight=4,
+        name=None,
+        metrics=None,
+        tracer=None,
+        retry_policy=None,
+        spool=None,
+        replay_interval=5.0,
+    ):
+        """
+        Args:
+            client (EventHubProducerClient): The asynchronous producer client (azure.eventhub.aio).
+            max_in_flight (int, optional): The maximum number of batches being sent at the same time. Defaults to 4.
+            name (str, optional): The name of the feed of the Event Hub. Defaults to None.
+            metrics (ProducerMetrics, optional): The metrics of the batches sent. Defaults to None.
+            tracer (opentelemetry.trace.Tracer, optional): The tracer of the batches sent. Defaults to None.
+            retry_policy (RetryPolicy, optional): The retry policy of the failed sends. Defaults to None.
+            spool (DeadLetterSpool, optional): The spool of the batches failing after their retries. Defaults to None.
+            replay_interval (float, optional): The time between two attempts to replay the spool while no batch
+                is acknowledged, in seconds. Defaults to 5.
+        """
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.name = name
+        self.metrics = metrics
+        self.tracer = tracer
+        self.retry_policy = retry_policy
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.partition_ids = []
+        self.batches_sent = 0
+        self.events_sent = 0
+        self._next_partition = 0
+        self._batch_ids = itertools.count()
+        self._slots = None
+        self._pending = set()
+        # The batches of a partition filled by key are sent one after the other
+        self._partition_locks = {}
+        self._retry_slots = None
+        # Set when a batch is acknowledged while the spool holds batches, to replay them
+        self._recovered = None
+        self._spooled = False
+        self._replayer = None
+
+    @property
+    def in_flight(self):
+        """
+        The number of batches being sent.
+        """
+        return len(self._pending)
+
+    async def start(self):
+        """
+        Retrieves the partitions of the Event Hub. Must be called from the event loop the sender is used in.
+        """
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.partition_ids = list(await self.client.get_partition_ids())
+        self._partition_locks = {partition_id: asyncio.Lock() for partition_id in self.partition_ids}
+        if self.retry_policy is not None:
+            self._retry_slots = asyncio.Semaphore(self.retry_policy.max_retrying)
+        if self.spool is not None:
+            # The batches left in the spool by a previous run are replayed right away
+            self._recovered = asyncio.Event()
+            self._spooled = bool(self.spool.files())
+            if self._spooled:
+                self._recovered.set()
+            self._replayer = asyncio.ensure_future(self._replay_loop())
+
+    def partition_for(self, key):
+        """
+        Returns the partition of the events with a given key, the same for as long as the number of partitions.
+
+        Args:
+            key (str or bytes): The key of the events, e.g. a user ID.
+
+        Returns:
+            str: The partition ID, None if the key is None or the partitions are unknown.
+        """
+        if key is None or not self.partition_ids:
+            return None
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return self.partition_ids[zlib.crc32(key) % len(self.partition_ids)]
+
+    async def create_batch(self, partition_id=None):
+        """
+        Creates an empty batch for a partition of the Event Hub.
+
+        Args:
+            partition_id (str, optional): The partition of the batch. Defaults to the next partition in turn.
+
+        Returns:
+            EventDataBatch: The batch.
+        """
+        if partition_id is None:
+            if not self.partition_ids:
+                return await self.client.create_batch()
+            partition_id = self.partition_ids[self._next_partition % len(self.partition_ids)]
+            self._next_partition += 1
+        return await self.client.create_batch(partition_id=partition_id)
+
+    async def send_batch(self, batch, on_sent=None, ordered_partition=None, events=None):
+        """
+        Starts sending a batch in the background.
+
+        It waits first while max_in_flight batches are being sent, which holds back the reading of
+        the files when the Event Hub cannot keep up.
+
+        Args:
+            batch (EventDataBatch): The batch to send.
+            on_sent (function, optional): Called once the batch is acknowledged by Event Hub. Defaults to None.
+            ordered_partition (str, optional): The partition whose batches must be sent in order,
+                this one after the ones started before. Defaults to None.
+            events (list, optional): The EventData objects of the batch, written to the spool if the batch
+                cannot be sent. Defaults to None, for a batch that is never spooled.
+
+        Returns:
+            asyncio.Task: The task sending the batch.
+        """
+        await self._slots.acquire()
+        task = asyncio.ensure_future(
+            self._send(batch, on_sent, ordered_partition, self._partition_locks.get(ordered_partition), events)
+        )
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def _send(self, batch, on_sent, partition_id, lock, events):
+        """
+        Sends a batch, after the batches of its partition started before when a lock is given, and frees its slot.
+        The batch is spooled if it still fails after its retries.
+        """
+        try:
+            try:
+                if lock is None:
+                    await self._send_with_retries(batch)
+                else:
+                    async with lock:
+                        await self._send_with_retries(batch)
+            except Exception as error:
+                if self.spool is None or events is None or not self._is_retryable(error):
+                    raise
+                self._spool(events, partition_id, error)
+            else:
+                self.batches_sent += 1
+                self.events_sent += len(batch)
+            if on_sent is not None:
+                on_sent()
+        finally:
+            self._slots.release()
+
+    def _is_retryable(self, error):
+        return self.retry_policy is None or self.retry_policy.is_retryable(error)
+
+    async def _send_with_retries(self, batch):
+        """
+        Sends a batch, then sends it again while it fails with a transient error, up to the retries of the policy.
+        """
+        try:
+            await self._send_once(batch)
+            return
+        except Exception as error:
+            if self.retry_policy is None or not self.retry_policy.max_retries or not self._is_retryable(error):
+                raise
+            last_error = error
+
+        # The batches waiting for a retry hold their slot, so the reading slows down while the Event Hub is throttling
+        async with self._retry_slots:
+            for attempt in range(1, self.retry_policy.max_retries + 1):
+                if self.metrics is not None:
+                    self.metrics.add(self.name, "retries")
+                await asyncio.sleep(self.retry_policy.delay(attempt, last_error))
+                try:
+                    await self._send_once(batch)
+                    return
+                except Exception as error:
+                    if attempt == self.retry_policy.max_retries or not self._is_retryable(error):
+                        raise
+                    last_error = error
+
+    async def _send_once(self, batch):
+        """
+        Sends a batch, recording its metrics and its span.
+        """
+        span = contextlib.nullcontext()
+        if self.tracer is not None:
+            span = self.tracer.start_as_current_span(
+                "send_batch",
+                attributes={"feed": self.name or "", "events": len(batch), "bytes": batch.size_in_bytes},
+            )
+        with span:
+            start = time.perf_counter()
+            try:
+                await self.client.send_batch(batch)
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.add(self.name, "send_failures")
+                raise
+        if self.metrics is not None:
+            self.metrics.record_batch(
+                self.name, len(batch), batch.size_in_bytes, batch.max_size_in_bytes, time.perf_counter() - start
+            )
+        if self._spooled:
+            self._recovered.set()
+
+    def _spool(self, events, partition_id, error):
+        """
+        Writes the events of a batch that could not be sent to the spool.
+        """
+        file_path = self.spool.put(events, partition_id)
+        self._spooled = True
+        if self.metrics is not None:
+            self.metrics.add(self.name, "dead_lettered", len(events))
+        print(f"Spooled a batch of {len(events)} events to {file_path} after: {error}")
+
+    async def _replay_loop(self):
+        """
+        Replays the spool when a batch is acknowledged again, or every replay_interval seconds while it holds batches.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._recovered.wait(), self.replay_interval)
+            except asyncio.TimeoutError:
+                if not self._spooled:
+                    continue
+            self._recovered.clear()
+            await self._replay()
+
+    async def _replay(self):
+        """
+        Sends the batches of the spool, oldest first, until one fails, removing each file once its batch is sent.
+        """
+        for file_path in self.spool.files():
+            partition_id, events = self.spool.load(file_path)
+            batch = await self.create_batch(partition_id)
+            for event in events:
+                batch.add(event)
+
+            await self._slots.acquire()
+            try:
+                await self._send_once(batch)
+            except Exception as error:
+                print(f"Failed to replay {file_path}, retrying later: {error}")
+                return
+            finally:
+                self._slots.release()
+
+            self.spool.remove(file_path)
+            self.batches_sent += 1
+            self.events_sent += len(batch)
+            if self.metrics is not None:
+                self.metrics.add(self.name, "replayed", len(events))
+            print(f"Replayed {len(events)} events from {file_path}")
+        self._spooled = False
+
+    async def send_stream(self, chunks, tracker=None):
+        """
+        Fills the batches while the events are being read, each full batch being sent while the next one is filled.
+        Only the batches being filled (one per partition for the events with a key) and the batches
+        being sent are held in memory.
+
+        Args:
+            chunks (async iterable): Lists of (EventData, position, key) tuples, in the order they are read.
+                The position is the one right after the event in its file, None if it is not needed.
+                The key is None for the events that can go to any partition.
+            tracker (OffsetTracker, optional): The tracker committing the position of the file as the batches
+                are acknowledged. Defaults to None.
+
+        Returns:
+            int: The number of batches sent.
+        """
+        tasks = []
+        # The batch being filled, its ID and its events (kept for the spool), for each partition
+        # (None for the events without a key)
+        open_batches = {}
+        previous_position = tracker.committed if tracker is not None else None
+
+        async def flush(partition_id):
+            batch, batch_id, batch_events = open_batches.pop(partition_id)
+            on_sent = (lambda: tracker.acknowledge(batch_id)) if tracker is not None else None
+            tasks.append(await self.send_batch(batch, on_sent, ordered_partition=partition_id, events=batch_events))
+
+        async for events in chunks:
+            for event, position, key in events:
+                partition_id = self.partition_for(key)
+                if partition_id in open_batches:
+                    try:
+                        open_batches[partition_id][0].add(event)
+                        open_batches[partition_id][2].append(event)
+                        event = None
+                    except ValueError:
+                        # If the batch is full, start sending it and add the event to a new one
+                        await flush(partition_id)
+
+                if event is not None:
+                    batch_id = next(self._batch_ids)
+                    open_batches[partition_id] = (await self.create_batch(partition_id), batch_id, [event])
+                    if tracker is not None:
+                        tracker.open(batch_id, previous_position)
+                    open_batches[partition_id][0].add(event)
+
+                previous_position = position
+                if tracker is not None:
+                    tracker.read(position)
+
+        for partition_id in list(open_batches):
+            await flush(partition_id)
+
+        await asyncio.gather(*tasks)
+        return len(tasks)
+
+    async def send_events(self, events, keys=None):
+        """
+        Sends events in as many batches as needed and waits until they are all sent.
+
+        Args:
+            events (list): The EventData objects to send.
+            keys (list, optional): The key of each event, None to send them to any partition. Defaults to None.
+
+        Returns:
+            int: The number of batches sent.
+        """
+
+        async def chunks():
+            yield [(event, None, key) for event, key in zip(events, keys or [None] * len(events))]
+
+        return await self.send_stream(chunks())
+
+    async def close(self):
+        """
+        Waits for the batches being sent, stops replaying the spool and closes the client.
+        The batches left in the spool are replayed at the next start.
+        """
+        if self._replayer is not None:
+            self._replayer.cancel()
+            await asyncio.gather(self._replayer, return_exceptions=True)
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.client.close()
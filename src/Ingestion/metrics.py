@@ -0,0 +1,333 @@
+"""
+This script contains the metrics of the producer side of the pipeline, to size the throughput units of the
+Event Hubs and find where the ingest latency goes.
+
+ProducerMetrics holds, for each feed (metric_feed, device_feed):
+- the counters of records read, events and bytes sent, batches sent, send failures, retries, events spooled
+  and replayed, and files sent,
+- the histograms of the send latency of the batches, of their fill ratio (size over maximum size), and of the
+  file lag (from the modification time of a file to the acknowledgement of its last batch).
+
+The metrics are exposed in the Prometheus text format by MetricsServer (GET /metrics), and/or printed as one JSON
+line per interval by MetricsReporter, with the batches and records per second over the interval.
+With create_tracer, each batch sent is also an OpenTelemetry span (optional opentelemetry-api package).
+"""
+
+import bisect
+import collections
+import http.server
+import json
+import threading
+import time
+
+counter_names = (
+    "records_read",
+    "events_sent",
+    "bytes_sent",
+    "batches_sent",
+    "send_failures",
+    "retries",
+    "dead_lettered",
+    "replayed",
+    "files_sent",
+)
+
+# The upper bounds of the buckets of each histogram
+histogram_buckets = {
+    "send_latency_seconds": (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    "batch_fill_ratio": (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+    "file_lag_seconds": (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+}
+
+# The rate of some counters printed by MetricsReporter
+rates = {
+    "batches_sent": "batches_per_sec",
+    "events_sent": "events_per_sec",
+    "bytes_sent": "bytes_per_sec",
+    "records_read": "records_per_sec",
+}
+
+descriptions = {
+    "records_read": "Records read from the files and the socket",
+    "events_sent": "Events acknowledged by Event Hub",
+    "bytes_sent": "Bytes of the batches acknowledged by Event Hub",
+    "batches_sent": "Batches acknowledged by Event Hub",
+    "send_failures": "Batches whose send failed",
+    "retries": "Sends of a batch retried after a failure",
+    "dead_lettered": "Events written to the dead-letter spool after the retries of their batch",
+    "replayed": "Events of the dead-letter spool sent",
+    "files_sent": "Files fully sent",
+    "send_latency_seconds": "Time to send a batch, until its acknowledgement",
+    "batch_fill_ratio": "Size of the batches sent over their maximum size",
+    "file_lag_seconds": "Time from the modification of a file to the acknowledgement of its last batch",
+}
+
+
+def create_tracer():
+    """
+    Returns the OpenTelemetry tracer of the sensor, the spans are exported by the configured SDK
+    (e.g. when sensor.py runs under opentelemetry-instrument).
+    """
+    try:
+        from opentelemetry import trace
+    except ImportError as error:
+        raise ImportError(
+            "The opentelemetry-api package is required for tracing: "
+            "poetry install --extras tracing (or pip install opentelemetry-api)"
+        ) from error
+    return trace.get_tracer("sensor")
+
+
+class Histogram:
+    """
+    Counts the values observed in buckets of increasing upper bounds.
+
+    Attributes:
+        buckets (tuple): The upper bounds of the buckets, the last bucket (+Inf) is implied.
+        counts (list): The number of values in each bucket, not cumulative.
+        sum (float): The sum of the values.
+        count (int): The number of values.
+        max (float): The largest value.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, fraction):
+        """
+        Returns the upper bound of the bucket holding the quantile, or the largest value when it is in the last bucket,
+        None if no value was observed.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+
+class ProducerMetrics:
+    """
+    The counters and histograms of each feed, updated from the event loop of the pipeline and read from other threads.
+
+    Methods:
+        add: Adds to a counter.
+        observe: Adds a value to a histogram.
+        record_batch: Records a batch acknowledged by Event Hub.
+        snapshot: Returns the current values.
+        render_prometheus: Returns the metrics in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(lambda: dict.fromkeys(counter_names, 0))
+        self._histograms = collections.defaultdict(
+            lambda: {name: Histogram(buckets) for name, buckets in histogram_buckets.items()}
+        )
+
+    def add(self, feed, name, value=1):
+        """
+        Adds to a counter of a feed.
+
+        Args:
+            feed (str): The feed (folder name).
+            name (str): The name of the counter, one of counter_names.
+            value (int, optional): The value added. Defaults to 1.
+        """
+        with self._lock:
+            self._counters[feed][name] += value
+
+    def observe(self, feed, name, value):
+        """
+        Adds a value to a histogram of a feed.
+
+        Args:
+            feed (str): The feed (folder name).
+            name (str): The name of the histogram, one of histogram_buckets.
+            value (float): The value observed.
+        """
+        with self._lock:
+            self._histograms[feed][name].observe(value)
+
+    def record_batch(self, feed, event_count, size, max_size, latency):
+        """
+        Records a batch acknowledged by Event Hub.
+
+        Args:
+            feed (str): The feed (folder name).
+            event_count (int): The number of events of the batch.
+            size (int): The size of the batch in bytes.
+            max_size (int): The maximum size of the batch in bytes.
+            latency (float): The time the batch took to be sent, in seconds.
+        """
+        with self._lock:
+            counters = self._counters[feed]
+            counters["events_sent"] += event_count
+            counters["bytes_sent"] += size
+            counters["batches_sent"] += 1
+            histograms = self._histograms[feed]
+            histograms["send_latency_seconds"].observe(latency)
+            if max_size:
+                histograms["batch_fill_ratio"].observe(size / max_size)
+
+    def snapshot(self):
+        """
+        Returns the current values of each feed.
+
+        Returns:
+            dict: For each feed, its counters and, for each histogram, its count, sum, p50 and p99.
+        """
+        with self._lock:
+            feeds = {}
+            for feed in sorted(set(self._counters) | set(self._histograms)):
+                values = dict(self._counters[feed])
+                for name, histogram in self._histograms[feed].items():
+                    values[name] = {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p99": histogram.quantile(0.99),
+                    }
+                feeds[feed] = values
+            return feeds
+
+    def render_prometheus(self, prefix="sensor"):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        Args:
+            prefix (str, optional): The prefix of the metric names. Defaults to 'sensor'.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            feeds = sorted(set(self._counters) | set(self._histograms))
+            for name in counter_names:
+                lines.append(f"# HELP {prefix}_{name}_total {descriptions[name]}")
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for feed in feeds:
+                    lines.append(f'{prefix}_{name}_total{{feed="{feed}"}} {self._counters[feed][name]}')
+
+            for name in histogram_buckets:
+                lines.append(f"# HELP {prefix}_{name} {descriptions[name]}")
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for feed in feeds:
+                    histogram = self._histograms[feed][name]
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{prefix}_{name}_bucket{{feed="{feed}",le="{le}"}} {cumulative}')
+                    lines.append(f'{prefix}_{name}_sum{{feed="{feed}"}} {histogram.sum}')
+                    lines.append(f'{prefix}_{name}_count{{feed="{feed}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics in the Prometheus text format on GET /metrics, from a background thread.
+
+    Attributes:
+        metrics (ProducerMetrics): The metrics served.
+        address (tuple): The (host, port) the server listens on.
+    """
+
+    def __init__(self, metrics, port, host="0.0.0.0"):
+        """
+        Args:
+            metrics (ProducerMetrics): The metrics served.
+            port (int): The port to listen on, 0 for any free port.
+            host (str, optional): The interface to listen on. Defaults to all of them.
+        """
+        self.metrics = metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                # The scrapes are not printed
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsReporter:
+    """
+    Prints the metrics as one JSON line per interval, from a background thread, with the batches, events, bytes
+    and records per second of each feed over the interval.
+    """
+
+    def __init__(self, metrics, interval, output=print, clock=time.monotonic):
+        """
+        Args:
+            metrics (ProducerMetrics): The metrics printed.
+            interval (float): The time between two lines, in seconds.
+            output (function, optional): Called with each line. Defaults to print.
+            clock (function, optional): The clock measuring the intervals. Defaults to time.monotonic.
+        """
+        self.metrics = metrics
+        self.interval = interval
+        self.output = output
+        self.clock = clock
+        self._previous = (clock(), {})
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def report(self):
+        """
+        Prints the metrics and the rates since the previous report.
+        """
+        now = self.clock()
+        feeds = self.metrics.snapshot()
+        previous_time, previous_feeds = self._previous
+        elapsed = now - previous_time
+        for feed, values in feeds.items():
+            previous = previous_feeds.get(feed, {})
+            for name, rate_name in rates.items():
+                values[rate_name] = (values[name] - previous.get(name, 0)) / elapsed if elapsed > 0 else None
+        self._previous = (now, feeds)
+        self.output(json.dumps({"time": time.time(), "interval": elapsed, "feeds": feeds}))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
@@ -0,0 +1,395 @@
+"""
+This script contains the asynchronous pipeline sending the generated files to Event Hub.
+
+The file watcher of sensor.py (or its socket listener) hands file paths to the pipeline, whose event loop runs in
+a background thread. Each Event Hub has its own bounded queue, workers and HubSender, so a backlog on one hub does
+not hold back the other. The files are streamed into batches as they are read, keyed so that the records of a user
+or device stay in order on one partition (across files too, as a keyed hub sends its files one at a time unless
+another worker count is given), optionally packed as arrow-zstd events, checkpointed as their batches are
+acknowledged, retried and dead-lettered on failure, and measured per folder (see the other modules of src/Ingestion
+and the arguments of IngestionPipeline).
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from azure.eventhub import EventData
+
+from src.Simulation.output_sinks import read_json_lines_from
+
+from .checkpoint_store import OffsetTracker
+from .dead_letter import DeadLetterSpool
+from .event_encoding import create_event, encodings
+from .hub_sender import HubSender
+
+
+class IngestionPipeline:
+    """
+    Sends the files handed over by the watcher to the Event Hub of their folder.
+
+    Attributes:
+        senders (dict): The HubSender of each folder name.
+        queue_size (int): The maximum number of files waiting to be sent to each Event Hub.
+        worker_counts (dict): The number of files sent at the same time to the Event Hub of each folder name.
+        key_fields (dict): The field of the records used as partition key, for some folder names.
+        validate (bool): Whether each line is parsed before being sent.
+        encoding (str): 'json' for one event per record, 'arrow-zstd' to pack the records of a chunk into one event
+            per partition.
+        chunk_size (int): The number of lines read at a time.
+        checkpoint_store (CheckpointStore): The store of the acknowledged position of each file, None for no checkpoints.
+        after_send (str): What is done with a fully sent file: 'keep', 'move' (to sent_dir) or 'delete'.
+        sent_dir (str): The directory the fully sent files are moved to, in a subdirectory per folder.
+        metrics (ProducerMetrics): The metrics of the pipeline, None for no metrics.
+        loop (asyncio.AbstractEventLoop): The event loop of the pipeline, running in a background thread.
+
+    Methods:
+        start: Starts the event loop, the senders and the workers.
+        submit: Queues a file to be sent, blocking while the queue of its Event Hub is full.
+        send: Sends events directly and waits until they are sent.
+        status: Returns the files queued, the files being sent and the batches in flight of each Event Hub.
+        stop: Waits until the queued files are sent, then closes the clients.
+    """
+
+    def __init__(
+        self,
+        clients,
+        queue_size=100,
+        worker_count=None,
+        max_in_flight=4,
+        limits=None,
+        key_fields=None,
+        validate=False,
+        encoding="json",
+        chunk_size=500,
+        checkpoint_store=None,
+        after_send="keep",
+        sent_dir="monitoring/sent",
+        metrics=None,
+        tracer=None,
+        retry_policy=None,
+        dead_letter_dir=None,
+    ):
+        """
+        Args:
+            clients (dict): A dictionary of folder names to asynchronous Event Hub producer clients.
+            queue_size (int, optional): The maximum number of files waiting to be sent to each Event Hub.
+                Defaults to 100.
+            worker_count (int, optional): The number of files sent at the same time to each Event Hub. Defaults to 1
+                for the folders with a key field, so the records of a key keep their order across files, and 4 for
+                the others.
+            max_in_flight (int, optional): The maximum number of batches being sent at the same time
+                to each Event Hub. Defaults to 4.
+            limits (dict, optional): The (worker_count, max_in_flight) of some folder names, overriding
+                the defaults for their Event Hub. Defaults to None.
+            key_fields (dict, optional): The field of the records used as partition key, for some folder names,
+                e.g. {"metric_feed": "user_id"}. The events of the other folders go to any partition. Defaults to None.
+            validate (bool, optional): Whether each line is parsed before being sent. Defaults to False.
+            encoding (str, optional): 'json' or 'arrow-zstd'. The arrow-zstd events hold up to chunk_size records,
+                and their lines are always parsed. Defaults to 'json'.
+            chunk_size (int, optional): The number of lines read at a time. Defaults to 500.
+            checkpoint_store (CheckpointStore, optional): The store of the acknowledged position of each file.
+                Defaults to None.
+            after_send (str, optional): 'keep', 'move' or 'delete' the fully sent files. Defaults to 'keep'.
+            sent_dir (str, optional): The directory the fully sent files are moved to. Defaults to 'monitoring/sent'.
+            metrics (ProducerMetrics, optional): The metrics of the pipeline. Defaults to None.
+            tracer (opentelemetry.trace.Tracer, optional): The tracer of the batches sent, one span per batch.
+                Defaults to None.
+            retry_policy (RetryPolicy, optional): The retry policy of the failed batches. Defaults to None.
+            dead_letter_dir (str, optional): The directory the batches failing after their retries are spooled to,
+                None to fail the file instead. Defaults to None.
+        """
+        if after_send not in ("keep", "move", "delete"):
+            raise ValueError("Unknown after_send, choose 'keep', 'move' or 'delete'")
+        if encoding not in encodings:
+            raise ValueError("Unknown encoding, choose 'json' or 'arrow-zstd'")
+        limits = limits or {}
+        self.senders = {}
+        self.worker_counts = {}
+        for folder_name, client in clients.items():
+            default_worker_count = worker_count
+            if default_worker_count is None:
+                default_worker_count = 1 if folder_name in (key_fields or {}) else 4
+            hub_worker_count, hub_max_in_flight = limits.get(folder_name, (default_worker_count, max_in_flight))
+            spool = DeadLetterSpool(os.path.join(dead_letter_dir, folder_name)) if dead_letter_dir else None
+            self.senders[folder_name] = HubSender(
+                client, hub_max_in_flight, folder_name, metrics, tracer, retry_policy=retry_policy, spool=spool
+            )
+            self.worker_counts[folder_name] = hub_worker_count
+        self.queue_size = queue_size
+        self.key_fields = key_fields or {}
+        # The value of a key field is found in the raw line with a regular expression instead of parsing it
+        self._key_patterns = {
+            folder_name: re.compile(rb'"' + re.escape(field.encode("utf-8")) + rb'"\s*:\s*"?([^",}\s]*)')
+            for folder_name, field in self.key_fields.items()
+        }
+        self.validate = validate
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.checkpoint_store = checkpoint_store
+        self.after_send = after_send
+        self.sent_dir = sent_dir
+        self.metrics = metrics
+        self.loop = asyncio.new_event_loop()
+        self._queues = {}
+        # The number of files being sent to each Event Hub
+        self._sending = dict.fromkeys(clients, 0)
+        self._workers = []
+        # The files queued or being sent, a file submitted twice is only sent once
+        self._active = set()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def _run(self, coroutine):
+        """
+        Runs a coroutine in the event loop of the pipeline from another thread and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def start(self):
+        """
+        Starts the event loop in a background thread, then the senders and the workers.
+        """
+        self._thread.start()
+        self._run(self._start())
+
+    async def _start(self):
+        for folder_name, sender in self.senders.items():
+            await sender.start()
+            self._queues[folder_name] = asyncio.Queue(maxsize=self.queue_size)
+            self._workers.extend(
+                asyncio.ensure_future(self._worker(folder_name)) for _ in range(self.worker_counts[folder_name])
+            )
+
+    def submit(self, folder_name, file_path):
+        """
+        Queues a file to be sent to the Event Hub of its folder. Blocks while the queue of that Event Hub is full.
+        A file already queued or being sent is not queued again.
+
+        Args:
+            folder_name (str): The name of the folder of the file.
+            file_path (str): The path of the file.
+        """
+        self._run(self._enqueue(folder_name, file_path))
+
+    async def _enqueue(self, folder_name, file_path):
+        if file_path in self._active:
+            return
+        self._active.add(file_path)
+        await self._queues[folder_name].put(file_path)
+
+    def send(self, folder_name, lines):
+        """
+        Sends records to the Event Hub of a folder and waits until they are sent.
+
+        Args:
+            folder_name (str): The name of the folder (metric_feed or device_feed).
+            lines (list): One JSON document per record (bytes).
+
+        Returns:
+            int: The number of batches sent.
+        """
+        if self.metrics is not None:
+            self.metrics.add(folder_name, "records_read", len(lines))
+        events = self._events(folder_name, [(line, None) for line in lines], None, {"events": 0, "invalid": 0})
+        keys = [key for _, _, key in events]
+        return self._run(self.senders[folder_name].send_events([event for event, _, _ in events], keys))
+
+    def _key(self, folder_name, line):
+        """
+        Returns the value of the key field of a raw line, None if the folder has no key field.
+        """
+        pattern = self._key_patterns.get(folder_name)
+        if pattern is None:
+            return None
+        match = pattern.search(line)
+        return match.group(1) if match else None
+
+    def status(self):
+        """
+        Returns the state of the queue of each Event Hub, to see which one is behind.
+
+        Returns:
+            dict: The number of files queued, files being sent and batches in flight of each folder name.
+        """
+        return self._run(self._status())
+
+    async def _status(self):
+        return {
+            folder_name: {
+                "queued_files": self._queues[folder_name].qsize(),
+                "sending_files": self._sending[folder_name],
+                "batches_in_flight": sender.in_flight,
+            }
+            for folder_name, sender in self.senders.items()
+        }
+
+    async def _worker(self, folder_name):
+        """
+        Sends the queued files of an Event Hub one after the other.
+        """
+        queue = self._queues[folder_name]
+        while True:
+            file_path = await queue.get()
+            self._sending[folder_name] += 1
+            try:
+                await self.send_file(folder_name, file_path)
+            except Exception as error:
+                print(f"Failed to send {file_path}: {error}")
+            finally:
+                self._sending[folder_name] -= 1
+                self._active.discard(file_path)
+                queue.task_done()
+
+    async def send_file(self, folder_name, file_path):
+        """
+        Reads a file (jsonl, compressed jsonl, parquet or arrow) and sends its records to the Event Hub of its folder.
+
+        Args:
+            folder_name (str): The name of the folder of the file.
+            file_path (str): The path of the file.
+        """
+        start = 0
+        tracker = None
+        if self.checkpoint_store is not None:
+            start = self.checkpoint_store.position(file_path)
+            tracker = OffsetTracker(lambda position: self.checkpoint_store.commit(file_path, position), start)
+
+        # The lag of the file is measured from its last modification
+        modified = os.path.getmtime(file_path)
+        counts = {"events": 0, "invalid": 0}
+        batch_count = await self.senders[folder_name].send_stream(
+            self._read_events(folder_name, file_path, start, counts), tracker
+        )
+        if self.metrics is not None:
+            self.metrics.observe(folder_name, "file_lag_seconds", max(time.time() - modified, 0.0))
+            self.metrics.add(folder_name, "files_sent")
+
+        resumed = f" (resumed at {start})" if start else ""
+        invalid = f", skipped {counts['invalid']} invalid lines" if counts["invalid"] else ""
+        print(f"Sent {counts['events']} records in {batch_count} batches from {file_path}{resumed}{invalid}")
+        self._finish(folder_name, file_path)
+
+    def _finish(self, folder_name, file_path):
+        """
+        Moves or deletes a fully sent file, then removes its checkpoint.
+        """
+        if self.after_send == "move":
+            destination = os.path.join(self.sent_dir, folder_name)
+            os.makedirs(destination, exist_ok=True)
+            shutil.move(file_path, os.path.join(destination, os.path.basename(file_path)))
+        elif self.after_send == "delete":
+            os.remove(file_path)
+        else:
+            return
+
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.forget(file_path)
+
+    async def _read_events(self, folder_name, file_path, start, counts):
+        """
+        Reads a file chunk by chunk from a position and converts its lines to events.
+
+        Args:
+            folder_name (str): The name of the folder of the file.
+            file_path (str): The path of the file.
+            start (int): The position to read from (see read_json_lines_from).
+            counts (dict): The number of events read and of invalid lines skipped, updated while reading.
+
+        Yields:
+            list: The (EventData, position, key) tuples of the next chunk of lines.
+        """
+        lines = read_json_lines_from(file_path, start)
+        while True:
+            # The lines are read in a thread so the event loop keeps sending the batches meanwhile
+            chunk = await self.loop.run_in_executor(None, lambda: list(itertools.islice(lines, self.chunk_size)))
+            if not chunk:
+                return
+            if self.metrics is not None:
+                self.metrics.add(folder_name, "records_read", len(chunk))
+            # The lines are parsed and packed in the thread as well
+            yield await self.loop.run_in_executor(None, self._events, folder_name, chunk, start, counts)
+            start = chunk[-1][1]
+
+    def _events(self, folder_name, lines, start, counts):
+        """
+        Converts lines to (EventData, position, key) tuples, one event per record or per packed group of records.
+
+        Args:
+            folder_name (str): The name of the folder of the lines.
+            lines (list): The (line, position) tuples read.
+            start (int): The position before the first line, None if the positions are not needed.
+            counts (dict): The number of records and of invalid lines skipped, updated with these lines.
+
+        Returns:
+            list: The (EventData, position, key) tuples.
+        """
+        if self.encoding == "arrow-zstd":
+            return self._pack(folder_name, lines, start, counts)
+        if self.validate:
+            records = [
+                (json.dumps(record), position, key) for record, position, key in self._parse(folder_name, lines, counts)
+            ]
+        else:
+            records = [(line, position, self._key(folder_name, line)) for line, position in lines]
+        counts["events"] += len(records)
+        return [(EventData(line), position, key) for line, position, key in records]
+
+    def _parse(self, folder_name, lines, counts):
+        """
+        Keeps the lines that are valid JSON objects, parsed, with their position and key.
+        """
+        key_field = self.key_fields.get(folder_name)
+        valid = []
+        for line, position in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                key = record.get(key_field) if key_field else None
+                valid.append((record, position, None if key is None else str(key).encode("utf-8")))
+            else:
+                counts["invalid"] += 1
+        return valid
+
+    def _pack(self, folder_name, lines, start, counts):
+        """
+        Packs the records of lines into one arrow-zstd event per partition (a single event without key field).
+
+        Only the last event has the position after the lines, the others have the position before them,
+        so the position of the lines is committed once all their events are acknowledged.
+        """
+        sender = self.senders[folder_name]
+        # The records and the key of the first of them, for each partition
+        groups = {}
+        for record, _, key in self._parse(folder_name, lines, counts):
+            groups.setdefault(sender.partition_for(key), ([], key))[0].append(record)
+            counts["events"] += 1
+
+        events = [(create_event(records), start, key) for records, key in groups.values()]
+        if events:
+            events[-1] = (events[-1][0], lines[-1][1], events[-1][2])
+        return events
+
+    def stop(self):
+        """
+        Waits until the queued files are sent, then closes the clients and stops the event loop.
+        """
+        self._run(self._stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def _stop(self):
+        for queue in self._queues.values():
+            await queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        for sender in self.senders.values():
+            await sender.close()
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.close()
@@ -0,0 +1,83 @@
+"""
+This script contains the retry policy of the batches sent to Event Hub.
+
+A batch whose send fails with a transient error (the Event Hub is busy, the connection was lost, the send timed out)
+is sent again after a delay growing exponentially with the attempt, with full jitter so the senders that failed
+at the same time do not retry at the same time. When the Event Hub is throttling (ServerBusy), the delay is at
+least busy_delay, as the service asks. The number of batches waiting to be retried at the same time is capped,
+so a throttled Event Hub is not sent more retries than it recovers from.
+"""
+
+import random
+
+from azure.eventhub.exceptions import AuthenticationError, EventDataError
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed send is retried.
+
+    Attributes:
+        max_retries (int): The number of times a batch is sent again before giving up.
+        base_delay (float): The delay of the first retry, doubled at each attempt, in seconds.
+        max_delay (float): The longest delay between two attempts, in seconds.
+        busy_delay (float): The shortest delay after a ServerBusy error, in seconds.
+        max_retrying (int): The maximum number of batches being retried at the same time by a sender.
+
+    Methods:
+        is_retryable: Returns whether an error is transient.
+        delay: Returns the time to wait before an attempt.
+    """
+
+    def __init__(self, max_retries=5, base_delay=0.5, max_delay=30.0, busy_delay=4.0, max_retrying=2, seed=None):
+        """
+        Args:
+            max_retries (int, optional): The number of times a batch is sent again before giving up. Defaults to 5.
+            base_delay (float, optional): The delay of the first retry in seconds. Defaults to 0.5.
+            max_delay (float, optional): The longest delay between two attempts in seconds. Defaults to 30.
+            busy_delay (float, optional): The shortest delay after a ServerBusy error in seconds. Defaults to 4.
+            max_retrying (int, optional): The maximum number of batches being retried at the same time. Defaults to 2.
+            seed (int, optional): The seed of the jitter. Defaults to None.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.busy_delay = busy_delay
+        self.max_retrying = max_retrying
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def is_busy(error):
+        """
+        Returns whether an error is the throttling of the Event Hub (ServerBusy).
+        """
+        message = str(error).lower()
+        return "server-busy" in message or "serverbusy" in message or "server busy" in message
+
+    def is_retryable(self, error):
+        """
+        Returns whether an error is transient. Invalid events and rejected credentials fail again however long we wait.
+
+        Args:
+            error (Exception): The error raised by the send.
+
+        Returns:
+            bool: True if the send can be retried.
+        """
+        return not isinstance(error, (EventDataError, AuthenticationError, ValueError, TypeError))
+
+    def delay(self, attempt, error=None):
+        """
+        Returns the time to wait before an attempt, with full jitter.
+
+        Args:
+            attempt (int): The number of the retry, from 1.
+            error (Exception, optional): The error of the previous attempt. Defaults to None.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if error is not None and self.is_busy(error):
+            delay = max(delay, self.busy_delay)
+        return delay
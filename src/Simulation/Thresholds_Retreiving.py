@@ -1,13 +1,29 @@
 """
-This script is used to retreive the thresholds, user_id_age, user_id_condition, user_id_medication, 
+This script is used to retreive the thresholds, user_id_age, user_id_condition, user_id_medication,
 user_device_id, and user_device_interval from the database.
 
 They will help in creating the user behavior and factors that might affect glucose levels for the simulation.
+
+Nothing is retrieved at import time, load_results returns the six result sets from one of the sources:
+- "database": one joined query to the database, the rows are then saved to the local snapshot.
+- "snapshot": the local snapshot (a JSON file) if it is fresh enough, otherwise the database.
+- "synthetic": synthetic results generated in memory, no database needed.
+
+The source, the snapshot path, its maximum age and the number of synthetic users are set in the
+"simulation_data" section of config.json. The source, the number of synthetic users and their seed can be overridden with
+the SIMULATION_DATA_SOURCE, SIMULATION_SYNTHETIC_USERS and SIMULATION_SEED environment variables.
+
+Running the script refreshes the snapshot from the database.
 """
 
+import json
 import logging
 import os
-import mysql.connector
+import random
+import time
+from collections import namedtuple
+from pathlib import Path
+
 from dotenv import find_dotenv, load_dotenv
 
 load_dotenv(find_dotenv())
@@ -22,7 +38,72 @@ username = os.getenv("user")
 password = os.getenv("password")
 database = os.getenv("database")
 
+# Get the root directory of the project and the path to the configuration file
+root_dir = Path(__file__).resolve().parents[2]
+config_file_path = root_dir / "config.json"
 
+# The six result sets, in the order expected by PatientRegistry
+Results = namedtuple(
+    "Results",
+    [
+        "thresholds",
+        "user_id_age",
+        "user_id_condition",
+        "user_id_medication",
+        "user_device_id",
+        "user_device_interval",
+    ],
+)
+
+# One row per user and device, every result set is a projection of it
+joined_query = '''
+    SELECT user.user_id, user.age, medical_info.min_glucose, medical_info.max_glucose,
+           medical_info.medical_condition, medical_info.medication,
+           pd.device_id, device_settings.data_transmission_interval
+    FROM user
+    LEFT JOIN medical_info ON medical_info.user_id = user.user_id
+    LEFT JOIN patient_device pd ON pd.user_id = user.user_id
+    LEFT JOIN device_settings ON pd.device_id = device_settings.device_id
+    ORDER BY user.user_id, pd.patient_device_id
+'''
+
+columns = [
+    "user_id",
+    "age",
+    "min_glucose",
+    "max_glucose",
+    "medical_condition",
+    "medication",
+    "device_id",
+    "data_transmission_interval",
+]
+
+# Values of the synthetic results, the same ranges as the ones in config.json used to fill the tables
+conditions = ["Type 1 Diabetes", "Type 2 Diabetes", "Prediabetes", "Hypoglycemia", "Hyperglycemia"]
+medications = ["Insulin Glargine", "Metformin", "Insulin Lispro", "Glipizide", "Sitagliptin"]
+
+
+def read_config():
+    """
+    Reads the "simulation_data" section of config.json, with the environment variables overriding it
+    :return: The source, snapshot_path, max_age_hours, synthetic_users and seed settings
+    """
+    settings = {
+        "source": "snapshot",
+        "snapshot_path": "simulation_snapshot.json",
+        "max_age_hours": 24,
+        "synthetic_users": 200,
+        "seed": None,
+    }
+    if config_file_path.exists():
+        with open(config_file_path) as json_file:
+            settings.update(json.load(json_file).get("simulation_data", {}))
+
+    settings["source"] = os.getenv("SIMULATION_DATA_SOURCE", settings["source"])
+    settings["synthetic_users"] = int(os.getenv("SIMULATION_SYNTHETIC_USERS", settings["synthetic_users"]))
+    if os.getenv("SIMULATION_SEED"):
+        settings["seed"] = int(os.getenv("SIMULATION_SEED"))
+    return settings
 
 
 def fetch_data(cursor, query):
@@ -37,25 +118,172 @@ def fetch_data(cursor, query):
     return list(cursor)
 
 
-# Retreives user_id, min_glucose, and max_glucose, user_id_age, 
-# user_id_condition, user_id_medication, user_device_id, and user_device_interval from the database.
-with mysql.connector.connect(user=username, password=password, host=host, database=database) as cnx:
-    
-    try:
-        with cnx.cursor() as cursor:
-            thresholds = fetch_data(cursor, 'SELECT user_id, min_glucose, max_glucose FROM medical_info')
-            user_id_age = fetch_data(cursor, 'SELECT user_id, age FROM user')
-            user_id_condition = fetch_data(cursor, 'SELECT user_id, medical_condition FROM medical_info')
-            user_id_medication = fetch_data(cursor, 'SELECT user_id, medication FROM medical_info')
-            user_device_id = fetch_data(cursor, 'SELECT user_id, device_id FROM patient_device')
-            user_device_interval = fetch_data(cursor, '''
-                SELECT user.user_id, device_settings.data_transmission_interval
-                FROM patient_device pd
-                JOIN user ON pd.user_id = user.user_id
-                JOIN device_settings ON pd.device_id = device_settings.device_id
-            ''')
-    except Exception as e:
-        logging.error(e)
-        raise e
-
-logging.info('Finished retrieving thresholds, user_device_id, and user_device_interval, user_id_age, user_id_condition, user_id_medication')
\ No newline at end of file
+def fetch_rows():
+    """
+    Retreives the joined rows of user, medical_info, patient_device and device_settings from the database
+    :return: The rows, in the order of columns
+    """
+    import mysql.connector
+
+    with mysql.connector.connect(user=username, password=password, host=host, database=database) as cnx:
+        try:
+            with cnx.cursor() as cursor:
+                rows = fetch_data(cursor, joined_query)
+        except Exception as e:
+            logging.error(e)
+            raise e
+
+    logging.info(f'Retrieved {len(rows)} rows of user, medical and device information')
+    return rows
+
+
+def _distinct(rows):
+    """
+    Removes the duplicate rows and the rows with a missing value, keeping the order of the first occurrences
+    :param rows: The rows
+    :return: The distinct complete rows
+    """
+    return [row for row in dict.fromkeys(rows) if None not in row]
+
+
+def split_rows(rows):
+    """
+    Splits the joined rows into the six result sets
+    :param rows: The rows, in the order of columns
+    :return: The Results
+    """
+    return Results(
+        thresholds=_distinct((row[0], row[2], row[3]) for row in rows),
+        user_id_age=_distinct((row[0], row[1]) for row in rows),
+        user_id_condition=_distinct((row[0], row[4]) for row in rows),
+        user_id_medication=_distinct((row[0], row[5]) for row in rows),
+        user_device_id=_distinct((row[0], row[6]) for row in rows),
+        user_device_interval=_distinct((row[0], row[7]) for row in rows if row[6] is not None),
+    )
+
+
+def save_snapshot(rows, snapshot_path):
+    """
+    Saves the joined rows to a JSON snapshot, written to a temporary file first and then renamed
+    :param rows: The rows, in the order of columns
+    :param snapshot_path: The path of the snapshot
+    """
+    snapshot_tmp = f"{snapshot_path}.tmp"
+    with open(snapshot_tmp, "w") as file:
+        json.dump({"columns": columns, "rows": [list(row) for row in rows]}, file, default=float)
+    os.replace(snapshot_tmp, snapshot_path)
+
+
+def load_snapshot(snapshot_path):
+    """
+    Loads the joined rows from a JSON snapshot
+    :param snapshot_path: The path of the snapshot
+    :return: The rows, in the order of columns
+    """
+    with open(snapshot_path) as file:
+        snapshot = json.load(file)
+    positions = [snapshot["columns"].index(name) for name in columns]
+    return [tuple(row[position] for position in positions) for row in snapshot["rows"]]
+
+
+def snapshot_is_fresh(snapshot_path, max_age_hours):
+    """
+    Checks whether the snapshot exists and was saved less than max_age_hours ago
+    :param snapshot_path: The path of the snapshot
+    :param max_age_hours: The maximum age of the snapshot in hours, None for no limit
+    :return: True if the snapshot can be used, False otherwise
+    """
+    if not os.path.exists(snapshot_path):
+        return False
+    if max_age_hours is None:
+        return True
+    return time.time() - os.path.getmtime(snapshot_path) < max_age_hours * 3600
+
+
+def synthetic_results(user_count, seed=None):
+    """
+    Creates synthetic results shaped like the ones retrieved from the database, user n having the device n
+    :param user_count: The number of users
+    :param seed: The seed of the random values
+    :return: The Results
+    """
+    rng = random.Random(seed)
+    user_ids = range(1, user_count + 1)
+    return Results(
+        thresholds=[(user_id, rng.uniform(65, 105), rng.uniform(145, 185)) for user_id in user_ids],
+        user_id_age=[(user_id, rng.randint(18, 90)) for user_id in user_ids],
+        user_id_condition=[(user_id, rng.choice(conditions)) for user_id in user_ids],
+        user_id_medication=[(user_id, rng.choice(medications)) for user_id in user_ids],
+        user_device_id=[(user_id, user_id) for user_id in user_ids],
+        user_device_interval=[(user_id, rng.randint(1, 4)) for user_id in user_ids],
+    )
+
+
+def refresh_snapshot(snapshot_path):
+    """
+    Retreives the rows from the database and saves them to the snapshot
+    :param snapshot_path: The path of the snapshot
+    :return: The rows
+    """
+    rows = fetch_rows()
+    save_snapshot(rows, snapshot_path)
+    logging.info(f'Saved the snapshot {snapshot_path}')
+    return rows
+
+
+def load_results(source=None, snapshot_path=None, max_age_hours=None, user_count=None, seed=None):
+    """
+    Returns the six result sets used to build the patient registry
+    :param source: "database", "snapshot" or "synthetic", defaults to the configured source
+    :param snapshot_path: The path of the snapshot, defaults to the configured path (relative to the project root)
+    :param max_age_hours: The maximum age of the snapshot in hours, defaults to the configured age
+    :param user_count: The number of synthetic users, defaults to the configured number
+    :param seed: The seed of the synthetic results, defaults to the configured seed
+    :return: The Results
+    """
+    settings = read_config()
+    source = source or settings["source"]
+    snapshot_path = str(root_dir / (snapshot_path or settings["snapshot_path"]))
+    max_age_hours = settings["max_age_hours"] if max_age_hours is None else max_age_hours
+
+    if source == "synthetic":
+        return synthetic_results(
+            user_count or settings["synthetic_users"], settings["seed"] if seed is None else seed
+        )
+
+    if source == "snapshot":
+        if snapshot_is_fresh(snapshot_path, max_age_hours):
+            try:
+                rows = load_snapshot(snapshot_path)
+                logging.info(f'Loaded {len(rows)} rows from the snapshot {snapshot_path}')
+                return split_rows(rows)
+            except (ValueError, KeyError) as e:
+                logging.warning(f'The snapshot could not be loaded: {e}')
+        return split_rows(refresh_snapshot(snapshot_path))
+
+    if source == "database":
+        return split_rows(refresh_snapshot(snapshot_path))
+
+    raise ValueError(f"Unknown data source {source}, choose 'database', 'snapshot' or 'synthetic'")
+
+
+_results = None
+
+
+def __getattr__(name):
+    """
+    Loads the results on first access to one of the result sets, for the modules importing them by name
+    """
+    global _results
+    if name not in Results._fields:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _results is None:
+        _results = load_results()
+    return getattr(_results, name)
+
+
+if __name__ == "__main__":
+    settings = read_config()
+    snapshot_path = str(root_dir / settings["snapshot_path"])
+    rows = refresh_snapshot(snapshot_path)
+    print(f"Saved {len(rows)} rows to {snapshot_path}")
@@ -0,0 +1,94 @@
+"""
+This script contains the index of the disconnection periods of the devices.
+
+The device generator appends a period each time a device disconnects, and the patient generator checks
+whether a reading falls within one of the periods of its device. Periods are kept per device as two
+parallel arrays of epoch seconds (starts and ends), sorted by start, so a check is a binary search
+without rebuilding any list.
+"""
+
+import bisect
+from array import array
+
+
+class DisconnectionIndex:
+    """
+    Index of the disconnection periods of each device.
+
+    Attributes:
+        starts (dict): The start of each period in epoch seconds, per device ID, sorted.
+        ends (dict): The end of each period in epoch seconds, per device ID, parallel to starts.
+
+    Methods:
+        append: Adds a disconnection period to a device.
+        latest: Returns the most recent disconnection period of a device.
+        contains: Checks whether a timestamp falls within one of the disconnection periods of a device.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def __contains__(self, device_id):
+        return device_id in self.starts
+
+    def __len__(self):
+        return sum(len(starts) for starts in self.starts.values())
+
+    def append(self, device_id, start, end):
+        """
+        Adds a disconnection period to a device.
+
+        Periods are generated in time order, so they are appended at the end. A period starting before
+        the latest one is inserted at its position to keep the arrays sorted.
+
+        Args:
+            device_id (int): The ID of the device.
+            start (float): The start of the period in epoch seconds.
+            end (float): The end of the period in epoch seconds.
+        """
+        if device_id not in self.starts:
+            self.starts[device_id] = array("d")
+            self.ends[device_id] = array("d")
+
+        starts, ends = self.starts[device_id], self.ends[device_id]
+        if not starts or start >= starts[-1]:
+            starts.append(start)
+            ends.append(end)
+        else:
+            index = bisect.bisect_right(starts, start)
+            starts.insert(index, start)
+            ends.insert(index, end)
+
+    def latest(self, device_id):
+        """
+        Returns the most recent disconnection period of a device.
+
+        Args:
+            device_id (int): The ID of the device.
+
+        Returns:
+            tuple or None: The start and end of the period in epoch seconds, None if the device never disconnected.
+        """
+        if device_id not in self.starts:
+            return None
+        return self.starts[device_id][-1], self.ends[device_id][-1]
+
+    def contains(self, device_id, timestamp):
+        """
+        Checks whether a timestamp falls within one of the disconnection periods of a device.
+
+        Args:
+            device_id (int): The ID of the device.
+            timestamp (float): The timestamp in epoch seconds.
+
+        Returns:
+            bool: True if the device is disconnected at that time, False otherwise.
+        """
+        starts = self.starts.get(device_id)
+        if not starts:
+            return False
+
+        # The period with the latest start at or before the timestamp is the only one that can contain it
+        index = bisect.bisect_right(starts, timestamp) - 1
+        return index >= 0 and timestamp <= self.ends[device_id][index]
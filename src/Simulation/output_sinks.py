@@ -0,0 +1,298 @@
+"""
+This script contains the output sinks the generated records can be written to.
+
+- JsonlFileSink: JSONL files written to a temporary file and renamed into place in the monitored directory (default).
+- CompressedJsonlFileSink: gzip or zstd compressed JSONL files.
+- ArrowFileSink: Parquet or Arrow IPC files holding a batch of records.
+- SocketSink: a local TCP or Unix socket, read by sensor.py in listening mode.
+
+Every sink has the same interface: write(records, output_dir, file_name) and close().
+The records are serialized with their timestamp formatted as a string.
+read_json_lines reads back the files written by the file sinks, one JSON document per record, streaming
+the file instead of loading it whole. read_json_lines_from also gives the position after each record, to resume
+reading a file from there.
+"""
+
+import gzip
+import io
+import json
+import os
+import socket
+
+from .records import to_dict
+
+
+def _import_zstandard():
+    """
+    Imports the optional zstandard package.
+    """
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            "The zstandard package is required for zstd compression: "
+            "poetry install --extras zstd (or pip install zstandard)"
+        ) from error
+    return zstandard
+
+
+def _import_pyarrow():
+    """
+    Imports the optional pyarrow package with its parquet and ipc modules.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "The pyarrow package is required for Parquet and Arrow files: "
+            "poetry install --extras arrow (or pip install pyarrow)"
+        ) from error
+    return pyarrow
+
+
+def parse_address(address):
+    """
+    Parses the address of a socket.
+
+    Args:
+        address (str): 'host:port' for a TCP socket, or the path of a Unix socket.
+
+    Returns:
+        tuple: The socket family and the address in the format expected by the socket module.
+    """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+class JsonlFileSink:
+    """
+    Writes the records to a JSONL file.
+
+    The records are written to a temporary file first, then the file is renamed into place,
+    so the monitored directory never contains a partially written file. The temporary file is in the
+    output directory, so the rename is atomic and sensor.py is notified by a move event as soon as the file is complete.
+    """
+
+    extension = ".jsonl"
+
+    def _write_file(self, file, records):
+        """
+        Writes the records to an open binary file.
+        """
+        file.write("\n".join([json.dumps(to_dict(record)) for record in records]).encode("utf-8"))
+
+    def write(self, records, output_dir, file_name):
+        """
+        Writes the records to a file in the output directory.
+
+        Args:
+            records (list): The records to write.
+            output_dir (str): The directory to write the file to.
+            file_name (str): The name of the file, without extension.
+        """
+        file_path = os.path.join(output_dir, file_name + self.extension)
+        # The extension of the temporary file is not one of the monitored extensions
+        file_tmp = file_path + ".tmp"
+        with open(file_tmp, "wb") as file:
+            self._write_file(file, records)
+
+        os.replace(file_tmp, file_path)
+
+    def close(self):
+        """
+        Nothing to release for file sinks.
+        """
+
+
+class CompressedJsonlFileSink(JsonlFileSink):
+    """
+    Writes the records to a gzip or zstd compressed JSONL file.
+    """
+
+    def __init__(self, compression="gzip", level=None):
+        """
+        Args:
+            compression (str, optional): 'gzip' or 'zstd'. Defaults to 'gzip'.
+            level (int, optional): The compression level. Defaults to the default level of the compression.
+        """
+        if compression == "gzip":
+            self.extension = ".jsonl.gz"
+            self.level = 6 if level is None else level
+        elif compression == "zstd":
+            self.extension = ".jsonl.zst"
+            self.level = 3 if level is None else level
+            self._zstd_compressor = _import_zstandard().ZstdCompressor(level=self.level)
+        else:
+            raise ValueError("Unknown compression, choose 'gzip' or 'zstd'")
+        self.compression = compression
+
+    def _write_file(self, file, records):
+        data = "\n".join([json.dumps(to_dict(record)) for record in records]).encode("utf-8")
+        if self.compression == "gzip":
+            file.write(gzip.compress(data, compresslevel=self.level))
+        else:
+            file.write(self._zstd_compressor.compress(data))
+
+
+class ArrowFileSink(JsonlFileSink):
+    """
+    Writes the records as one columnar batch to a Parquet or Arrow IPC file.
+    """
+
+    def __init__(self, file_format="parquet"):
+        """
+        Args:
+            file_format (str, optional): 'parquet' or 'arrow' (Arrow IPC file). Defaults to 'parquet'.
+        """
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError("Unknown file format, choose 'parquet' or 'arrow'")
+        self.pyarrow = _import_pyarrow()
+        self.file_format = file_format
+        self.extension = "." + file_format
+
+    def _write_file(self, file, records):
+        table = self.pyarrow.Table.from_pylist([to_dict(record) for record in records])
+        if self.file_format == "parquet":
+            self.pyarrow.parquet.write_table(table, file)
+        else:
+            with self.pyarrow.ipc.new_file(file, table.schema) as writer:
+                writer.write_table(table)
+
+
+class SocketSink:
+    """
+    Sends the records to a local TCP or Unix socket (sensor.py --listen).
+
+    Each batch is sent as a JSON header line {"feed": ..., "count": ...} followed by one JSON line per record.
+    """
+
+    def __init__(self, address):
+        """
+        Args:
+            address (str): 'host:port' for a TCP socket, or the path of a Unix socket.
+        """
+        family, socket_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(socket_address)
+
+    def write(self, records, output_dir, file_name):
+        lines = [json.dumps({"feed": os.path.basename(output_dir), "count": len(records)})]
+        lines.extend(json.dumps(to_dict(record)) for record in records)
+        self.socket.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self):
+        self.socket.close()
+
+
+def create_sink(name, address=None):
+    """
+    Creates a sink from its name.
+
+    Args:
+        name (str): One of 'jsonl', 'gzip', 'zstd', 'parquet', 'arrow' or 'socket'.
+        address (str, optional): The address of the socket sink. Defaults to None.
+
+    Returns:
+        The sink.
+    """
+    if name == "jsonl":
+        return JsonlFileSink()
+    if name in ("gzip", "zstd"):
+        return CompressedJsonlFileSink(name)
+    if name in ("parquet", "arrow"):
+        return ArrowFileSink(name)
+    if name == "socket":
+        if address is None:
+            raise ValueError("The socket sink needs an address")
+        return SocketSink(address)
+    raise ValueError(f"Unknown sink {name}")
+
+
+# Extensions of the files written by the file sinks
+file_extensions = (".jsonl", ".jsonl.gz", ".jsonl.zst", ".parquet", ".arrow")
+
+
+def _read_record_batches(file_path):
+    """
+    Reads the record batches of a Parquet or Arrow IPC file one at a time.
+    """
+    pyarrow = _import_pyarrow()
+    if file_path.endswith(".parquet"):
+        yield from pyarrow.parquet.ParquetFile(file_path).iter_batches()
+        return
+
+    with pyarrow.memory_map(file_path) as source:
+        reader = pyarrow.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+
+
+def read_json_lines(file_path, raw=False):
+    """
+    Reads a file written by one of the file sinks, one line (or record batch) at a time.
+
+    Args:
+        file_path (str): The path of the file.
+        raw (bool, optional): Whether to yield the lines as bytes, as they are in the file. Defaults to False.
+
+    Yields:
+        str or bytes: One JSON document per record.
+    """
+    if file_path.endswith((".parquet", ".arrow")):
+        for record_batch in _read_record_batches(file_path):
+            for record in record_batch.to_pylist():
+                line = json.dumps(record)
+                yield line.encode("utf-8") if raw else line
+        return
+
+    mode = "rb" if raw else "rt"
+    if file_path.endswith(".gz"):
+        file = gzip.open(file_path, mode)
+    elif file_path.endswith(".zst"):
+        zstandard = _import_zstandard()
+        file = zstandard.open(file_path, mode)
+        if raw:
+            # The binary zstd reader cannot be iterated line by line on its own
+            file = io.BufferedReader(file)
+    else:
+        file = open(file_path, mode)
+
+    with file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def read_json_lines_from(file_path, start=0):
+    """
+    Reads a file written by one of the file sinks from a position, with the position after each record.
+
+    The position is a byte offset for uncompressed JSONL files, which are read from there directly,
+    and the number of records read for the other files, whose first records are skipped.
+
+    Args:
+        file_path (str): The path of the file.
+        start (int, optional): The position to read from. Defaults to 0.
+
+    Yields:
+        tuple: One JSON document per record (bytes) and the position right after the record.
+    """
+    if file_path.endswith(".jsonl"):
+        with open(file_path, "rb") as file:
+            file.seek(start)
+            position = start
+            for line in file:
+                position += len(line)
+                line = line.strip()
+                if line:
+                    yield line, position
+        return
+
+    for index, line in enumerate(read_json_lines(file_path, raw=True)):
+        if index >= start:
+            yield line, index + 1
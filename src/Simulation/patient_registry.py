@@ -0,0 +1,136 @@
+"""
+This script contains the patient registry used by every generator of the simulation.
+
+The registry is built once from the results retrieved in Thresholds_Retreiving.py and indexes them by user ID
+and device ID, so the lookups done for every generated record (thresholds, interval, device metadata...)
+are dictionary or list lookups instead of scans over the query results.
+"""
+
+import copy
+
+
+def _first_by_key(rows):
+    """
+    Indexes (key, value) rows by key, keeping the first value when a key appears more than once.
+
+    :param rows: The (key, value) rows to index
+
+    :return: A dictionary of the values with the key as the key
+    """
+    index = {}
+    for key, value in rows:
+        index.setdefault(key, value)
+    return index
+
+
+class PatientRegistry:
+    """
+    Indexes the patients, devices and user information used by the simulation.
+
+    Attributes:
+        thresholds (dict): The (min_glucose, max_glucose) of each user ID.
+        ages (dict): The age of each user ID.
+        conditions (dict): The medical condition of each user ID.
+        medications (dict): The medication of each user ID.
+        intervals (dict): The data transmission interval in minutes of each user ID.
+        devices (list): The devices, each a dict with 'device_id' and 'firmware_info'. The device ID n is at position n - 1.
+        patients (list): The patients, each a dict with 'user_id' and 'device_id'.
+
+    Methods:
+        threshold: Returns the glucose thresholds of a user.
+        device: Returns the device with the given device ID.
+        shard: Returns the part of the registry simulated by one shard.
+    """
+
+    # Thresholds used for users without medical information
+    default_threshold = (50, 240)
+
+    def __init__(
+        self,
+        thresholds,
+        user_id_age,
+        user_id_condition,
+        user_id_medication,
+        user_device_id,
+        user_device_interval,
+        firmware_data,
+    ):
+        """
+        Builds the registry from the results retrieved in Thresholds_Retreiving.py.
+
+        Args:
+            thresholds (list): The (user_id, min_glucose, max_glucose) rows.
+            user_id_age (list): The (user_id, age) rows.
+            user_id_condition (list): The (user_id, medical_condition) rows.
+            user_id_medication (list): The (user_id, medication) rows.
+            user_device_id (list): The (user_id, device_id) rows.
+            user_device_interval (list): The (user_id, data_transmission_interval) rows.
+            firmware_data (list): The firmware assigned to the devices in turn.
+        """
+        self.thresholds = _first_by_key(
+            (user_id, (min_glucose, max_glucose)) for user_id, min_glucose, max_glucose in thresholds
+        )
+        self.ages = _first_by_key(user_id_age)
+        self.conditions = _first_by_key(user_id_condition)
+        self.medications = _first_by_key(user_id_medication)
+        self.intervals = _first_by_key(user_device_interval)
+        device_by_user = _first_by_key(user_device_id)
+
+        # There is one device per patient in the database
+        patient_count = len(user_device_id)
+        device_count = patient_count
+
+        self.devices = [
+            {"device_id": i + 1, "firmware_info": firmware_data[i % len(firmware_data)]}
+            for i in range(device_count)
+        ]
+
+        # All the devices by position, kept whole when the registry is sharded
+        self._all_devices = self.devices
+
+        # Here I am using the user_device_id rows to assign device IDs to patients.
+        # This ensures that each patient is assigned the device ID that is already present in the database.
+        # If a user is not in the rows, a device ID is derived from the user ID, so the registry is the same
+        # on every run (and in every worker process).
+        self.patients = [
+            {"user_id": user_id, "device_id": device_by_user.get(user_id) or (user_id - 1) % device_count + 1}
+            for user_id in range(1, patient_count + 1)
+        ]
+
+    def threshold(self, user_id):
+        """
+        Returns the glucose thresholds of a user.
+
+        :param user_id: The ID of the user
+
+        :return: A tuple containing the minimum and maximum glucose thresholds for the user.
+            If the user ID is not found, the default threshold values of 50 and 240 are returned.
+        """
+        return self.thresholds.get(user_id, self.default_threshold)
+
+    def device(self, device_id):
+        """
+        Returns the device with the given device ID.
+
+        :param device_id: The ID of the device
+
+        :return: The device as a dict with 'device_id' and 'firmware_info'
+        """
+        return self._all_devices[device_id - 1]
+
+    def shard(self, index, count):
+        """
+        Returns the part of the registry simulated by one shard.
+
+        Devices are partitioned by device ID, and patients follow their device, so the disconnections
+        of a device are always known by the shard generating the records of its patients.
+
+        :param index: The index of the shard, from 0 to count - 1
+        :param count: The number of shards
+
+        :return: A PatientRegistry with the devices and patients of the shard
+        """
+        shard = copy.copy(self)
+        shard.devices = [device for device in self.devices if (device["device_id"] - 1) % count == index]
+        shard.patients = [patient for patient in self.patients if (patient["device_id"] - 1) % count == index]
+        return shard
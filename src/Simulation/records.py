@@ -0,0 +1,107 @@
+"""
+This script contains the compact record types produced by the simulation.
+
+Records use __slots__ instead of a per-record dict, and their timestamp is an integer number of epoch seconds.
+The timestamp is only formatted as a "%Y-%m-%dT%H:%M:%S" string when the record is serialized with to_dict,
+so sorting records is integer-based and a record takes several times less memory than the equivalent dict.
+"""
+
+import datetime
+
+timestamp_format = "%Y-%m-%dT%H:%M:%S"
+
+
+def format_timestamp(timestamp):
+    """
+    Formats an epoch seconds timestamp in the format of the generated data.
+
+    Args:
+        timestamp (int): The timestamp in epoch seconds.
+
+    Returns:
+        str: The timestamp in the format "%Y-%m-%dT%H:%M:%S" (local time).
+    """
+    return datetime.datetime.fromtimestamp(timestamp).strftime(timestamp_format)
+
+
+class _Record:
+    """
+    Base class of the records, serialized field by field in the order of __slots__.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def to_dict(self):
+        """
+        Returns the record as a dictionary, with the timestamp formatted as a string.
+        """
+        record = {field: getattr(self, field) for field in self.__slots__}
+        record["timestamp"] = format_timestamp(self.timestamp)
+        return record
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class MetricRecord(_Record):
+    """
+    A glucose reading of a patient.
+
+    Attributes:
+        user_id (int): The user ID of the patient.
+        device_id (int): The device ID of the patient.
+        timestamp (int): The timestamp of the reading in epoch seconds.
+        glucose_reading (float): The glucose reading.
+        latitude (float): The latitude of the patient.
+        longitude (float): The longitude of the patient.
+    """
+
+    __slots__ = ("user_id", "device_id", "timestamp", "glucose_reading", "latitude", "longitude")
+
+
+class DeviceRecord(_Record):
+    """
+    A status report of a device.
+
+    Attributes:
+        device_id (int): The ID of the device.
+        battery_level (int): The battery level of the device.
+        firmware_name (str): The name of the firmware installed on the device.
+        firmware_version (str): The version of the firmware installed on the device.
+        connection_status (str): The connection status of the device ("Connected" or "Disconnected").
+        error_code (str): The error code of the device ("None", "Battery Low", or "404 Connection Lost").
+        timestamp (int): The timestamp of the report in epoch seconds.
+    """
+
+    __slots__ = (
+        "device_id",
+        "battery_level",
+        "firmware_name",
+        "firmware_version",
+        "connection_status",
+        "error_code",
+        "timestamp",
+    )
+
+
+def to_dict(record):
+    """
+    Returns a record as a dictionary, records already being dictionaries are returned as is.
+
+    Args:
+        record (MetricRecord, DeviceRecord or dict): The record.
+
+    Returns:
+        dict: The record as a dictionary.
+    """
+    return record if isinstance(record, dict) else record.to_dict()
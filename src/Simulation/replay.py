@@ -0,0 +1,136 @@
+"""
+This script contains the scheduler used to replay the simulated records in real time.
+
+Records are released at their simulated wall-clock time, or faster with a speed-up factor, and the rate
+can be capped with a token bucket. The scheduler keeps count of the records released so the achieved
+throughput can be compared with the target.
+"""
+
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket limiting the number of events per second.
+
+    Attributes:
+        rate (float): The number of tokens added per second.
+        capacity (float): The maximum number of tokens, i.e. the largest burst allowed.
+        tokens (float): The number of tokens currently available.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            rate (float): The number of events allowed per second.
+            capacity (float, optional): The largest burst allowed. Defaults to a tenth of a second worth of events.
+            clock (function, optional): The clock used to refill the bucket. Defaults to time.monotonic.
+            sleep (function, optional): The function used to wait for tokens. Defaults to time.sleep.
+        """
+        if rate <= 0:
+            raise ValueError("The rate of the token bucket must be positive")
+        self.rate = rate
+        self.capacity = capacity or max(rate / 10, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.last_refill = clock()
+
+    def consume(self, tokens=1):
+        """
+        Takes tokens from the bucket, waiting until enough tokens are available.
+
+        The bucket can go into debt: the time overslept is refilled on the next call,
+        so the average rate stays on target even with coarse sleeps.
+
+        Args:
+            tokens (int, optional): The number of tokens to take. Defaults to 1.
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+        self.tokens -= tokens
+        if self.tokens < 0:
+            self.sleep(-self.tokens / self.rate)
+
+
+class ReplayScheduler:
+    """
+    Releases records at their simulated time, scaled by a speed-up factor, and at most at a target rate.
+
+    Attributes:
+        speed (float): The speed-up factor (1 for real time), None to release the records as fast as possible.
+        target_rate (float): The maximum number of records per second, None for no limit.
+        released (int): The number of records released so far.
+        lag (float): How late the last record was released compared to its schedule, in seconds.
+
+    Methods:
+        wait: Waits until a record with the given simulated timestamp can be released.
+        report: Returns the achieved and target throughput.
+    """
+
+    def __init__(self, speed=1.0, target_rate=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            speed (float, optional): The speed-up factor, None for as fast as possible. Defaults to 1.0.
+            target_rate (float, optional): The maximum number of records per second. Defaults to None.
+            clock (function, optional): The clock used for the schedule. Defaults to time.monotonic.
+            sleep (function, optional): The function used to wait. Defaults to time.sleep.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("The speed-up factor must be positive")
+        self.speed = speed
+        self.target_rate = target_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.bucket = TokenBucket(target_rate, clock=clock, sleep=sleep) if target_rate else None
+
+        self.released = 0
+        self.lag = 0.0
+        self._start_wall_time = None
+        self._start_simulated_time = None
+
+    def wait(self, simulated_time, count=1):
+        """
+        Waits until records with the given simulated timestamp can be released.
+
+        Args:
+            simulated_time (float): The simulated timestamp of the records in epoch seconds.
+            count (int, optional): The number of records released together. Defaults to 1.
+        """
+        now = self.clock()
+        if self._start_wall_time is None:
+            self._start_wall_time = now
+            self._start_simulated_time = simulated_time
+
+        if self.speed is not None:
+            due = self._start_wall_time + (simulated_time - self._start_simulated_time) / self.speed
+            if due > now:
+                self.sleep(due - now)
+                self.lag = 0.0
+            else:
+                self.lag = now - due
+
+        if self.bucket is not None:
+            self.bucket.consume(count)
+
+        self.released += count
+
+    def report(self):
+        """
+        Returns the achieved and target throughput since the first record was released.
+
+        Returns:
+            dict: The records released, the elapsed time in seconds, the achieved and target rates
+                in records per second, the speed-up factor and the current lag in seconds.
+        """
+        elapsed = self.clock() - self._start_wall_time if self._start_wall_time is not None else 0.0
+        return {
+            "released": self.released,
+            "elapsed": elapsed,
+            "achieved_rate": self.released / elapsed if elapsed > 0 else 0.0,
+            "target_rate": self.target_rate,
+            "speed": self.speed,
+            "lag": self.lag,
+        }
@@ -0,0 +1,290 @@
+"""
+This script contains the clock-driven simulation engine used to stream device and metric records.
+
+Instead of materializing the whole simulated day up front, the engine keeps a priority queue holding
+the next expected timestamp of every device and patient. Records are generated only when they are pulled,
+and they come out in timestamp order, so memory stays constant with the simulated duration and the first
+records are available immediately.
+
+The device and metric streams share one simulation, so the records of one kind met while pulling the other
+are buffered. Each stream must be pulled at the rate its kind is simulated (see SimulationEngine.buffered):
+a buffer holding more than max_buffered records raises BufferError instead of growing without limit.
+
+With vectorized=True, the engine advances one simulated minute (tick) at a time instead, and the metric
+records of all the patients due within a tick are generated at once as NumPy arrays (vectorized_generator.py).
+"""
+
+import datetime
+import heapq
+import itertools
+import random
+from collections import deque
+
+import numpy as np
+
+from .data_initialization_config import registry, simulation_duration
+from .device_data_generator import generate_device_record, record_interval
+from .disconnection_index import DisconnectionIndex
+from .patient_data_generator import generate_metric_record
+from .user_behaviour import user_behaviors
+from .vectorized_generator import BatchMetricGenerator
+
+# Kinds of records produced by the engine
+DEVICE = "device"
+METRIC = "metric"
+
+# Device records are processed before metric records sharing the same timestamp,
+# so a disconnection starting at that exact time is already known when the metric is generated.
+_priority = {DEVICE: 0, METRIC: 1}
+
+
+class SimulationEngine:
+    """
+    Streams simulated device and metric records in timestamp order.
+
+    Attributes:
+        registry (PatientRegistry): The registry of the patients and devices to simulate.
+        patients (list): The patients to simulate, each a dict with 'user_id' and 'device_id'.
+        devices (list): The devices to simulate, each a dict with 'device_id' and 'firmware_info'.
+        intervals (dict): The data transmission interval in minutes for each user ID.
+        user_behaviors (dict): The user behaviors affecting glucose readings, keyed by user ID.
+        duration (int): The duration of the simulation in minutes.
+        start_time (datetime.datetime): The start time of the simulation.
+        disconnection_periods (DisconnectionIndex): The disconnection periods recorded for each device.
+        initial_coordinates (dict): The initial coordinates of each user.
+        vectorized (bool): Whether the metric records are generated per tick as NumPy arrays.
+        seed (int): The seed of the NumPy random generator used in vectorized mode.
+        max_buffered (int): The maximum number of records of one kind buffered while the other kind is pulled.
+
+    Methods:
+        events: Yields (kind, record) tuples for both record kinds in timestamp order.
+        tick_batches: Yields the device records and the batch of metric records of every tick.
+        stream: Yields the records of a single kind in timestamp order.
+        buffered: Returns the number of records of a kind waiting for their stream to be pulled.
+    """
+
+    def __init__(
+        self,
+        registry=registry,
+        user_behaviors=user_behaviors,
+        duration=simulation_duration,
+        start_time=None,
+        vectorized=False,
+        seed=None,
+        max_buffered=100000,
+    ):
+        self.registry = registry
+        self.patients = registry.patients
+        self.devices = registry.devices
+        self.intervals = registry.intervals
+        self.user_behaviors = user_behaviors
+        self.duration = duration
+        self.start_time = start_time or datetime.datetime.now()
+        self.disconnection_periods = DisconnectionIndex()
+        self.initial_coordinates = {}
+        self.vectorized = vectorized
+        self.seed = seed
+        self.max_buffered = max_buffered
+
+        # Records of one kind pulled out of the queue while looking for the other kind
+        self._buffers = {DEVICE: deque(), METRIC: deque()}
+        self._events = self.events()
+
+    def _device_timestamp(self, minute):
+        """
+        Returns the timestamp of a device record for the given minute of the simulation.
+        A random number of seconds is added so devices do not all report at the same second.
+        """
+        return self.start_time + datetime.timedelta(
+            minutes=minute, seconds=random.randint(0, 59)
+        )
+
+    @staticmethod
+    def _metric_timestamp(next_expected_timestamp):
+        """
+        Returns a realistic timestamp between next_expected_timestamp (inclusive) and 59 seconds after it.
+        """
+        realistic_timestamp = random.uniform(
+            next_expected_timestamp.timestamp(),
+            (next_expected_timestamp + datetime.timedelta(seconds=59)).timestamp(),
+        )
+        return datetime.datetime.fromtimestamp(realistic_timestamp)
+
+    def events(self):
+        """
+        Runs the simulation lazily and yields the generated records in timestamp order.
+
+        Yields:
+            tuple: The kind of the record (DEVICE or METRIC) and the record itself.
+        """
+        if self.vectorized:
+            for device_records, metric_batch in self.tick_batches():
+                for record in device_records:
+                    yield DEVICE, record
+                for record in BatchMetricGenerator.to_records(metric_batch):
+                    yield METRIC, record
+            return
+
+        queue = []
+        sequence = itertools.count()
+
+        for device in self.devices:
+            heapq.heappush(
+                queue,
+                (self._device_timestamp(0), _priority[DEVICE], next(sequence), device, 0),
+            )
+
+        # The time one minute before the start, used as reference for the user-specific intervals.
+        # A user is observed while its next expected timestamp falls within the simulated minutes.
+        # For example, if a user has an interval of 2 minutes, the difference between the last seen record
+        # and the next one will be 2 minutes plus up to 59 seconds.
+        last_observed_time = self.start_time - datetime.timedelta(minutes=1)
+        last_check_time = last_observed_time + datetime.timedelta(minutes=self.duration - 1)
+
+        for patient in self.patients:
+            next_expected_timestamp = last_observed_time + datetime.timedelta(
+                minutes=self.intervals[patient["user_id"]]
+            )
+            if next_expected_timestamp <= last_check_time:
+                heapq.heappush(
+                    queue,
+                    (self._metric_timestamp(next_expected_timestamp), _priority[METRIC], next(sequence), patient, None),
+                )
+
+        while queue:
+            timestamp, priority, _, item, minute = heapq.heappop(queue)
+
+            if priority == _priority[DEVICE]:
+                yield DEVICE, generate_device_record(
+                    item["device_id"], timestamp, self.disconnection_periods
+                )
+
+                # Scheduling the record of the next minute for this device
+                minute += record_interval
+                if minute < self.duration:
+                    heapq.heappush(
+                        queue,
+                        (self._device_timestamp(minute), priority, next(sequence), item, minute),
+                    )
+                continue
+
+            record = generate_metric_record(
+                item,
+                timestamp.replace(microsecond=0),
+                self.disconnection_periods,
+                self.user_behaviors,
+                coordinates=self.initial_coordinates,
+            )
+            if record is not None:
+                yield METRIC, record
+
+            # Scheduling the next record for this user based on their interval
+            next_expected_timestamp = timestamp + datetime.timedelta(
+                minutes=self.intervals[item["user_id"]]
+            )
+            if next_expected_timestamp <= last_check_time:
+                heapq.heappush(
+                    queue,
+                    (self._metric_timestamp(next_expected_timestamp), priority, next(sequence), item, None),
+                )
+
+    def tick_batches(self):
+        """
+        Runs the simulation one simulated minute (tick) at a time.
+
+        The schedule of the patients is kept in arrays of epoch seconds, and the patients whose next
+        record falls within the tick are generated together by a BatchMetricGenerator.
+
+        Yields:
+            tuple: The device records of the tick (list) and the columns of its metric records (dict of NumPy arrays).
+        """
+        generator = BatchMetricGenerator(self.registry, self.user_behaviors, seed=self.seed)
+        rng = generator.rng
+
+        start = self.start_time.timestamp()
+        intervals = np.array(
+            [self.intervals[patient["user_id"]] for patient in self.patients], dtype=np.float64
+        ) * 60
+
+        # Same reference points as events(), in epoch seconds
+        last_observed_time = start - 60
+        last_check_time = last_observed_time + (self.duration - 1) * 60
+
+        next_expected_timestamps = last_observed_time + intervals
+        active = next_expected_timestamps <= last_check_time
+        next_timestamps = next_expected_timestamps + rng.uniform(0, 59, size=len(intervals))
+
+        for minute in range(0, self.duration, record_interval):
+            tick_end = start + (minute + record_interval) * 60
+
+            # The device records are generated first, so the disconnections of the tick are known
+            device_records = [
+                generate_device_record(device["device_id"], self._device_timestamp(minute), self.disconnection_periods)
+                for device in self.devices
+            ]
+
+            due = np.flatnonzero(active & (next_timestamps < tick_end))
+            due = due[np.argsort(next_timestamps[due], kind="stable")]
+            timestamps = next_timestamps[due]
+
+            # If a device is currently in a disconnection period, no metric record is generated for its patient
+            connected = np.array(
+                [
+                    not self.disconnection_periods.contains(device_id, timestamp)
+                    for device_id, timestamp in zip(generator.device_ids[due].tolist(), np.floor(timestamps).tolist())
+                ],
+                dtype=bool,
+            )
+            metric_batch = generator.generate(due[connected], timestamps[connected])
+
+            # Scheduling the next record of the due patients based on their interval
+            next_expected_timestamps[due] = timestamps + intervals[due]
+            active[due] = next_expected_timestamps[due] <= last_check_time
+            next_timestamps[due] = next_expected_timestamps[due] + rng.uniform(0, 59, size=len(due))
+
+            yield device_records, metric_batch
+
+    def stream(self, kind):
+        """
+        Yields the records of a single kind in timestamp order.
+
+        Both streams share the same simulation, records of the other kind met along the way
+        are buffered until that stream is pulled.
+
+        Args:
+            kind (str): The kind of records to stream (DEVICE or METRIC).
+
+        Yields:
+            DeviceRecord or MetricRecord: The next record of the requested kind.
+
+        Raises:
+            BufferError: If the buffer of the other kind exceeds max_buffered records,
+                because that stream is not pulled often enough.
+        """
+        buffer = self._buffers[kind]
+        while True:
+            while not buffer:
+                try:
+                    record_kind, record = next(self._events)
+                except StopIteration:
+                    return
+                other_buffer = self._buffers[record_kind]
+                if len(other_buffer) >= self.max_buffered:
+                    raise BufferError(
+                        f"More than {self.max_buffered} {record_kind} records are waiting to be pulled, "
+                        f"the {record_kind} stream must be pulled as often as its records are simulated"
+                    )
+                other_buffer.append(record)
+            yield buffer.popleft()
+
+    def buffered(self, kind):
+        """
+        Returns the number of records of a kind generated while pulling the other kind, waiting for their stream.
+
+        Args:
+            kind (str): The kind of records (DEVICE or METRIC).
+
+        Returns:
+            int: The number of buffered records.
+        """
+        return len(self._buffers[kind])
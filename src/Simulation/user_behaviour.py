@@ -3,7 +3,53 @@ This script is used to simulate user behavior and factors that might affect gluc
 """
 
 import random
-from .Thresholds_Retreiving import user_id_age, user_id_condition, user_id_medication
+from .data_initialization_config import registry
+
+
+# ------------Ranges of the Effects on Glucose Levels------------#
+
+# Mapping of conditions to their respective ranges
+condition_ranges = {
+    "Type 1 Diabetes": (-15, 25),
+    "Type 2 Diabetes": (-10, 15),
+    "Gestational Diabetes": (-10, 20),
+    "Prediabetes": (-10, 10),
+    "Insulin Resistance": (-5, 15),
+    "Hypoglycemia": (-10, 0),
+    "Hyperglycemia": (10, 30),
+    "Metabolic Syndrome": (-10, 20),
+    "Polycystic Ovary Syndrome": (-5, 15),
+    "Cystic Fibrosis-Related Diabetes": (-15, 25),
+    "Chronic Pancreatitis": (-10, 20),
+    "Monogenic Diabetes": (-10, 20)
+}
+
+# Mapping of medications to a given range
+medication_ranges = {
+    "Insulin Glargine": (-10, -5),
+    "Metformin": (-16, -10),
+    "Insulin Lispro": (-15, -5),
+    "Glipizide": (-12, -6),
+    "Glyburide": (-15, -10),
+    "Dapagliflozin": (-15, -5),
+    "Empagliflozin": (-15, -5),
+    "Liraglutide": (-15, -5),
+    "Exenatide": (-15, -5),
+    "Sitagliptin": (-15, -5)
+}
+
+# Mapping of exercise intensities to their respective ranges. Exercise lowers glucose levels.
+exercise_ranges = {
+    "high": (-15, -5),
+    "medium": (-10, -3)
+}
+
+# Mapping of diet types to their respective ranges
+diet_ranges = {
+    "high_carb": (10, 30),
+    "balanced": (5, 15),
+    "low_carb": (0, 10)
+}
 
 
 # ------------User Behavior and Factors Affecting Glucose Levels------------#
@@ -80,22 +126,6 @@ class UserBehavior:
             float: The effect of the medical condition on glucose levels.
         """
 
-        # Mapping of conditions to their respective ranges
-        condition_ranges = {
-            "Type 1 Diabetes": (-15, 25),
-            "Type 2 Diabetes": (-10, 15),
-            "Gestational Diabetes": (-10, 20),
-            "Prediabetes": (-10, 10),
-            "Insulin Resistance": (-5, 15),
-            "Hypoglycemia": (-10, 0),
-            "Hyperglycemia": (10, 30),
-            "Metabolic Syndrome": (-10, 20),
-            "Polycystic Ovary Syndrome": (-5, 15),
-            "Cystic Fibrosis-Related Diabetes": (-15, 25),
-            "Chronic Pancreatitis": (-10, 20),
-            "Monogenic Diabetes": (-10, 20)
-        }
-
         # Gets the range for the current condition. Will default to (0, 0) if not found
         condition_range = condition_ranges.get(self.condition, (0, 0))
 
@@ -109,20 +139,6 @@ class UserBehavior:
             float: The effect of the medication on glucose levels.
         """
 
-        # Mapping of medications to a given range
-        medication_ranges = {
-            "Insulin Glargine": (-10, -5),
-            "Metformin": (-16, -10),
-            "Insulin Lispro": (-15, -5),
-            "Glipizide": (-12, -6),
-            "Glyburide": (-15, -10),
-            "Dapagliflozin": (-15, -5),
-            "Empagliflozin": (-15, -5),
-            "Liraglutide": (-15, -5),
-            "Exenatide": (-15, -5),
-            "Sitagliptin": (-15, -5)
-        }
-
         medication_range = medication_ranges.get(self.medication, (0, 0))
 
         return random.uniform(*medication_range)
@@ -135,12 +151,10 @@ class UserBehavior:
             float: The effect of exercise on glucose levels.
         """
 
-        # Effect of exercise on glucose levels
-        if self.exercise_intensity == 'high':
-            return -random.uniform(5, 15)
-        if self.exercise_intensity == 'medium':
-            return -random.uniform(3, 10)
-        return 0
+        # Effect of exercise on glucose levels. Low intensity or no exercise has no effect
+        exercise_range = exercise_ranges.get(self.exercise_intensity, (0, 0))
+
+        return random.uniform(*exercise_range)
 
     def diet_effect(self):
         """
@@ -150,12 +164,9 @@ class UserBehavior:
             float: The effect of diet on glucose levels.
         """
         # Effect of diet on glucose levels
-        if self.diet_type == 'high_carb':
-            return random.uniform(10, 30)
-        if self.diet_type == 'low_carb':
-            return random.uniform(0, 10)
-        # balanced diet
-        return random.uniform(5, 15)
+        diet_range = diet_ranges.get(self.diet_type, diet_ranges["balanced"])
+
+        return random.uniform(*diet_range)
 
     def glucose_reading_effect(self):
         """
@@ -176,20 +187,18 @@ class UserBehavior:
 
 
 # creating UserBehavior instances
-def create_user_behaviors(user_id_age, user_id_condition, user_id_medication):
+def create_user_behaviors(registry):
     """
     Create UserBehavior instances for each user based on their age, condition, and medication
 
-    :param user_id_age: The user ID and age
-    :param user_id_condition: The user ID and condition
-    :param user_id_medication: The user ID and medication
+    :param registry: The patient registry holding the age, condition, and medication of each user
 
     :return: A dictionary of user behaviors with user ID as the key
     """
     users_behavior = {}
-    for user_id, age in user_id_age:
-        condition = next(cond for uid, cond in user_id_condition if uid == user_id)
-        medication = next(med for uid, med in user_id_medication if uid == user_id)
+    for user_id, age in registry.ages.items():
+        condition = registry.conditions[user_id]
+        medication = registry.medications[user_id]
         users_behavior[user_id] = UserBehavior(user_id, age, condition, medication)
     return users_behavior
 
@@ -206,4 +215,4 @@ def get_glucose_effect(user_id, behaviors):
     return behaviors[user_id].glucose_reading_effect()
 
 
-user_behaviors = create_user_behaviors(user_id_age, user_id_condition, user_id_medication)
+user_behaviors = create_user_behaviors(registry)
@@ -0,0 +1,195 @@
+"""
+This script generates the metric records of a whole simulation tick at once using NumPy arrays.
+
+It mirrors generate_metric_record from patient_data_generator.py: the 95/5 draw within or outside the
+glucose thresholds, the effects of the user behaviors and the coordinates jitter are all computed in
+vectorized form with a seeded numpy.random.Generator, instead of several random calls per record.
+"""
+
+import numpy as np
+
+from .records import MetricRecord
+from .user_behaviour import condition_ranges, diet_ranges, exercise_ranges, medication_ranges
+
+# Bounds of the glucose readings generated outside the thresholds
+glucose_floor, glucose_ceiling = 50, 240
+
+# Approximate bounding box of Spain, where the patients are moving
+latitude_range = (36.0, 43.79)
+longitude_range = (-9.3, 3.3)
+
+# Range of the offset applied to the previous coordinates for the next observation
+nearby_range = (0.01, 0.05)
+
+
+def _effect_bounds(values, ranges, default=(0, 0)):
+    """
+    Looks up the range of an effect for each value and returns the lower and upper bounds as arrays.
+
+    Args:
+        values (list): The value (condition, medication, ...) of each patient.
+        ranges (dict): The mapping of values to their respective ranges.
+        default (tuple, optional): The range used for values not in the mapping. Defaults to (0, 0).
+
+    Returns:
+        tuple: The lower bounds and the upper bounds as NumPy arrays.
+    """
+    bounds = np.array([ranges.get(value, default) for value in values], dtype=np.float64)
+    return bounds[:, 0], bounds[:, 1]
+
+
+class BatchMetricGenerator:
+    """
+    Generates the metric records of many patients at once.
+
+    The per-patient attributes (thresholds and ranges of the behavior effects) are stored as arrays
+    built once, so a batch is generated by indexing them with the positions of the due patients.
+
+    Attributes:
+        rng (numpy.random.Generator): The random generator used for every draw.
+        user_ids (numpy.ndarray): The user ID of each patient.
+        device_ids (numpy.ndarray): The device ID of each patient.
+        min_glucose (numpy.ndarray): The minimum glucose threshold of each patient.
+        max_glucose (numpy.ndarray): The maximum glucose threshold of each patient.
+        latitudes (numpy.ndarray): The initial latitude of each patient, NaN until first observed.
+        longitudes (numpy.ndarray): The initial longitude of each patient, NaN until first observed.
+
+    Methods:
+        glucose_readings: Draws the glucose readings within or outside the thresholds for the given patients.
+        behavior_effects: Draws the overall effect of the lifestyle factors for the given patients.
+        coordinates: Draws the coordinates of the given patients.
+        generate: Generates a batch of metric records for the given patients.
+        to_records: Converts a batch into metric records.
+    """
+
+    def __init__(self, registry, user_behaviors, seed=None):
+        """
+        Initializes the per-patient arrays.
+
+        Args:
+            registry (PatientRegistry): The registry of the patients to generate records for.
+            user_behaviors (dict): The user behaviors affecting glucose readings, keyed by user ID.
+            seed (int, optional): The seed of the random generator. Defaults to None.
+        """
+        self.rng = np.random.default_rng(seed)
+        patients = registry.patients
+
+        self.user_ids = np.array([patient["user_id"] for patient in patients], dtype=np.int64)
+        self.device_ids = np.array([patient["device_id"] for patient in patients], dtype=np.int64)
+
+        thresholds = np.array(
+            [registry.threshold(user_id) for user_id in self.user_ids.tolist()], dtype=np.float64
+        )
+        self.min_glucose, self.max_glucose = thresholds[:, 0], thresholds[:, 1]
+
+        behaviors = [user_behaviors[user_id] for user_id in self.user_ids.tolist()]
+        self._effects = [
+            _effect_bounds([behavior.condition for behavior in behaviors], condition_ranges),
+            _effect_bounds([behavior.medication for behavior in behaviors], medication_ranges),
+            _effect_bounds([behavior.exercise_intensity for behavior in behaviors], exercise_ranges),
+            _effect_bounds([behavior.diet_type for behavior in behaviors], diet_ranges, diet_ranges["balanced"]),
+        ]
+
+        self.latitudes = np.full(len(patients), np.nan)
+        self.longitudes = np.full(len(patients), np.nan)
+
+    def behavior_effects(self, index):
+        """
+        Draws the overall effect of the lifestyle factors (condition, medication, exercise, diet).
+
+        Args:
+            index (numpy.ndarray): The positions of the patients.
+
+        Returns:
+            numpy.ndarray: The effect on the glucose reading of each patient.
+        """
+        glucose_effect = np.zeros(len(index))
+        for low, high in self._effects:
+            glucose_effect += self.rng.uniform(low[index], high[index])
+        return glucose_effect
+
+    def glucose_readings(self, index):
+        """
+        Draws the glucose readings, 95% within the thresholds and 5% outside of them.
+        Readings outside the thresholds are below the minimum or above the maximum with a 50% chance each.
+
+        Args:
+            index (numpy.ndarray): The positions of the patients.
+
+        Returns:
+            numpy.ndarray: The glucose reading of each patient, before the behavior effects.
+        """
+        min_glucose, max_glucose = self.min_glucose[index], self.max_glucose[index]
+
+        within_threshold = self.rng.random(len(index)) < 0.95
+        below_threshold = self.rng.random(len(index)) < 0.5
+
+        low = np.where(within_threshold, min_glucose, np.where(below_threshold, glucose_floor, max_glucose))
+        high = np.where(within_threshold, max_glucose, np.where(below_threshold, min_glucose, glucose_ceiling))
+
+        return self.rng.uniform(low, high)
+
+    def coordinates(self, index):
+        """
+        Draws the coordinates of the patients. Patients observed for the first time get random
+        coordinates within Spain, the others get coordinates close to their initial ones.
+
+        Args:
+            index (numpy.ndarray): The positions of the patients.
+
+        Returns:
+            tuple: The latitudes and the longitudes as NumPy arrays.
+        """
+        first_time = np.isnan(self.latitudes[index])
+        new_index = index[first_time]
+        self.latitudes[new_index] = self.rng.uniform(*latitude_range, size=len(new_index))
+        self.longitudes[new_index] = self.rng.uniform(*longitude_range, size=len(new_index))
+
+        latitudes, longitudes = self.latitudes[index], self.longitudes[index]
+
+        seen_index = np.flatnonzero(~first_time)
+        range_lat = self.rng.uniform(*nearby_range, size=len(seen_index))
+        range_lon = self.rng.uniform(*nearby_range, size=len(seen_index))
+        latitudes[seen_index] = self.rng.uniform(latitudes[seen_index] - range_lat, latitudes[seen_index] + range_lat)
+        longitudes[seen_index] = self.rng.uniform(longitudes[seen_index] - range_lon, longitudes[seen_index] + range_lon)
+
+        return latitudes, longitudes
+
+    def generate(self, index, timestamps):
+        """
+        Generates a batch of metric records.
+
+        Args:
+            index (numpy.ndarray): The positions of the patients, in the order of the records.
+            timestamps (numpy.ndarray): The timestamps of the records in epoch seconds.
+
+        Returns:
+            dict: The columns of the batch ('user_id', 'device_id', 'timestamp', 'glucose_reading',
+                'latitude', 'longitude') as NumPy arrays.
+        """
+        glucose_reading = self.glucose_readings(index) + self.behavior_effects(index)
+        latitude, longitude = self.coordinates(index)
+
+        return {
+            "user_id": self.user_ids[index],
+            "device_id": self.device_ids[index],
+            "timestamp": np.floor(timestamps).astype(np.int64),
+            "glucose_reading": glucose_reading,
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+
+    @staticmethod
+    def to_records(batch):
+        """
+        Converts a batch into metric records, as returned by generate_metric_record.
+
+        Args:
+            batch (dict): The columns of the batch as returned by generate.
+
+        Yields:
+            MetricRecord: A metric record.
+        """
+        columns = [batch[field].tolist() for field in MetricRecord.__slots__]
+        for values in zip(*columns):
+            yield MetricRecord(*values)
@@ -0,0 +1,15 @@
+-- Adds the event keys of the rows to the tables created before the inserts were made idempotent.
+-- The rows inserted before have no event key (NULL), so they are never taken for duplicates.
+
+ALTER TABLE glucose_reading
+    ADD COLUMN event_partition VARCHAR(32),
+    ADD COLUMN event_sequence BIGINT,
+    ADD COLUMN event_position INT,
+    ADD UNIQUE KEY event_record (event_partition, event_sequence, event_position);
+
+
+ALTER TABLE device_feed
+    ADD COLUMN event_partition VARCHAR(32),
+    ADD COLUMN event_sequence BIGINT,
+    ADD COLUMN event_position INT,
+    ADD UNIQUE KEY event_record (event_partition, event_sequence, event_position);
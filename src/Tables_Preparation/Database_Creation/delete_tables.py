@@ -8,6 +8,7 @@ import os
 
 
 tables = [
+    "insert_quarantine",
     "device_feed",
     "patient_device",
     "device_settings",
@@ -1,7 +1,11 @@
 """
 Create a trigger in the database
+
+With --drop, the trigger is dropped instead, when the alerts are created by the batch alert stage
+of the DatabaseInserts function app (alert_mode setting set to 'batch').
 """
 #%%
+import argparse
 import os
 import sys
 import mysql.connector
@@ -58,6 +62,39 @@ def create_trigger():
     print("Function create_trigger() executed successfully")
 
 
+def drop_trigger():
+    """
+    Drops the trigger from the database, so the alerts are only created by the batch alert stage.
+    """
+    cnx = get_sql_connection()
+
+    try:
+        cursor = cnx.cursor()
+        cursor.execute("DROP TRIGGER IF EXISTS check_glucose_after_insert")
+        print("Trigger dropped successfully")
+        cnx.commit()
+
+    except Exception as e:
+        print("An error occurred", e)
+        cnx.rollback()
+
+    finally:
+        cursor.close()
+        cnx.close()
+        print("Connection closed")
+
+
 if __name__ == "__main__":
-    create_trigger()
+    parser = argparse.ArgumentParser(description="Create the alert trigger of the glucose_reading table.")
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop the trigger instead, when the DatabaseInserts function app creates the alerts (alert_mode=batch)",
+    )
+    args = parser.parse_args()
+
+    if args.drop:
+        drop_trigger()
+    else:
+        create_trigger()
 
@@ -95,6 +95,10 @@ CREATE TABLE IF NOT EXISTS glucose_reading (
     timestamp DATETIME,
     latitude FLOAT,
     longitude FLOAT,
+    event_partition VARCHAR(32),
+    event_sequence BIGINT,
+    event_position INT,
+    UNIQUE KEY event_record (event_partition, event_sequence, event_position),
     FOREIGN KEY (user_id) REFERENCES user (user_id) ON DELETE CASCADE,
     FOREIGN KEY (device_id) REFERENCES device (device_id) ON DELETE SET NULL
 );
@@ -122,5 +126,18 @@ CREATE TABLE IF NOT EXISTS device_feed (
     connectivity_status VARCHAR(255),
     error_codes VARCHAR(255),
     timestamp DATETIME,
+    event_partition VARCHAR(32),
+    event_sequence BIGINT,
+    event_position INT,
+    UNIQUE KEY event_record (event_partition, event_sequence, event_position),
     FOREIGN KEY (device_id) REFERENCES device (device_id) ON DELETE SET NULL);
+
+
+CREATE TABLE IF NOT EXISTS insert_quarantine (
+    quarantine_id INT PRIMARY KEY AUTO_INCREMENT,
+    table_name VARCHAR(255),
+    record LONGTEXT,
+    reason TEXT,
+    received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
     
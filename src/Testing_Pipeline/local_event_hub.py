@@ -0,0 +1,423 @@
+"""
+This script contains an in-process stand-in for Azure Event Hubs, to run the pipeline without Azure.
+
+LocalEventHubNamespace holds the Event Hubs, created on first use, each with its partitions. The events sent are
+appended to their partition with a sequence number, an offset and an enqueued time, like Event Hubs does:
+- LocalProducerClient has the surface of the asynchronous producer client used by sensor.py
+  (get_partition_ids, create_batch, send_batch, close).
+- LocalConsumerClient has the surface of the consumer client used by the Streamlit dashboard
+  (receive with an on_event callback, receive_batch with an on_event_batch callback, close).
+
+Every consumer group reads every event of its Event Hub, each partition in order, and keeps its own checkpoints.
+The events received are copies of the events sent, with their body, content type and properties (with bytes keys
+and values, as they are received from Event Hubs), and their sequence number, offset, enqueued time and partition key.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+import zlib
+
+from azure.eventhub import EventData, EventDataBatch
+
+# The annotations of a received event (see azure.eventhub._constants)
+SEQUENCE_NUMBER = b"x-opt-sequence-number"
+OFFSET = b"x-opt-offset"
+ENQUEUED_TIME = b"x-opt-enqueued-time"
+PARTITION_KEY = b"x-opt-partition-key"
+
+# The maximum size of a batch of the Standard tier of Event Hubs, in bytes
+MAX_BATCH_SIZE = 1024 * 1024
+
+
+def _to_bytes(value):
+    """
+    Encodes strings as they are received from Event Hubs, the other values are kept as they are.
+    """
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def received_event(event, sequence_number, offset, enqueued_time, partition_key=None):
+    """
+    Returns the copy of a sent event as it is received from Event Hubs.
+
+    Args:
+        event (EventData): The event sent.
+        sequence_number (int): The sequence number of the event in its partition.
+        offset (int): The offset of the event in its partition.
+        enqueued_time (float): When the event was appended to its partition, in epoch seconds.
+        partition_key (bytes, optional): The partition key the event was sent with. Defaults to None.
+
+    Returns:
+        EventData: The received event.
+    """
+    received = EventData(b"".join(event.body))
+    if event.content_type:
+        received.content_type = event.content_type
+    if event.properties:
+        received.properties = {_to_bytes(key): _to_bytes(value) for key, value in event.properties.items()}
+    annotations = {
+        SEQUENCE_NUMBER: sequence_number,
+        OFFSET: str(offset).encode("utf-8"),
+        ENQUEUED_TIME: int(enqueued_time * 1000),
+    }
+    if partition_key is not None:
+        annotations[PARTITION_KEY] = _to_bytes(partition_key)
+    received.raw_amqp_message.annotations = annotations
+    return received
+
+
+class LocalEventHub:
+    """
+    An Event Hub held in memory.
+
+    Attributes:
+        name (str): The name of the Event Hub.
+        partition_ids (list): The IDs of the partitions, '0' to 'n - 1'.
+        checkpoints (dict): The sequence number of the last event checkpointed, for each (consumer group, partition).
+
+    Methods:
+        append: Appends events to a partition.
+        read: Returns the events of a partition from a sequence number.
+        wait: Waits until events are appended.
+        event_count: Returns the number of events in the Event Hub.
+    """
+
+    def __init__(self, name, partition_count=4):
+        """
+        Args:
+            name (str): The name of the Event Hub.
+            partition_count (int, optional): The number of partitions. Defaults to 4.
+        """
+        self.name = name
+        self.partition_ids = [str(index) for index in range(partition_count)]
+        self.checkpoints = {}
+        self._partitions = {partition_id: [] for partition_id in self.partition_ids}
+        self._offsets = dict.fromkeys(self.partition_ids, 0)
+        self._next_partition = itertools.cycle(self.partition_ids)
+        self._condition = threading.Condition()
+
+    def append(self, events, partition_id=None, partition_key=None):
+        """
+        Appends events to a partition.
+
+        Args:
+            events (list): The events sent.
+            partition_id (str, optional): The partition of the events. Defaults to the partition of the partition key.
+            partition_key (str, optional): The partition key of the events. Defaults to the next partition in turn.
+
+        Returns:
+            str: The partition the events were appended to.
+        """
+        with self._condition:
+            if partition_id is None and partition_key is not None:
+                partition_id = self.partition_ids[zlib.crc32(_to_bytes(partition_key)) % len(self.partition_ids)]
+            elif partition_id is None:
+                partition_id = next(self._next_partition)
+
+            partition = self._partitions[partition_id]
+            enqueued_time = time.time()
+            for event in events:
+                partition.append(
+                    received_event(event, len(partition), self._offsets[partition_id], enqueued_time, partition_key)
+                )
+                self._offsets[partition_id] += sum(len(part) for part in event.body)
+            self._condition.notify_all()
+        return partition_id
+
+    def read(self, partition_id, sequence_number, max_count=None):
+        """
+        Returns the events of a partition from a sequence number.
+
+        Args:
+            partition_id (str): The partition.
+            sequence_number (int): The sequence number of the first event.
+            max_count (int, optional): The maximum number of events. Defaults to all of them.
+
+        Returns:
+            list: The events.
+        """
+        with self._condition:
+            partition = self._partitions[partition_id]
+            end = len(partition) if max_count is None else sequence_number + max_count
+            return partition[sequence_number:end]
+
+    def wait(self, positions, timeout):
+        """
+        Waits until an event is appended after the given positions, or the timeout is over.
+
+        Args:
+            positions (dict): The sequence number of the next event to read, for each partition.
+            timeout (float): The maximum time to wait, in seconds.
+
+        Returns:
+            bool: True if an event can be read.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: any(len(self._partitions[partition_id]) > position for partition_id, position in positions.items()),
+                timeout,
+            )
+
+    def event_count(self):
+        """
+        Returns the number of events in the Event Hub.
+        """
+        with self._condition:
+            return sum(len(partition) for partition in self._partitions.values())
+
+
+class LocalEventHubNamespace:
+    """
+    The Event Hubs run in memory, created the first time they are used.
+
+    Attributes:
+        partition_count (int): The number of partitions of each Event Hub.
+        send_latency (float): The time each batch takes to be sent, in seconds, to stand for the network.
+
+    Methods:
+        hub: Returns an Event Hub.
+        producer: Returns a producer client of an Event Hub.
+        consumer: Returns a consumer client of an Event Hub.
+    """
+
+    def __init__(self, partition_count=4, send_latency=0.0):
+        """
+        Args:
+            partition_count (int, optional): The number of partitions of each Event Hub. Defaults to 4.
+            send_latency (float, optional): The time each batch takes to be sent, in seconds. Defaults to 0.
+        """
+        self.partition_count = partition_count
+        self.send_latency = send_latency
+        self._hubs = {}
+        self._lock = threading.Lock()
+
+    def hub(self, eventhub_name):
+        """
+        Returns an Event Hub, created if it does not exist yet.
+
+        Args:
+            eventhub_name (str): The name of the Event Hub.
+
+        Returns:
+            LocalEventHub: The Event Hub.
+        """
+        with self._lock:
+            if eventhub_name not in self._hubs:
+                self._hubs[eventhub_name] = LocalEventHub(eventhub_name, self.partition_count)
+            return self._hubs[eventhub_name]
+
+    def producer(self, eventhub_name):
+        """
+        Returns a producer client of an Event Hub.
+
+        Args:
+            eventhub_name (str): The name of the Event Hub.
+
+        Returns:
+            LocalProducerClient: The producer client.
+        """
+        return LocalProducerClient(self, eventhub_name)
+
+    def consumer(self, eventhub_name, consumer_group="$Default"):
+        """
+        Returns a consumer client of an Event Hub.
+
+        Args:
+            eventhub_name (str): The name of the Event Hub.
+            consumer_group (str, optional): The consumer group. Defaults to '$Default'.
+
+        Returns:
+            LocalConsumerClient: The consumer client.
+        """
+        return LocalConsumerClient(self, eventhub_name, consumer_group)
+
+
+class LocalEventDataBatch(EventDataBatch):
+    """
+    A batch of the SDK, so it is filled as it is with Event Hubs, which also records its events and its partition
+    for the local Event Hub, as the SDK has no public accessor to them.
+
+    Attributes:
+        events (list): The events added to the batch.
+        target_partition_id (str): The partition the batch is sent to, None for any.
+        target_partition_key (str): The partition key of the batch, None for none.
+    """
+
+    def __init__(self, max_size_in_bytes=None, partition_id=None, partition_key=None):
+        super().__init__(max_size_in_bytes=max_size_in_bytes, partition_id=partition_id, partition_key=partition_key)
+        self.events = []
+        self.target_partition_id = partition_id
+        self.target_partition_key = partition_key
+
+    def add(self, event_data):
+        # The batch of the SDK raises a ValueError when the event does not fit, it is then not recorded
+        super().add(event_data)
+        self.events.append(event_data)
+
+
+class LocalProducerClient:
+    """
+    Sends events to a local Event Hub, with the methods of the asynchronous EventHubProducerClient used by sensor.py.
+    """
+
+    def __init__(self, namespace, eventhub_name):
+        """
+        Args:
+            namespace (LocalEventHubNamespace): The namespace of the Event Hub.
+            eventhub_name (str): The name of the Event Hub.
+        """
+        self.namespace = namespace
+        self.eventhub_name = eventhub_name
+        self.hub = namespace.hub(eventhub_name)
+
+    async def get_partition_ids(self):
+        return list(self.hub.partition_ids)
+
+    async def create_batch(self, partition_id=None, partition_key=None, max_size_in_bytes=None):
+        return LocalEventDataBatch(
+            max_size_in_bytes=max_size_in_bytes or MAX_BATCH_SIZE, partition_id=partition_id, partition_key=partition_key
+        )
+
+    async def send_batch(self, event_data_batch, **kwargs):
+        if self.namespace.send_latency:
+            await asyncio.sleep(self.namespace.send_latency)
+        self.hub.append(
+            list(event_data_batch.events),
+            partition_id=event_data_batch.target_partition_id,
+            partition_key=event_data_batch.target_partition_key,
+        )
+
+    async def close(self):
+        pass
+
+
+class LocalPartitionContext:
+    """
+    The partition context given to the callbacks of LocalConsumerClient.
+
+    Attributes:
+        eventhub_name (str): The name of the Event Hub.
+        consumer_group (str): The consumer group.
+        partition_id (str): The partition.
+    """
+
+    def __init__(self, hub, consumer_group, partition_id):
+        self._hub = hub
+        self.eventhub_name = hub.name
+        self.consumer_group = consumer_group
+        self.partition_id = partition_id
+
+    def update_checkpoint(self, event=None):
+        """
+        Records the last event processed in the partition.
+
+        Args:
+            event (EventData, optional): The event. Defaults to None.
+        """
+        if event is not None:
+            self._hub.checkpoints[(self.consumer_group, self.partition_id)] = event.sequence_number
+
+
+class LocalConsumerClient:
+    """
+    Receives the events of a local Event Hub, with the methods of the EventHubConsumerClient.
+
+    receive and receive_batch block until close is called from another thread. The partitions are read in turn,
+    so the callbacks are called from a single thread.
+    """
+
+    def __init__(self, namespace, eventhub_name, consumer_group="$Default"):
+        """
+        Args:
+            namespace (LocalEventHubNamespace): The namespace of the Event Hub.
+            eventhub_name (str): The name of the Event Hub.
+            consumer_group (str, optional): The consumer group. Defaults to '$Default'.
+        """
+        self.hub = namespace.hub(eventhub_name)
+        self.eventhub_name = eventhub_name
+        self.consumer_group = consumer_group
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start_positions(self, starting_position):
+        """
+        Returns the sequence number of the first event to read in each partition.
+        """
+        positions = {}
+        for partition_id in self.hub.partition_ids:
+            checkpoint = self.hub.checkpoints.get((self.consumer_group, partition_id))
+            if checkpoint is not None:
+                positions[partition_id] = checkpoint + 1
+            elif starting_position in ("-1", "@earliest", -1):
+                positions[partition_id] = 0
+            else:
+                positions[partition_id] = len(self.hub.read(partition_id, 0))
+        return positions
+
+    def receive_batch(self, on_event_batch, max_batch_size=300, max_wait_time=None, starting_position="@latest", **kwargs):
+        """
+        Calls on_event_batch with the events of each partition, at most max_batch_size at a time, until close is called.
+
+        Args:
+            on_event_batch (function): Called with the partition context and the list of events.
+            max_batch_size (int, optional): The maximum number of events of a call. Defaults to 300.
+            max_wait_time (float, optional): Calls on_event_batch with an empty list for each partition when
+                no event was received for that long, in seconds. Defaults to None (only called with events).
+            starting_position (str, optional): '-1' to read the partitions from the beginning, '@latest' for the
+                events appended from now on. The checkpoints of the consumer group come first. Defaults to '@latest'.
+        """
+        positions = self._start_positions(starting_position)
+        contexts = {
+            partition_id: LocalPartitionContext(self.hub, self.consumer_group, partition_id)
+            for partition_id in self.hub.partition_ids
+        }
+        waited_since = time.monotonic()
+        while not self._closed.is_set():
+            received = False
+            for partition_id, position in positions.items():
+                events = self.hub.read(partition_id, position, max_batch_size)
+                if events:
+                    received = True
+                    positions[partition_id] = position + len(events)
+                    on_event_batch(contexts[partition_id], events)
+
+            if received:
+                waited_since = time.monotonic()
+            elif max_wait_time is not None and time.monotonic() - waited_since >= max_wait_time:
+                waited_since = time.monotonic()
+                for partition_id in positions:
+                    on_event_batch(contexts[partition_id], [])
+            else:
+                self.hub.wait(positions, 0.1)
+
+    def receive(self, on_event, max_wait_time=None, starting_position="@latest", **kwargs):
+        """
+        Calls on_event with each event, in order in each partition, until close is called.
+
+        Args:
+            on_event (function): Called with the partition context and the event.
+            max_wait_time (float, optional): Calls on_event with None for each partition when no event was
+                received for that long, in seconds. Defaults to None (only called with events).
+            starting_position (str, optional): '-1' or '@latest', see receive_batch. Defaults to '@latest'.
+        """
+
+        def on_event_batch(partition_context, events):
+            if not events:
+                on_event(partition_context, None)
+            for event in events:
+                on_event(partition_context, event)
+
+        self.receive_batch(on_event_batch, max_wait_time=max_wait_time, starting_position=starting_position)
+
+    def close(self):
+        """
+        Stops receiving, receive and receive_batch return.
+        """
+        self._closed.set()
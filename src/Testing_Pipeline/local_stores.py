@@ -0,0 +1,258 @@
+"""
+This script contains the local stand-ins for the MySQL database and the Redis cache, to run the pipeline without Azure.
+
+- LocalDatabase: a SQLite database with the tables written by the Azure Functions (glucose_reading, device_feed,
+  insert_quarantine), whose connections accept the queries of mysql.connector (%s placeholders,
+  ON DUPLICATE KEY UPDATE).
+- LocalRedis: the hashes of the Redis cache (user:<user_id> and device:<device_id>) in a dictionary,
+  filled from the patient registry of the simulation like Redis_Cache_Creation.py fills Redis from the database.
+"""
+
+import contextlib
+import re
+import sqlite3
+import threading
+
+# The tables written by the Azure Functions, as in sql_tables_creation.sql but without the foreign keys
+tables = [
+    """
+    CREATE TABLE IF NOT EXISTS glucose_reading (
+        reading_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT,
+        device_id INT,
+        glucose_level FLOAT,
+        timestamp DATETIME,
+        latitude FLOAT,
+        longitude FLOAT,
+        event_partition VARCHAR(32),
+        event_sequence BIGINT,
+        event_position INT,
+        UNIQUE (event_partition, event_sequence, event_position)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS device_feed (
+        feed_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INT,
+        battery_level INT,
+        firmware_name VARCHAR(255),
+        firmware_version VARCHAR(255),
+        connectivity_status VARCHAR(255),
+        error_codes VARCHAR(255),
+        timestamp DATETIME,
+        event_partition VARCHAR(32),
+        event_sequence BIGINT,
+        event_position INT,
+        UNIQUE (event_partition, event_sequence, event_position)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS insert_quarantine (
+        quarantine_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name VARCHAR(255),
+        record TEXT,
+        reason TEXT,
+        received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+@contextlib.contextmanager
+def integrity_errors():
+    """
+    Raises the constraint errors of SQLite as the IntegrityError of mysql.connector, caught by the Azure Functions.
+    """
+    try:
+        yield
+    except sqlite3.IntegrityError as error:
+        import mysql.connector
+
+        raise mysql.connector.IntegrityError(msg=str(error)) from error
+
+
+def translate(operation):
+    """
+    Translates a query of mysql.connector to SQLite: the %s placeholders to ?, and ON DUPLICATE KEY UPDATE
+    to ON CONFLICT DO NOTHING (the Azure Functions only use it to skip the rows already inserted).
+    """
+    operation = re.sub(r"\s+ON DUPLICATE KEY UPDATE\s.*$", " ON CONFLICT DO NOTHING", operation, flags=re.S | re.I)
+    return operation.replace("%s", "?")
+
+
+class LocalCursor:
+    """
+    A cursor of LocalDatabase, translating the queries of mysql.connector to SQLite (see translate),
+    and the constraint errors of SQLite to the IntegrityError of mysql.connector.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, operation, params=()):
+        with integrity_errors():
+            self._cursor.execute(translate(operation), params)
+
+    def executemany(self, operation, seq_params):
+        with integrity_errors():
+            self._cursor.executemany(translate(operation), seq_params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+
+class LocalConnection:
+    """
+    A connection to LocalDatabase, with the methods of a mysql.connector connection used by the Azure Functions.
+    """
+
+    def __init__(self, path):
+        # A write waits for the other connections instead of failing while they hold the lock of the database
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self):
+        return LocalCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._connection.close()
+
+
+class LocalDatabase:
+    """
+    A SQLite database standing in for the MySQL database written by the Azure Functions.
+
+    Attributes:
+        path (str): The path of the SQLite database.
+        connection_count (int): The number of connections opened so far.
+
+    Methods:
+        connect: Opens a connection, to replace get_db_connection of the Azure Functions.
+        count: Returns the number of rows of a table.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the SQLite database, created with the tables if it does not exist.
+        """
+        self.path = path
+        self.connection_count = 0
+        self._lock = threading.Lock()
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            for table in tables:
+                connection.execute(table)
+        connection.close()
+
+    def connect(self):
+        """
+        Opens a connection to the database.
+
+        Returns:
+            LocalConnection: The connection.
+        """
+        with self._lock:
+            self.connection_count += 1
+        return LocalConnection(self.path)
+
+    def count(self, table):
+        """
+        Returns the number of rows of a table.
+
+        Args:
+            table (str): The name of the table.
+
+        Returns:
+            int: The number of rows.
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            connection.close()
+
+
+class LocalRedis:
+    """
+    The hashes of the Redis cache held in a dictionary, with the methods of a redis client used by the pipeline.
+
+    Methods:
+        hset: Sets fields of a hash.
+        hgetall: Returns the fields of a hash.
+        fill_from_registry: Fills the user and device hashes from the patient registry of the simulation.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        """
+        Sets fields of a hash, as strings like Redis does.
+        """
+        fields = dict(mapping or {})
+        if key is not None:
+            fields[key] = value
+        with self._lock:
+            self._hashes.setdefault(name, {}).update({field: str(value) for field, value in fields.items()})
+        return len(fields)
+
+    def hgetall(self, name):
+        """
+        Returns the fields of a hash, an empty dictionary if it does not exist.
+        """
+        with self._lock:
+            return dict(self._hashes.get(name, {}))
+
+    def fill_from_registry(self, registry):
+        """
+        Fills the user:<user_id> and device:<device_id> hashes with the fields of Redis_Cache_Creation.py.
+
+        Args:
+            registry (PatientRegistry): The patient registry of the simulation.
+        """
+        for patient in registry.patients:
+            user_id, device_id = patient["user_id"], patient["device_id"]
+            min_glucose, max_glucose = registry.threshold(user_id)
+            interval = registry.intervals.get(user_id, 5)
+            self.hset(
+                f"user:{user_id}",
+                mapping={
+                    "patient_name": f"Patient {user_id}",
+                    "patient_age": registry.ages.get(user_id, ""),
+                    "gender": "",
+                    "max_glucose": max_glucose,
+                    "min_glucose": min_glucose,
+                    "medical_condition": registry.conditions.get(user_id, ""),
+                },
+            )
+            self.hset(
+                f"device:{device_id}",
+                mapping={
+                    "owner_name": f"Patient {user_id}",
+                    "device_model": "",
+                    "data_transmission_interval": interval,
+                    "expected_transmissions": round(15 / interval),
+                    "manufacturer_name": "",
+                },
+            )
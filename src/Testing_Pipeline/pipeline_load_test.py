@@ -0,0 +1,536 @@
+"""
+The script load tests the streaming pipeline end to end without Azure.
+
+Data_Generation.py writes the files of the simulation (synthetic results of Thresholds_Retreiving.py, no database)
+to a temporary monitoring directory, the watcher and the IngestionPipeline of sensor.py send them to local
+Event Hubs (local_event_hub.py), and the Azure Functions consume them:
+- DatabaseInserts inserts the readings and device reports into a SQLite stand-in of the MySQL database,
+  or into the MySQL database of the .env with --mysql,
+- an alert stage standing in for the Databricks notebook compares the readings with the thresholds of a Redis
+  stand-in (local_stores.py) and sends the alerts of high and low readings and of lost connections,
+- TelegramAlerts formats the alerts, their messages are recorded instead of being sent to Telegram.
+
+The end-to-end latency of a record is the time from the write of its file by Data_Generation.py to the end of the
+function handling it (for an alert, the function handling the alert). The throughput in records per second and the
+p50/p99 latency of each function are printed and can be written as JSON with --output.
+"""
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parents[2]
+sys.path.append(str(root_dir))
+
+METRIC_HUB = "raw_glucose_readings"
+DEVICE_HUB = "raw_device_feeds"
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of values, None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def record_key(record):
+    """
+    Identifies a reading by its user and timestamp, and a device report by its device and timestamp.
+    The alerts of the notebook have the timestamp of their reading as final_df_timestamp.
+    """
+    timestamp = str(record.get("timestamp", record.get("final_df_timestamp")))
+    if "glucose_reading" in record:
+        return ("reading", int(record["user_id"]), timestamp)
+    return ("device", int(record["device_id"]), timestamp)
+
+
+class TimedSink:
+    """
+    Writes the records with another sink under a root directory, and records when each record was written.
+
+    Attributes:
+        written (dict): The time each record was written, in epoch seconds, by record key.
+        counts (dict): The number of records written to each output directory.
+    """
+
+    def __init__(self, sink, root):
+        """
+        Args:
+            sink: The sink the records are written with (output_sinks.py).
+            root (str): The directory the output directories are in.
+        """
+        from src.Simulation.records import to_dict
+
+        self.to_dict = to_dict
+        self.sink = sink
+        self.root = root
+        self.written = {}
+        self.counts = defaultdict(int)
+
+    def write(self, records, output_dir, file_name):
+        now = time.time()
+        for record in records:
+            self.written.setdefault(record_key(self.to_dict(record)), now)
+        self.counts[os.path.basename(output_dir)] += len(records)
+        self.sink.write(records, os.path.join(self.root, output_dir), file_name)
+
+    def close(self):
+        self.sink.close()
+
+
+class LatencyRecorder:
+    """
+    Records the end-to-end latency of the records handled by each function.
+
+    Attributes:
+        written (dict): The time each record was written, by record key.
+        latencies (dict): The latencies of each function, in seconds.
+        errors (dict): The number of events each function failed on.
+        last_handled (float): When the last record was handled, in epoch seconds.
+    """
+
+    def __init__(self, written):
+        self.written = written
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.last_handled = None
+        self._lock = threading.Lock()
+
+    def record(self, function_name, keys):
+        now = time.time()
+        with self._lock:
+            self.latencies[function_name].extend(now - self.written[key] for key in keys if key in self.written)
+            self.last_handled = now
+
+    def fail(self, function_name):
+        with self._lock:
+            self.errors[function_name] += 1
+
+    def count(self, function_name):
+        with self._lock:
+            return len(self.latencies[function_name])
+
+
+def load_function_app(name):
+    """
+    Imports the function_app.py of an Azure Function.
+
+    Args:
+        name (str): The name of the directory of the function app, e.g. DatabaseInserts.
+
+    Returns:
+        module: The function app module.
+    """
+    spec = importlib.util.spec_from_file_location(f"{name}_function_app", root_dir / "Azure Functions" / name / "function_app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def function_event(event, partition_context, metadata=None):
+    """
+    Converts a received event to the EventHubEvent given to the Azure Functions, with the trigger metadata
+    of a single event unless the common metadata of a batch is given.
+    """
+    import azure.functions as func
+    from azure.functions.meta import Datum
+
+    if metadata is None:
+        metadata = {
+            "Properties": Datum(json.dumps(_properties(event)), "json"),
+            "SystemProperties": Datum(json.dumps(_system_properties(event)), "json"),
+            "PartitionContext": Datum(json.dumps(_partition_context(partition_context)), "json"),
+        }
+    partition_key = event.partition_key.decode("utf-8") if event.partition_key else None
+    return func.EventHubEvent(
+        body=b"".join(event.body),
+        trigger_metadata=metadata,
+        enqueued_time=event.enqueued_time,
+        partition_key=partition_key,
+        sequence_number=event.sequence_number,
+        offset=event.offset,
+    )
+
+
+def batch_metadata(events, partition_context):
+    """
+    Returns the trigger metadata common to the events of a batch (cardinality many).
+    """
+    from azure.functions.meta import Datum
+
+    return {
+        "PropertiesArray": Datum(json.dumps([_properties(event) for event in events]), "json"),
+        "SystemPropertiesArray": Datum(json.dumps([_system_properties(event) for event in events]), "json"),
+        "PartitionContext": Datum(json.dumps(_partition_context(partition_context)), "json"),
+    }
+
+
+def _properties(event):
+    return {
+        key.decode("utf-8"): value.decode("utf-8") if isinstance(value, bytes) else value
+        for key, value in (event.properties or {}).items()
+    }
+
+
+def _system_properties(event):
+    return {
+        "SequenceNumber": event.sequence_number,
+        "Offset": event.offset,
+        "EnqueuedTimeUtc": event.enqueued_time.isoformat(),
+        "PartitionKey": event.partition_key.decode("utf-8") if event.partition_key else None,
+    }
+
+
+def _partition_context(partition_context):
+    return {
+        "EventHubName": partition_context.eventhub_name,
+        "ConsumerGroup": partition_context.consumer_group,
+        "PartitionId": partition_context.partition_id,
+    }
+
+
+def start_function_consumers(module, namespace, recorder):
+    """
+    Starts a consumer, in its own thread, for each Event Hub trigger of a function app.
+    The latency of the records of an event is recorded once the function returns.
+
+    Args:
+        module (module): The function app module.
+        namespace (LocalEventHubNamespace): The local Event Hubs.
+        recorder (LatencyRecorder): The recorder of the latencies.
+
+    Returns:
+        list: The (consumer, thread) of each trigger.
+    """
+    from azure.functions.decorators.core import Cardinality
+
+    from src.Ingestion.event_encoding import decode_event
+
+    consumers = []
+    for function in module.app.get_functions():
+        trigger = function.get_trigger()
+        name = function.get_function_name()
+        user_function = function.get_user_function()
+        consumer = namespace.consumer(trigger.event_hub_name, trigger.consumer_group or "$Default")
+
+        def handle(name, user_function, events, argument):
+            keys = [record_key(record) for event in events for record in decode_event(event)]
+            try:
+                user_function(argument)
+            except Exception:
+                recorder.fail(name)
+                return
+            recorder.record(name, keys)
+
+        if trigger.cardinality == Cardinality.MANY:
+
+            def on_event_batch(partition_context, events, name=name, user_function=user_function):
+                metadata = batch_metadata(events, partition_context)
+                argument = [function_event(event, partition_context, metadata) for event in events]
+                handle(name, user_function, events, argument)
+
+            target = lambda consumer=consumer, on_event_batch=on_event_batch: consumer.receive_batch(
+                on_event_batch, starting_position="-1"
+            )
+        else:
+
+            def on_event(partition_context, event, name=name, user_function=user_function):
+                handle(name, user_function, [event], function_event(event, partition_context))
+
+            target = lambda consumer=consumer, on_event=on_event: consumer.receive(on_event, starting_position="-1")
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        consumers.append((consumer, thread))
+    return consumers
+
+
+class AlertStage:
+    """
+    Stands in for the Databricks notebook: compares the readings with the thresholds of the Redis cache, and sends
+    the high and low readings and the lost connections to the Event Hubs read by TelegramAlerts.
+
+    Attributes:
+        alerts_sent (int): The number of alerts sent.
+    """
+
+    def __init__(self, namespace, redis):
+        """
+        Args:
+            namespace (LocalEventHubNamespace): The local Event Hubs.
+            redis (LocalRedis): The Redis stand-in with the user and device hashes.
+        """
+        self.namespace = namespace
+        self.redis = redis
+        self.alerts_sent = 0
+
+    def _send(self, eventhub_name, alert, partition_key):
+        from azure.eventhub import EventData
+
+        self.namespace.hub(eventhub_name).append([EventData(json.dumps(alert))], partition_key=str(partition_key))
+        self.alerts_sent += 1
+
+    def on_readings(self, partition_context, events):
+        from src.Ingestion.event_encoding import decode_event
+
+        for event in events:
+            for reading in decode_event(event):
+                patient = self.redis.hgetall(f"user:{reading['user_id']}")
+                alert = {
+                    "user_id": reading["user_id"],
+                    "device_id": reading["device_id"],
+                    "patient_name": patient.get("patient_name"),
+                    "final_df_timestamp": reading["timestamp"],
+                    "glucose_reading": reading["glucose_reading"],
+                }
+                if patient and reading["glucose_reading"] > float(patient["max_glucose"]):
+                    alert["max_glucose"] = int(float(patient["max_glucose"]))
+                    self._send("above_max_glucose_threshold", alert, reading["user_id"])
+                elif patient and reading["glucose_reading"] < float(patient["min_glucose"]):
+                    alert["min_glucose"] = int(float(patient["min_glucose"]))
+                    self._send("below_min_glucose_threshold", alert, reading["user_id"])
+
+    def on_device_feeds(self, partition_context, events):
+        from src.Ingestion.event_encoding import decode_event
+
+        for event in events:
+            for report in decode_event(event):
+                if report["connection_status"] != "Disconnected":
+                    continue
+                device = self.redis.hgetall(f"device:{report['device_id']}")
+                alert = {
+                    "device_id": report["device_id"],
+                    "timestamp": report["timestamp"],
+                    "battery_level": report["battery_level"],
+                    "connection_status": report["connection_status"],
+                    "error_code": report["error_code"],
+                    "owner_name": device.get("owner_name"),
+                    "manufacturer_name": device.get("manufacturer_name"),
+                }
+                self._send("device_error", alert, report["device_id"])
+
+    def start(self):
+        """
+        Starts reading the raw Event Hubs in background threads.
+
+        Returns:
+            list: The (consumer, thread) of each raw Event Hub.
+        """
+        consumers = []
+        for eventhub_name, on_event_batch in ((METRIC_HUB, self.on_readings), (DEVICE_HUB, self.on_device_feeds)):
+            consumer = self.namespace.consumer(eventhub_name, "spark")
+            thread = threading.Thread(
+                target=consumer.receive_batch, args=(on_event_batch,), kwargs={"starting_position": "-1"}, daemon=True
+            )
+            thread.start()
+            consumers.append((consumer, thread))
+        return consumers
+
+
+def run_load_test(
+    rounds=20,
+    interval=0.5,
+    users=200,
+    seed=0,
+    encoding="json",
+    partition_count=4,
+    send_latency=0.0,
+    use_mysql=False,
+    timeout=120,
+):
+    """
+    Runs the pipeline end to end on local Event Hubs and returns its throughput and latencies.
+
+    Args:
+        rounds (int, optional): The number of times generate_data of Data_Generation.py is called. Defaults to 20.
+        interval (float, optional): The time between two rounds, in seconds. Defaults to 0.5.
+        users (int, optional): The number of synthetic users (and devices). Defaults to 200.
+        seed (int, optional): The seed of the synthetic data and of the simulation. Defaults to 0.
+        encoding (str, optional): The encoding of the events sent by sensor.py, 'json' or 'arrow-zstd'. Defaults to 'json'.
+        partition_count (int, optional): The number of partitions of each Event Hub. Defaults to 4.
+        send_latency (float, optional): The time each batch takes to be sent, in seconds. Defaults to 0.
+        use_mysql (bool, optional): Whether DatabaseInserts writes to the MySQL database of the .env. Defaults to False.
+        timeout (float, optional): How long to wait for the records to be handled after the last round, in seconds.
+            Defaults to 120.
+
+    Returns:
+        dict: The results.
+    """
+    # The registry is built at import time from the configured source
+    os.environ["SIMULATION_DATA_SOURCE"] = "synthetic"
+    os.environ["SIMULATION_SYNTHETIC_USERS"] = str(users)
+    os.environ["SIMULATION_SEED"] = str(seed)
+
+    import Data_Generation
+    import sensor
+    from src.Ingestion.pipeline import IngestionPipeline
+    from src.Simulation.data_initialization_config import registry
+    from src.Simulation.output_sinks import JsonlFileSink
+    from src.Testing_Pipeline.local_event_hub import LocalEventHubNamespace
+    from src.Testing_Pipeline.local_stores import LocalDatabase, LocalRedis
+
+    work_dir = tempfile.mkdtemp(prefix="pipeline_load_test_")
+    paths = [os.path.join(work_dir, "monitoring", feed) for feed in ("metric_feed", "device_feed")]
+    for path in paths:
+        os.makedirs(path)
+
+    namespace = LocalEventHubNamespace(partition_count=partition_count, send_latency=send_latency)
+    sink = TimedSink(JsonlFileSink(), work_dir)
+    recorder = LatencyRecorder(sink.written)
+
+    database = None
+    database_inserts = load_function_app("DatabaseInserts")
+    if not use_mysql:
+        database = LocalDatabase(os.path.join(work_dir, "glucose.db"))
+        database_inserts.get_db_connection = database.connect
+
+    telegram_messages = []
+    telegram_alerts = load_function_app("TelegramAlerts")
+    telegram_alerts.send_telegram_message = lambda bot_token, chat_id, message: telegram_messages.append(message)
+
+    redis = LocalRedis()
+    redis.fill_from_registry(registry)
+    alert_stage = AlertStage(namespace, redis)
+
+    consumers = start_function_consumers(database_inserts, namespace, recorder)
+    consumers += start_function_consumers(telegram_alerts, namespace, recorder)
+    consumers += alert_stage.start()
+
+    pipeline = IngestionPipeline(
+        {"metric_feed": namespace.producer(METRIC_HUB), "device_feed": namespace.producer(DEVICE_HUB)},
+        key_fields=sensor.partition_key_fields,
+        encoding=encoding,
+        after_send="delete",
+    )
+    pipeline.start()
+    observer, event_handlers = sensor.create_observer(paths, pipeline)
+
+    Data_Generation.start_simulation(seed=seed, output_sink=sink)
+    start = time.time()
+    for _ in range(rounds):
+        Data_Generation.generate_data()
+        time.sleep(interval)
+    generated = time.time() - start
+
+    # Waiting until DatabaseInserts handled every record and TelegramAlerts every alert sent
+    expected = {
+        "glucose_readings_table_insert": sink.counts["metric_feed"],
+        "device_feed_table_insert": sink.counts["device_feed"],
+    }
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        handled = all(recorder.count(name) + recorder.errors[name] >= count for name, count in expected.items())
+        if handled and len(telegram_messages) >= alert_stage.alerts_sent:
+            break
+        time.sleep(0.1)
+
+    sensor.stop_observer(observer, event_handlers)
+    pipeline.stop()
+    for consumer, thread in consumers:
+        consumer.close()
+        thread.join()
+
+    elapsed = (recorder.last_handled or time.time()) - start
+    handled_records = sum(recorder.count(name) for name in expected)
+    results = {
+        "encoding": encoding,
+        "users": users,
+        "rounds": rounds,
+        "records_written": dict(sink.counts),
+        "events_sent": {hub: namespace.hub(hub).event_count() for hub in (METRIC_HUB, DEVICE_HUB)},
+        "generation_seconds": generated,
+        "seconds": elapsed,
+        "records_per_sec": handled_records / elapsed if elapsed > 0 else None,
+        "alerts_sent": alert_stage.alerts_sent,
+        "telegram_messages": len(telegram_messages),
+        "functions": {
+            name: {
+                "records": len(latencies),
+                "errors": recorder.errors[name],
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            }
+            for name, latencies in recorder.latencies.items()
+            if latencies
+        },
+    }
+    if database is not None:
+        results["rows"] = {table: database.count(table) for table in ("glucose_reading", "device_feed")}
+        results["database_connections"] = database.connection_count
+    return results
+
+
+def print_results(results):
+    """
+    Prints the results as a table.
+
+    Args:
+        results (dict): The results of run_load_test.
+    """
+    print(
+        f"{results['encoding']}: {sum(results['records_written'].values())} records written, "
+        f"{sum(results['events_sent'].values())} events sent, {results['records_per_sec'] or 0:.0f} records/s "
+        f"end to end over {results['seconds']:.1f} s"
+    )
+    print(f"{'function':<36} {'records':>9} {'errors':>7} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for name, function in results["functions"].items():
+        print(
+            f"{name:<36} {function['records']:>9} {function['errors']:>7} "
+            f"{function['p50_ms']:>10.1f} {function['p99_ms']:>10.1f}"
+        )
+    print(f"{results['alerts_sent']} alerts sent, {results['telegram_messages']} Telegram messages formatted")
+    if "rows" in results:
+        print(f"Rows inserted: {results['rows']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the streaming pipeline end to end on local Event Hubs.")
+    parser.add_argument("--rounds", type=int, default=20, help="Number of rounds of generate_data of Data_Generation.py")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between two rounds")
+    parser.add_argument("--users", type=int, default=200, help="Number of synthetic users")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and of the simulation")
+    parser.add_argument("--encoding", choices=["json", "arrow-zstd"], default="json", help="Encoding of the events")
+    parser.add_argument("--partitions", type=int, default=4, help="Number of partitions of each Event Hub")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="Seconds each batch takes to be sent")
+    parser.add_argument("--mysql", action="store_true", help="Insert into the MySQL database of the .env instead of SQLite")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the records after the last round")
+    parser.add_argument("--output", default=None, help="Path of the JSON results")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of sensor.py and of the functions")
+    args = parser.parse_args()
+
+    # sensor.py and the functions print a line per file and per event
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+        results = run_load_test(
+            rounds=args.rounds,
+            interval=args.interval,
+            users=args.users,
+            seed=args.seed,
+            encoding=args.encoding,
+            partition_count=args.partitions,
+            send_latency=args.send_latency,
+            use_mysql=args.mysql,
+            timeout=args.timeout,
+        )
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {"python": platform.python_version(), "created_at": datetime.datetime.now().isoformat(), "results": results},
+                file,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
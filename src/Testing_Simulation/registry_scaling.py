@@ -0,0 +1,143 @@
+"""
+The script is used to check that building and querying the patient registry scales linearly with the number of users.
+
+It builds the registry from synthetic query results (no database needed) for fleets of 200 to 200k users
+and times the lookups done by the generators for every user: thresholds, interval and device metadata.
+It then times the generation of the records of the fleet by the simulation engine for a few simulated minutes,
+in a separate process as the generators use the registry built at import time from the configured source.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parents[2]
+sys.path.append(str(root_dir))
+
+from src.Simulation.patient_registry import PatientRegistry
+from src.Simulation.Thresholds_Retreiving import synthetic_results
+
+firmware_data = [
+    {"name": "FirmwareA", "version": "1.0.0"},
+    {"name": "FirmwareB", "version": "2.1.0"},
+]
+
+
+def time_registry(user_count):
+    """
+    Time the construction of the registry and one round of lookups for every user.
+
+    Args:
+        user_count (int): The number of users.
+
+    Returns:
+        tuple: The build time and the lookup time in seconds.
+    """
+    results = synthetic_results(user_count)
+
+    start = time.perf_counter()
+    registry = PatientRegistry(*results, firmware_data)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for patient in registry.patients:
+        registry.threshold(patient["user_id"])
+        registry.intervals[patient["user_id"]]
+        registry.device(patient["device_id"])["firmware_info"]
+    lookup_time = time.perf_counter() - start
+
+    return build_time, lookup_time
+
+
+def generate_fleet(user_count, duration):
+    """
+    Time the generation of the device and metric records of a synthetic fleet by the simulation engine.
+    Must run in a fresh process.
+
+    Args:
+        user_count (int): The number of users.
+        duration (int): The simulated duration in minutes.
+
+    Returns:
+        dict: The number of records generated and the generation time in seconds.
+    """
+    # The registry is built at import time from the configured source
+    os.environ["SIMULATION_DATA_SOURCE"] = "synthetic"
+    os.environ["SIMULATION_SYNTHETIC_USERS"] = str(user_count)
+    os.environ["SIMULATION_SEED"] = "0"
+
+    from src.Simulation.simulation_engine import SimulationEngine
+
+    simulation = SimulationEngine(duration=duration, start_time=datetime.datetime(2024, 6, 1), vectorized=True, seed=0)
+
+    start = time.perf_counter()
+    record_count = sum(1 for _ in simulation.events())
+    generation_time = time.perf_counter() - start
+
+    return {"records": record_count, "seconds": generation_time}
+
+
+def time_generation(user_count, duration):
+    """
+    Time the generation of the records of a fleet in its own process.
+
+    Args:
+        user_count (int): The number of users.
+        duration (int): The simulated duration in minutes.
+
+    Returns:
+        tuple: The number of records generated and the generation time in seconds.
+    """
+    completed = subprocess.run(
+        [sys.executable, __file__, "--fleet", str(user_count), "--duration", str(duration)],
+        cwd=root_dir,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    results = json.loads(completed.stdout.decode("utf-8").splitlines()[-1])
+    return results["records"], results["seconds"]
+
+
+def main(user_counts, duration):
+    """
+    Print the build, lookup and generation times for each fleet size, with the time per user and per record.
+
+    Args:
+        user_counts (list): The fleet sizes to time.
+        duration (int): The simulated duration of the generation pass in minutes.
+    """
+    print(
+        f"{'users':>10} {'build (s)':>12} {'lookups (s)':>12} {'us/user':>10} "
+        f"{'records':>10} {'generation (s)':>15} {'us/record':>10}"
+    )
+    for user_count in user_counts:
+        build_time, lookup_time = time_registry(user_count)
+        per_user = (build_time + lookup_time) / user_count * 1e6
+        record_count, generation_time = time_generation(user_count, duration)
+        per_record = generation_time / record_count * 1e6 if record_count else 0
+        print(
+            f"{user_count:>10} {build_time:>12.4f} {lookup_time:>12.4f} {per_user:>10.2f} "
+            f"{record_count:>10} {generation_time:>15.4f} {per_record:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the scaling of the patient registry.")
+    parser.add_argument(
+        "--users", type=int, nargs="+", default=[200, 2000, 20000, 200000], help="Fleet sizes to time"
+    )
+    parser.add_argument(
+        "--duration", type=int, default=5, help="Simulated minutes of the record generation pass"
+    )
+    parser.add_argument("--fleet", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fleet is not None:
+        # Child process generating the records of a single fleet size, the results are the last line of its output
+        print(json.dumps(generate_fleet(args.fleet, args.duration)))
+    else:
+        main(args.users, args.duration)
@@ -0,0 +1,209 @@
+"""
+The script benchmarks the simulation at several fleet sizes without a database.
+
+The simulation runs against the synthetic results of Thresholds_Retreiving.py.
+For each fleet size, in a separate process so the peak memory is measured per fleet size, it times:
+- generate_device_record and generate_metric_record called directly,
+- the simulation engine, in scalar and vectorized mode,
+- the JSON serialization of the records,
+- new_dataset, i.e. serialization, temporary file and move into the output directory.
+
+The records per second, time and peak RSS of each stage are printed and can be written as JSON with --output,
+to compare the results of two versions of the generators.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).resolve().parents[2]
+sys.path.append(str(root_dir))
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def run_stage(results, name, stage):
+    """
+    Runs a stage, timing it, and adds its results.
+
+    Args:
+        results (dict): The results of the fleet size, the stage is added to results["stages"].
+        name (str): The name of the stage.
+        stage (function): The stage, returning the number of records it processed.
+    """
+    start = time.perf_counter()
+    record_count = stage()
+    elapsed = time.perf_counter() - start
+
+    results["stages"][name] = {
+        "records": record_count,
+        "seconds": elapsed,
+        "records_per_sec": record_count / elapsed if elapsed > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def benchmark_fleet(user_count, duration, seed):
+    """
+    Benchmarks the simulation for one fleet size. Must run in a fresh process.
+
+    Args:
+        user_count (int): The number of users (and devices).
+        duration (int): The simulated duration in minutes.
+        seed (int): The seed of the synthetic results and of the simulation.
+
+    Returns:
+        dict: The results of every stage.
+    """
+    # The registry is built at import time from the configured source
+    os.environ["SIMULATION_DATA_SOURCE"] = "synthetic"
+    os.environ["SIMULATION_SYNTHETIC_USERS"] = str(user_count)
+    os.environ["SIMULATION_SEED"] = str(seed)
+
+    import random
+
+    from Data_Generation import new_dataset
+    from src.Simulation.data_initialization_config import registry
+    from src.Simulation.device_data_generator import generate_device_record
+    from src.Simulation.disconnection_index import DisconnectionIndex
+    from src.Simulation.patient_data_generator import generate_metric_record
+    from src.Simulation.records import to_dict
+    from src.Simulation.simulation_engine import SimulationEngine
+    from src.Simulation.user_behaviour import user_behaviors
+
+    random.seed(seed)
+    start_time = datetime.datetime(2024, 6, 1)
+    results = {"users": user_count, "duration": duration, "seed": seed, "stages": {}}
+    records = []
+
+    def device_records():
+        disconnection_periods = DisconnectionIndex()
+        for device in registry.devices:
+            generate_device_record(device["device_id"], start_time, disconnection_periods)
+        return len(registry.devices)
+
+    def metric_records():
+        disconnection_periods = DisconnectionIndex()
+        coordinates = {}
+        for patient in registry.patients:
+            generate_metric_record(patient, start_time, disconnection_periods, user_behaviors, coordinates=coordinates)
+        return len(registry.patients)
+
+    def engine(vectorized):
+        def run():
+            simulation = SimulationEngine(duration=duration, start_time=start_time, vectorized=vectorized, seed=seed)
+            records[:] = [record for _, record in simulation.events()]
+            return len(records)
+
+        return run
+
+    def serialization():
+        for record in records:
+            json.dumps(to_dict(record))
+        return len(records)
+
+    def file_handoff():
+        with tempfile.TemporaryDirectory() as output_dir:
+            stream = iter(records)
+            file_seq = 0
+            while True:
+                next_file_seq = new_dataset(
+                    file_seq,
+                    record_count=800,
+                    generate_record_func=generate_metric_record,
+                    output_dir=output_dir,
+                    data_source=stream,
+                    file_prefix="benchmark_",
+                )
+                if next_file_seq == file_seq:
+                    break
+                file_seq = next_file_seq
+        return len(records)
+
+    run_stage(results, "generate_device_record", device_records)
+    run_stage(results, "generate_metric_record", metric_records)
+    run_stage(results, "engine_vectorized", engine(vectorized=True))
+    run_stage(results, "engine_scalar", engine(vectorized=False))
+    run_stage(results, "serialization", serialization)
+    run_stage(results, "new_dataset", file_handoff)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    return results
+
+
+def print_results(all_results):
+    """
+    Prints the results as a table.
+
+    Args:
+        all_results (list): The results of every fleet size.
+    """
+    print(f"{'users':>8} {'stage':<24} {'records':>10} {'seconds':>9} {'records/s':>12} {'peak RSS (MB)':>14}")
+    for results in all_results:
+        for name, stage in results["stages"].items():
+            print(
+                f"{results['users']:>8} {name:<24} {stage['records']:>10} {stage['seconds']:>9.3f} "
+                f"{stage['records_per_sec'] or 0:>12.0f} {stage['peak_rss_mb']:>14.1f}"
+            )
+
+
+def main(user_counts, duration, seed, output):
+    """
+    Benchmarks every fleet size in its own process, prints the results and writes them as JSON.
+
+    Args:
+        user_counts (list): The fleet sizes.
+        duration (int): The simulated duration in minutes.
+        seed (int): The seed of the synthetic results and of the simulation.
+        output (str): The path of the JSON results, None to only print them.
+    """
+    all_results = []
+    for user_count in user_counts:
+        completed = subprocess.run(
+            [sys.executable, __file__, "--fleet", str(user_count), "--duration", str(duration), "--seed", str(seed)],
+            cwd=root_dir,
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        all_results.append(json.loads(completed.stdout.decode("utf-8").splitlines()[-1]))
+
+    print_results(all_results)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(
+                {"python": platform.python_version(), "created_at": datetime.datetime.now().isoformat(), "results": all_results},
+                file,
+                indent=2,
+            )
+        print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulation at several fleet sizes.")
+    parser.add_argument("--users", type=int, nargs="+", default=[200, 2000, 20000], help="Fleet sizes to benchmark")
+    parser.add_argument("--duration", type=int, default=30, help="Simulated duration in minutes")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and of the simulation")
+    parser.add_argument("--output", default=None, help="Path of the JSON results")
+    parser.add_argument("--fleet", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fleet is not None:
+        # Child process benchmarking a single fleet size, the results are the last line of its output
+        print(json.dumps(benchmark_fleet(args.fleet, args.duration, args.seed)))
+    else:
+        main(args.users, args.duration, args.seed, args.output)